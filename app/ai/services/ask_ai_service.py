@@ -1,26 +1,57 @@
-import os
 from utils.logger import Logger
 from ai.services.rag_service import VectorDBManager
+from utils.concurrency import backend_limit
+from utils.metrics import span
 from utils.openai_client import ChatGPTClient
+from utils.storage import DocumentScope
 import json
 import openai
-from ollama import Client
 from pydantic import BaseModel
-from utils.ollama import ChatOllama
 
 class Response(BaseModel):
     answer: str
 
 
 class AskAIService:
-    def __init__(self, collection_name: str):
-        self.vector_db_manager = VectorDBManager(collection_name=collection_name)
-        self.openai_manager = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        self.ollama_client = ChatOllama(host='http://localhost:11434')
+    def __init__(self, collection_name: str = None, scope: DocumentScope = None):
+        self.vector_db_manager = VectorDBManager(scope=scope or DocumentScope(collection_name))
+        self.ollama_client = self.vector_db_manager.registry.ollama
         self.logger = Logger("AskAIService")
 
-    def local_model(self, request: str, chat_history: list[dict] = None):
-        context = " ".join(self.vector_db_manager.collection.query(query_texts=request, n_results=20)["documents"][0])
+    @property
+    def openai_manager(self):
+        # Built on first use, so deployments without an OpenAI key can still chat through Ollama.
+        return self.vector_db_manager.registry.openai.async_client
+
+    async def local_model(self, request: str, chat_history: list[dict] = None, retrieval_mode: str = None):
+        messages = await self.build_chat_messages(
+            request=request, chat_history=chat_history, retrieval_mode=retrieval_mode
+        )
+        try:
+            response = await self.ollama_client.agenerate_response(
+                messages=messages, format=Response.model_json_schema(), budget="chat"
+            )
+            return json.loads(response)['answer']
+        except ConnectionError as e:
+            self.logger.error("Connection error occurred: %s", e)
+            return f"ConnectionError: {e}"
+        except ValueError as e:
+            self.logger.error("Invalid parameter error: %s", e)
+            return f"ValueError: {e}"
+        except Exception as e:
+            self.logger.error("An unexpected error occurred: %s", e)
+            return f"Exception: {e}"
+
+    async def stream_local_model(self, request: str, chat_history: list[dict] = None, retrieval_mode: str = None):
+        """Yield chat answer tokens as they are generated (plain text, including any reasoning)."""
+        messages = await self.build_chat_messages(
+            request=request, chat_history=chat_history, retrieval_mode=retrieval_mode
+        )
+        async for token in self.ollama_client.astream_response(messages=messages, budget="chat"):
+            yield token
+
+    async def build_chat_messages(self, request: str, chat_history: list[dict] = None, retrieval_mode: str = None):
+        context = (await self.vector_db_manager.aretrieve_context(request, mode=retrieval_mode)).text
         system_prompt = {
             "role": "system",
             "content": """
@@ -71,27 +102,11 @@ class AskAIService:
         if chat_history:
             messages.extend(chat_history)
         messages.append(human_prompt)
-
-        try:
-            response = self.ollama_client.generate_response(messages=messages, format=Response.model_json_schema())
-            return json.loads(response.message.content)['answer']
-        except ConnectionError as e:
-            self.logger.error(f"Connection error occurred: {e}")
-            return f"ConnectionError: {e}"
-        except ValueError as e:
-            self.logger.error(f"Invalid parameter error: {e}")
-            return f"ValueError: {e}"
-        except Exception as e:
-            self.logger.error(f"An unexpected error occurred: {e}")
-            return f"Exception: {e}"
+        return messages
 
 
-    def generate_response(self, request: str, chat_history: list[dict] = None):
-        context = " ".join(
-            self.vector_db_manager.collection.query(query_texts=request, n_results=20)[
-                "documents"
-            ][0]
-        )
+    async def generate_response(self, request: str, chat_history: list[dict] = None):
+        context = (await self.vector_db_manager.aretrieve_context(request)).text
         system_prompt = {
             "role": "system",
             "content": """
@@ -160,18 +175,21 @@ class AskAIService:
             },
         }
         try:
-            response = self.openai_manager.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                response_format=response_format,
-                temperature=0.5,
-                max_tokens=1000,
-            )
+            async with backend_limit("openai"):
+                with span("openai"):
+                    response = await self.openai_manager.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=messages,
+                        response_format=response_format,
+                        temperature=0.5,
+                        max_tokens=1000,
+                    )
+            ChatGPTClient.record_usage(response)
             return json.loads(response.choices[0].message.content)["ai_reply"]
         except openai.APIConnectionError as e:
-            self.logger.error(f"The server could not be reached: {e.__cause__}")
+            self.logger.error("The server could not be reached: %s", e.__cause__)
         except openai.RateLimitError as e:
-            self.logger.error(f"A 429 status code was received; we should back off a bit.")
+            self.logger.error("A 429 status code was received; we should back off a bit.")
         except openai.APIStatusError as e:
-            self.logger.error(f"Another non-200-range status code({e.status_code}) was received: {e.response}")
+            self.logger.error("Another non-200-range status code(%s) was received: %s", e.status_code, e.response)
         return ""
@@ -0,0 +1,83 @@
+from dataclasses import dataclass, field
+from typing import List, Sequence
+
+import numpy as np
+
+from utils import settings
+from utils.tokens import estimate_tokens
+
+
+@dataclass
+class BuiltContext:
+    text: str
+    chunks: List[str] = field(default_factory=list)
+    tokens: int = 0
+    candidates: int = 0
+    duplicates: int = 0
+
+
+class ContextBuilder:
+    """Selects retrieved chunks for a prompt.
+
+    Chunks are picked greedily by maximal marginal relevance (relevance from the
+    query distance, redundancy from chunk-to-chunk cosine similarity), near
+    duplicates of already selected chunks are dropped, and selection stops
+    adding chunks once the token budget is used up.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = settings.CONTEXT_TOKEN_BUDGET,
+        mmr_lambda: float = settings.CONTEXT_MMR_LAMBDA,
+        duplicate_threshold: float = settings.CONTEXT_DUPLICATE_THRESHOLD,
+        max_distance: float = settings.CONTEXT_MAX_DISTANCE,
+        separator: str = "\n\n",
+    ):
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+        self.max_distance = max_distance
+        self.separator = separator
+
+    def build(self, documents: Sequence[str], embeddings, distances: Sequence[float]) -> BuiltContext:
+        candidates = len(documents)
+        if not candidates:
+            return BuiltContext(text="")
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        similarity = vectors @ vectors.T
+        relevance = 1.0 - np.asarray(distances, dtype=np.float32)
+        tokens = np.array([estimate_tokens(document) for document in documents])
+
+        available = np.asarray(distances) <= self.max_distance
+        redundancy = np.full(candidates, -np.inf, dtype=np.float32)
+        remaining_budget = self.token_budget
+        selected = []
+        duplicates = 0
+
+        while available.any():
+            scores = np.where(
+                available,
+                self.mmr_lambda * relevance - (1.0 - self.mmr_lambda) * np.maximum(redundancy, 0.0),
+                -np.inf,
+            )
+            best = int(np.argmax(scores))
+            available[best] = False
+            if tokens[best] > remaining_budget:
+                continue
+            selected.append(best)
+            remaining_budget -= tokens[best]
+            redundancy = np.maximum(redundancy, similarity[best])
+            duplicate = available & (similarity[best] >= self.duplicate_threshold)
+            duplicates += int(duplicate.sum())
+            available &= ~duplicate
+
+        chunks = [documents[i] for i in selected]
+        return BuiltContext(
+            text=self.separator.join(chunks),
+            chunks=chunks,
+            tokens=self.token_budget - remaining_budget,
+            candidates=candidates,
+            duplicates=duplicates,
+        )
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import time
+from typing import Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+from utils import settings
+from utils.concurrency import run_blocking
+from utils.db_helper import (
+    get_chat_history,
+    get_chat_summary,
+    get_messages_after,
+    get_messages_to_summarize,
+    save_chat_summary,
+)
+from utils.logger import Logger
+from utils.registry import get_registry
+from utils.tokens import estimate_tokens
+
+SUMMARY_PROMPT = """
+    You maintain the running summary of a conversation between a student and an AI study assistant.
+    You will be given the current summary (possibly empty) and the messages that followed it, in order.
+    Return an updated summary that:
+        1. Keeps the student's goals, questions, answers given, facts established and open points.
+        2. Drops small talk and anything repeated.
+        3. Stays under 200 words, written in the third person.
+"""
+
+
+class Summary(BaseModel):
+    summary: str
+
+
+class ConversationMemory:
+    """Chat history sent to the model on /api/ai_chat.
+
+    In "summary" mode the prompt gets the last `recent_turns` turns verbatim
+    plus a running summary of everything before them, so its size stays flat
+    however long the conversation gets. After each turn `schedule_update`
+    folds messages that left the verbatim window into the summary in the
+    background; the summary is stored in `chat_summaries` next to the
+    messages. Every message after the summary is sent verbatim, so when the
+    summary falls behind (a slow or failing model) more of the conversation
+    is sent verbatim; once that exceeds CHAT_HISTORY_MAX_MESSAGES /
+    CHAT_HISTORY_MAX_TOKENS, the window below is sent instead. In "window" mode
+    only the last messages are sent, bounded by those same limits.
+    """
+
+    def __init__(
+        self,
+        mode: str = settings.CHAT_MEMORY_MODE,
+        recent_turns: int = settings.CHAT_MEMORY_RECENT_TURNS,
+        batch_messages: int = settings.CHAT_SUMMARY_BATCH_MESSAGES,
+    ):
+        if mode not in ("summary", "window"):
+            raise ValueError(f"Unknown chat memory mode: {mode}")
+        self.mode = mode
+        self.recent_turns = recent_turns
+        self.batch_messages = batch_messages
+        # One update task per conversation; a turn finishing while it runs marks it to run again.
+        self._tasks: Dict[Tuple[str, Optional[str]], asyncio.Task] = {}
+        self._rerun = set()
+        self.updates = 0
+        self.failures = 0
+        self.fallbacks = 0
+        self.logger = Logger("ConversationMemory")
+
+    async def history(self, user_id: str, document_id: Optional[str] = None) -> list[dict]:
+        """Model-ready messages standing for the conversation so far, oldest first."""
+        if self.mode == "window":
+            return await self._window(user_id, document_id)
+        state = await run_blocking(get_chat_summary, user_id, document_id, backend="sqlite")
+        summary, last_message_id = (state["summary"], state["last_message_id"]) if state else ("", 0)
+        # Everything the summary does not cover yet, or a sign there is more than the window allows.
+        unsummarized = await run_blocking(
+            get_messages_after,
+            user_id,
+            document_id,
+            after_id=last_message_id,
+            limit=settings.CHAT_HISTORY_MAX_MESSAGES + 1,
+            backend="sqlite",
+        )
+        summary_message = (
+            [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}] if summary else []
+        )
+        if (
+            len(unsummarized) > settings.CHAT_HISTORY_MAX_MESSAGES
+            or sum(estimate_tokens(m["content"]) for m in summary_message + unsummarized)
+            > settings.CHAT_HISTORY_MAX_TOKENS
+        ):
+            # The summary is too far behind for summary plus everything after it to fit.
+            self.fallbacks += 1
+            return await self._window(user_id, document_id)
+        return summary_message + [{"role": m["role"], "content": m["content"]} for m in unsummarized]
+
+    async def _window(self, user_id: str, document_id: Optional[str]) -> list[dict]:
+        return await run_blocking(
+            get_chat_history,
+            user_id=user_id,
+            document_id=document_id,
+            max_messages=settings.CHAT_HISTORY_MAX_MESSAGES,
+            max_tokens=settings.CHAT_HISTORY_MAX_TOKENS,
+            backend="sqlite",
+        )
+
+    def schedule_update(self, user_id: str, document_id: Optional[str] = None) -> None:
+        """Update the conversation's summary in the background; needs a running event loop."""
+        if self.mode != "summary":
+            return
+        key = (user_id, document_id)
+        if key in self._tasks:
+            self._rerun.add(key)
+            return
+        self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def _run(self, key):
+        try:
+            while True:
+                self._rerun.discard(key)
+                try:
+                    await self.update(*key)
+                except Exception as e:
+                    self.failures += 1
+                    self.logger.error("Failed to update the summary of %s/%s: %s", *key, e)
+                if key not in self._rerun:
+                    break
+        finally:
+            self._tasks.pop(key, None)
+
+    async def update(self, user_id: str, document_id: Optional[str] = None) -> int:
+        """Fold every message older than the verbatim window into the summary; returns how many."""
+        folded = 0
+        while True:
+            state = await run_blocking(get_chat_summary, user_id, document_id, backend="sqlite")
+            summary, last_message_id = (state["summary"], state["last_message_id"]) if state else ("", 0)
+            messages = await run_blocking(
+                get_messages_to_summarize,
+                user_id,
+                document_id,
+                after_id=last_message_id,
+                keep_recent=2 * self.recent_turns,
+                limit=self.batch_messages,
+                backend="sqlite",
+            )
+            if not messages:
+                return folded
+            started = time.perf_counter()
+            summary = await self._summarize(summary, messages)
+            await run_blocking(save_chat_summary, user_id, document_id, summary, messages[-1]["id"], backend="sqlite")
+            folded += len(messages)
+            self.updates += 1
+            self.logger.info(
+                "Folded %d messages into the summary of %s/%s in %.1f ms",
+                len(messages),
+                user_id,
+                document_id,
+                (time.perf_counter() - started) * 1000,
+            )
+
+    async def _summarize(self, summary: str, messages: list[dict]) -> str:
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        response = await get_registry().ollama.agenerate_response(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"### Current summary:\n{summary or '(none)'}\n\n### New messages:\n{transcript}",
+                },
+            ],
+            format=Summary.model_json_schema(),
+            budget="chat_summary",
+        )
+        # Errors come back as text; failing to parse keeps the old summary and its position.
+        return json.loads(response)["summary"]
+
+    async def stop(self) -> None:
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "recent_turns": self.recent_turns,
+            "updating": len(self._tasks),
+            "updates": self.updates,
+            "failures": self.failures,
+            "window_fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import shutil
+import uuid
+
+from ai.services.rag_service import VectorDBManager, read_text_blocks
+from utils import settings
+from utils.concurrency import run_blocking
+from utils.db_helper import create_ingest_job, get_ingest_job, list_ingest_jobs, update_ingest_job
+from utils.logger import Logger
+from utils.storage import DocumentScope, stored_document_scope
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class IngestJobQueue:
+    """Background ingestion of documents by a bounded pool of workers.
+
+    Submitted content is spooled to disk and the job is recorded in SQLite, so
+    queued and interrupted jobs are picked up again by `start()` after a
+    restart. Chunk IDs are content hashes, so a resumed job skips the chunks an
+    earlier run already stored instead of embedding them again. The spooled
+    content of a failed job is kept for inspection.
+    """
+
+    def __init__(
+        self,
+        workers: int = settings.INGEST_WORKERS,
+        max_queued: int = settings.INGEST_QUEUE_SIZE,
+        spool_dir: str = settings.INGEST_SPOOL_DIR,
+    ):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.spool_dir = spool_dir
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self.logger = Logger("IngestJobQueue")
+
+    async def start(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        unfinished = await run_blocking(list_ingest_jobs, ["queued", "running"], backend="sqlite")
+        for job in unfinished:
+            self._queue.put_nowait(job["id"])
+        if unfinished:
+            self.logger.info("Resuming %d ingest jobs", len(unfinished))
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _spool(self, job_id: str, source) -> str:
+        path = os.path.join(self.spool_dir, f"{job_id}.txt")
+        with open(path, "wb") as spooled:
+            if isinstance(source, str):
+                spooled.write(source.encode("utf-8"))
+            else:
+                shutil.copyfileobj(source, spooled, settings.INGEST_READ_BLOCK_SIZE)
+        return path
+
+    async def submit(self, scope: DocumentScope, document_id: str, user_id: str, source) -> str:
+        """Queue a document for ingestion; `source` is the text or a binary file object."""
+        if self._queue.qsize() >= self.max_queued:
+            raise QueueFullError(f"Ingest queue is full ({self.max_queued} jobs waiting)")
+        job_id = uuid.uuid4().hex
+        path = await run_blocking(self._spool, job_id, source)
+        await run_blocking(
+            create_ingest_job,
+            job_id,
+            user_id=user_id,
+            document_id=document_id,
+            collection_name=scope.collection_name,
+            path=path,
+            bytes_total=os.path.getsize(path),
+            backend="sqlite",
+        )
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await run_blocking(self._run, job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id: str):
+        job = get_ingest_job(job_id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return
+        if not os.path.exists(job["path"]):
+            update_ingest_job(job_id, status="failed", error="Spooled document content is missing")
+            return
+        update_ingest_job(job_id, status="running", error=None)
+        try:
+            manager = VectorDBManager(
+                scope=stored_document_scope(job["collection_name"], job["user_id"], job["document_id"])
+            )
+            with open(job["path"], "rb") as source:
+
+                def on_progress(chunks_done):
+                    update_ingest_job(job_id, chunks_done=chunks_done, bytes_done=source.tell())
+
+                total = manager.add_document_stream(
+                    read_text_blocks(source),
+                    document_id=job["document_id"],
+                    user_id=job["user_id"],
+                    skip_existing=True,
+                    on_progress=on_progress,
+                )
+            update_ingest_job(job_id, status="done", chunks_done=total, bytes_done=job["bytes_total"])
+            self.logger.info("Ingest job %s finished: %d chunks", job_id, total)
+        except Exception as e:
+            self.logger.error("Ingest job %s failed: %s", job_id, e)
+            update_ingest_job(job_id, status="failed", error=str(e))
+            return
+        try:
+            os.remove(job["path"])
+        except OSError as e:
+            self.logger.warning("Could not remove spooled content of ingest job %s: %s", job_id, e)
@@ -1,146 +1,661 @@
+import codecs
+import contextvars
+import hashlib
 import json
-import chromadb
-import nltk
+import re
+import time
+import numpy as np
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from nltk.tokenize import sent_tokenize
-from utils.embedding import Embedding
+from ai.services.context_builder import BuiltContext, ContextBuilder
+from utils import settings
+from utils.concurrency import run_blocking
+from utils.db_helper import register_document
 from utils.logger import Logger
-from utils.openai_client import ChatGPTClient
-from ollama import Client
+from utils.metrics import span, timed
+from utils.nltk_resources import ensure_nltk_resources
+from utils.registry import get_registry
+from utils.singleflight import generation_flight, normalize_text, retrieval_flight
+from utils.storage import DocumentScope, lexical_group, user_scope_key
+from utils.bm25 import reciprocal_rank_fusion, tokenize
+from utils.tokens import estimate_tokens
+from utils.vector_store import query_collection
 from pydantic import BaseModel
-from utils.ollama import ChatOllama
+
+
+# Chunks stored before chunk_index metadata existed: "doc_<document>_chunk_<position>".
+LEGACY_CHUNK_ID = re.compile(r"_chunk_(\d+)$")
 
 
 class Response(BaseModel):
     answer: str
 
+
+def read_text_blocks(fileobj, block_size=settings.INGEST_READ_BLOCK_SIZE, encoding="utf-8"):
+    """Decode a binary file object into text blocks of about `block_size` bytes each."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    while True:
+        data = fileobj.read(block_size)
+        if not data:
+            break
+        text = decoder.decode(data)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+class ChunkOccurrences:
+    """Occurrence counts of chunk hashes, for the `occurrences` of `chunk_records`.
+
+    A `Counter` holds ~100 bytes per chunk for the whole ingestion. Here hashes
+    seen once are kept as sorted 64-bit arrays, merged as they grow so there are
+    only logarithmically many, and only repeated hashes keep a counter entry.
+    """
+
+    MERGE_AFTER = 1024
+
+    def __init__(self):
+        self._runs = []
+        self._recent = set()
+        self._repeated = Counter()
+
+    def _seen(self, key: int) -> bool:
+        if key in self._recent:
+            return True
+        for run in self._runs:
+            i = int(np.searchsorted(run, np.uint64(key)))
+            if i < len(run) and int(run[i]) == key:
+                return True
+        return False
+
+    def __getitem__(self, digest: str) -> int:
+        key = int(digest, 16)
+        if key in self._repeated:
+            return self._repeated[key]
+        return 1 if self._seen(key) else 0
+
+    def __setitem__(self, digest: str, count: int) -> None:
+        key = int(digest, 16)
+        if count > 1:
+            self._repeated[key] = count
+            return
+        self._recent.add(key)
+        if len(self._recent) >= self.MERGE_AFTER:
+            run = np.array(sorted(self._recent), dtype=np.uint64)
+            self._recent.clear()
+            while self._runs and len(self._runs[-1]) <= len(run):
+                run = np.union1d(self._runs.pop(), run)
+            self._runs.append(run)
+
+
+def answer_messages(context: str, request: str) -> list:
+    """System and user messages asking the model to answer `request` from retrieved `context`."""
+    system_prompt = {
+        "role": "system",
+        "content": """
+            "You are a knowledgeable assistant for the RAG system." 
+            "Your role is to help the student understand and engage with the provided study materials." 
+            "You will be given:"
+            "1. **Document Chunks**: Relevant excerpts from the study material retrieved from a vector database."
+            "2. **User's Request**: The current question or statement from the student."
+
+            "**Guidelines:**"
+                "- **Use Only Provided Information**:" 
+                    "Base your responses solely on the **Chat History** and **Document Chunks**." 
+                    "Do not incorporate any external knowledge or make assumptions beyond the given data."
+
+                "- **Be Clear and Concise**:" 
+                    "Provide explanations that are easy to understand, avoiding unnecessary jargon unless it is part" 
+                    "of the provided material."
+
+                "- **Maintain Context**: "
+                    "Ensure continuity by considering the **Chat History**. Your responses should build upon previous" 
+                    "interactions when relevant."
+
+                "- **Stay Relevant**:" 
+                    "Address the **User's Request** directly, ensuring that your response is pertinent and helpful."
+
+                "- **Format**:" 
+                    "Respond in a clear and organized manner, using bullet points or numbered lists if it enhances clarity."
+
+                "- **Be interactive with user and pretend to be a human**:" 
+                    "If the user asks you simple questions, for a small talk, you can play and interact like a users friend"
+                "- **Be flexible**"
+                    "If the user's question is about a general knowledge that is well known to everyone provide an answer"
+                     "on the user's question even if there is nothing mentioned in the provided context"
+                """,
+    }
+    human_prompt = {
+        "role": "user",
+        "content": f"""
+            "### Document Chunks:"
+                "{context}"
+            "### User's Request:"
+                "{request}"
+            """,
+    }
+    return [system_prompt, human_prompt]
+
+
 class VectorDBManager:
-    def __init__(self, db_path="./chroma_db", collection_name="study_room_vectors_v2"):
+    """Chunks of one document: ingestion, retrieval and answering.
+
+    Pass a `DocumentScope` (see `utils.storage.document_scope`) to address a
+    document in either storage layout; a bare `collection_name` is a
+    collection of its own, with no filtering.
+    """
+
+    def __init__(
+        self, db_path=settings.CHROMA_DB_PATH, collection_name="study_room_vectors_v2", scope: DocumentScope = None
+    ):
+        scope = scope or DocumentScope(collection_name)
+        collection_name = scope.collection_name
         self.db_path = db_path
+        self.scope = scope
         self.collection_name = collection_name
-        self.openai = ChatGPTClient()
-        self.client = chromadb.PersistentClient(path=self.db_path)
-        self.ollama_client = ChatOllama(host='http://localhost:11434')
-        self.embedding = Embedding()
-        self.collection = self.client.get_or_create_collection(
-            name=self.collection_name,
-            embedding_function=self.embedding.embedding_function,
-            metadata={"hnsw:space": "cosine"},
-        )
+        # Metadata filter selecting the document's chunks, and the key caches use for them.
+        self.where = scope.where
+        self.scope_key = scope.key
+        self.registry = get_registry(db_path)
+        self.client = self.registry.chroma_client
+        self.ollama_client = self.registry.ollama
+        self.embedding = self.registry.embedding
+        self.collection = self.registry.get_collection(collection_name)
+        self.layout = self.registry.get_vector_layout(collection_name)
         self.logger = Logger("VectorDBManager")
 
-        nltk.download("punkt", quiet=True)
-        nltk.download("punkt_tab", quiet=True)
-        nltk.download("wordnet", quiet=True)
-        nltk.download("omw-1.4", quiet=True)
-
+    @timed("embed")
     def get_embedding(self, content):
+        """Embed a list of texts with the configured backend, serving repeats from the cache."""
+        if isinstance(content, str):
+            content = [content]
         try:
-            response = self.openai.client.embeddings.create(
-                model="text-embedding-3-small", input=content
-            )
-            return response.data
+            return self.embedding.embed(content)
         except Exception as e:
-            self.logger.error(f"Error fetching embedding: {e}")
+            self.logger.error("Error fetching embedding: %s", e)
             return None
 
-    def create_chunks(self, sentences, max_chunk_length=800, similarity_threshold=0.8):
-        chunks = []
+    def iter_chunks(self, sentences, max_chunk_length=800):
         current_chunk = []
         current_length = 0
 
         for sentence in sentences:
             sentence_length = len(sentence)
             if current_length + sentence_length > max_chunk_length and current_chunk:
-                chunks.append(" ".join(current_chunk))
+                yield " ".join(current_chunk)
                 current_chunk = []
                 current_length = 0
             current_chunk.append(sentence)
             current_length += sentence_length
 
             if current_length >= max_chunk_length:
-                chunks.append(" ".join(current_chunk))
+                yield " ".join(current_chunk)
                 current_chunk = []
                 current_length = 0
 
         if current_chunk:
-            chunks.append(" ".join(current_chunk))
+            yield " ".join(current_chunk)
 
-        return chunks
+    def create_chunks(self, sentences, max_chunk_length=800, similarity_threshold=0.8):
+        return list(self.iter_chunks(sentences, max_chunk_length=max_chunk_length))
 
-    def add_document(self, content, document_id, user_id):
+    def split_document(self, content):
+        ensure_nltk_resources()
         sentences = sent_tokenize(content)
-        chunked_text = self.create_chunks(sentences, max_chunk_length=800)
-        chunk_embeddings = self.get_embedding(chunked_text)
-
-        for i, chunk in enumerate(chunked_text):
-            metadata = {"document_id": document_id, "user_id": user_id}
-            self.collection.add(
-                documents=[chunk],
-                embeddings=[chunk_embeddings[i].embedding],
-                metadatas=metadata,
-                ids=[f"doc_{document_id}_chunk_{i}"],
+        return self.create_chunks(sentences, max_chunk_length=800)
+
+    @staticmethod
+    def iter_sentences(blocks, max_sentence_chars=settings.INGEST_MAX_SENTENCE_CHARS):
+        """Sentences of a document that arrives as a stream of text blocks.
+
+        Only the last, possibly unfinished sentence is carried over into the next
+        block, so memory is bounded by the block size rather than the document.
+        """
+        ensure_nltk_resources()
+        pending = ""
+        for block in blocks:
+            text = pending + block
+            sentences = sent_tokenize(text)
+            if not sentences:
+                pending = ""
+                continue
+            # Carry the raw tail (not the stripped sentence) so whitespace at the
+            # block boundary still separates it from the next block.
+            last = sentences.pop()
+            start = text.rfind(last)
+            pending = text[start:] if start >= 0 else last
+            yield from sentences
+            while len(pending) > max_sentence_chars:
+                yield pending[:max_sentence_chars]
+                pending = pending[max_sentence_chars:]
+        if pending.strip():
+            yield pending.strip()
+
+    @staticmethod
+    def chunk_hash(chunk: str) -> str:
+        return hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:16]
+
+    def chunk_records(self, chunks, document_id, user_id, occurrences=None, start_index=0):
+        """IDs and metadata for a document's chunks.
+
+        IDs are derived from chunk content, so an unchanged chunk keeps its ID
+        across re-ingestion; repeated identical chunks get an occurrence suffix.
+        When a document is processed in batches, pass the same `occurrences`
+        counter and the running `start_index` for every batch.
+        """
+        ids = []
+        metadatas = []
+        occurrences = Counter() if occurrences is None else occurrences
+        for index, chunk in enumerate(chunks, start=start_index):
+            digest = self.chunk_hash(chunk)
+            occurrences[digest] += 1
+            suffix = f"_{occurrences[digest]}" if occurrences[digest] > 1 else ""
+            ids.append(f"{self.scope.chunk_id_prefix(document_id, user_id)}_{digest}{suffix}")
+            metadatas.append(
+                {"document_id": document_id, "user_id": user_id, "chunk_index": index, "chunk_hash": digest}
+            )
+        return ids, metadatas
+
+    def lexical_groups(self, metadatas):
+        """BM25 groups for chunks; only shared collections need them."""
+        if not self.scope.shared:
+            return None
+        return [lexical_group(metadata["user_id"], metadata["document_id"]) for metadata in metadatas]
+
+    def write_chunks(self, ids, chunks, embeddings, metadatas):
+        batch_size = min(settings.CHROMA_WRITE_BATCH_SIZE, self.client.get_max_batch_size())
+        for offset in range(0, len(chunks), batch_size):
+            end = offset + batch_size
+            self.collection.upsert(
+                ids=ids[offset:end],
+                documents=chunks[offset:end],
+                embeddings=self.layout.index_vectors(embeddings[offset:end]),
+                metadatas=metadatas[offset:end],
             )
+        if self.vector_store is not None:
+            self.vector_store.add(ids, self.layout.rescore_vectors(embeddings))
+        if self.lexical_index is not None:
+            self.lexical_index.add(ids, chunks, groups=self.lexical_groups(metadatas))
+
+    def _finish_ingest(self, document_id, user_id, chunks):
+        """Persist the lexical index and side-store vectors, record the document and drop stale cached answers."""
+        lexical_index = self.lexical_index
+        if lexical_index is not None:
+            lexical_index.save()
+        else:
+            # The index no longer matches the collection; it is rebuilt if lexical search is enabled again.
+            self.registry.discard_lexical_index(self.collection_name)
+        if self.vector_store is not None:
+            self.vector_store.save()
+        register_document(user_id, document_id, self.collection_name, chunks)
+        answer_cache = self.registry.answer_cache
+        if answer_cache is not None:
+            answer_cache.invalidate(self.scope_key)
+            answer_cache.invalidate(user_scope_key(user_id))
+
+    def add_document(self, content, document_id, user_id):
+        return self.add_document_stream([content], document_id=document_id, user_id=user_id)
+
+    def add_document_stream(
+        self,
+        blocks,
+        document_id,
+        user_id,
+        batch_size=settings.INGEST_BATCH_CHUNKS,
+        skip_existing=False,
+        on_progress=None,
+    ):
+        """Ingest a document given as an iterable of text blocks.
+
+        Sentences, chunks and batches are produced lazily. Up to
+        `INGEST_EMBED_PREFETCH` batches are embedded in the background while the
+        next batch is chunked and earlier ones are written. With `skip_existing`,
+        chunks already stored for the document (e.g. by an interrupted earlier
+        run) are not embedded again. `on_progress(chunks_done)` is called after
+        every written batch.
+        """
+        chunks = self.iter_chunks(self.iter_sentences(blocks), max_chunk_length=800)
+        existing = self.document_chunk_ids(document_id) if skip_existing else set()
+        occurrences = ChunkOccurrences()
+        in_flight = deque()
+        total = 0
+        done = 0
+        with ThreadPoolExecutor(max_workers=settings.INGEST_EMBED_PREFETCH, thread_name_prefix="ingest") as executor:
+            while True:
+                batch = list(islice(chunks, batch_size))
+                if batch:
+                    ids, metadatas = self.chunk_records(
+                        batch, document_id=document_id, user_id=user_id, occurrences=occurrences, start_index=total
+                    )
+                    total += len(batch)
+                    stored = [i for i, chunk_id in enumerate(ids) if chunk_id in existing]
+                    if stored and self.lexical_index is not None:
+                        self.lexical_index.add(
+                            [ids[i] for i in stored],
+                            [batch[i] for i in stored],
+                            groups=self.lexical_groups([metadatas[i] for i in stored]),
+                        )
+                    new = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing]
+                    new_chunks = [batch[i] for i in new]
+                    future = None
+                    if new_chunks:
+                        future = executor.submit(contextvars.copy_context().run, self.get_embedding, new_chunks)
+                    in_flight.append(
+                        (future, [ids[i] for i in new], new_chunks, [metadatas[i] for i in new], len(batch))
+                    )
+                while in_flight and (not batch or len(in_flight) > settings.INGEST_EMBED_PREFETCH):
+                    future, new_ids, new_chunks, new_metadatas, size = in_flight.popleft()
+                    if future is not None:
+                        embeddings = future.result()
+                        if embeddings is None:
+                            raise RuntimeError(f"Failed to embed document {document_id}")
+                        self.write_chunks(new_ids, new_chunks, embeddings, new_metadatas)
+                    done += size
+                    if on_progress is not None:
+                        on_progress(done)
+                if not batch:
+                    break
+        if total:
+            self._finish_ingest(document_id, user_id, total)
+        return total
+
+    def document_chunk_ids(self, document_id):
+        where = {"document_id": document_id}
+        if self.scope.shared:
+            where = {"$and": [{"user_id": self.scope.user_id}, where]}
+        return set(self.collection.get(where=where, include=[])["ids"])
+
+    @staticmethod
+    def chunk_position(chunk_id, metadata):
+        """Position of a stored chunk in its document, from metadata or, for legacy chunks, the ID."""
+        if metadata and "chunk_index" in metadata:
+            return metadata["chunk_index"]
+        match = LEGACY_CHUNK_ID.search(chunk_id)
+        if match is None:
+            raise ValueError(f"Cannot tell the position of chunk {chunk_id}; re-ingest the document")
+        return int(match.group(1))
+
+    def document_chunks(self):
+        """`(chunk_hash, text)` of every stored chunk in the scope, in document order."""
+        stored = self.collection.get(where=self.where, include=["documents", "metadatas"])
+        rows = sorted(
+            zip(stored["metadatas"], stored["ids"], stored["documents"]),
+            key=lambda row: (self.chunk_position(row[1], row[0]), row[1]),
+        )
+        return [((metadata or {}).get("chunk_hash") or self.chunk_hash(text), text) for metadata, _, text in rows]
+
+    def reingest_document(self, content, document_id, user_id):
+        """Bring the stored chunks of a document in line with a new version of its content.
+
+        Only chunks whose content is new are embedded; unchanged chunks are kept
+        (their position metadata is refreshed) and chunks that disappeared are deleted.
+        """
+        chunked_text = self.split_document(content)
+        ids, metadatas = self.chunk_records(chunked_text, document_id=document_id, user_id=user_id)
+        existing = self.document_chunk_ids(document_id)
+
+        new_positions = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing]
+        reused_positions = [i for i, chunk_id in enumerate(ids) if chunk_id in existing]
+        stale_ids = list(existing - set(ids))
+
+        if new_positions:
+            new_chunks = [chunked_text[i] for i in new_positions]
+            embeddings = self.get_embedding(new_chunks)
+            if embeddings is None:
+                raise RuntimeError(f"Failed to embed document {document_id}")
+            self.write_chunks([ids[i] for i in new_positions], new_chunks, embeddings, [metadatas[i] for i in new_positions])
+        if reused_positions:
+            self.collection.update(
+                ids=[ids[i] for i in reused_positions], metadatas=[metadatas[i] for i in reused_positions]
+            )
+        if stale_ids:
+            self.collection.delete(ids=stale_ids)
+            if self.lexical_index is not None:
+                self.lexical_index.remove(stale_ids)
+            if self.vector_store is not None:
+                self.vector_store.remove(stale_ids)
+        self._finish_ingest(document_id, user_id, len(ids))
+
+        return {"chunks": len(ids), "reused": len(reused_positions), "embedded": len(new_positions), "deleted": len(stale_ids)}
+
+    @classmethod
+    def add_documents(cls, items, db_path=settings.CHROMA_DB_PATH):
+        """Ingest many `(scope, document_id, user_id, content)` items.
+
+        `scope` is a `DocumentScope` or a collection name. All chunks across all
+        items are embedded together so small documents share embedding
+        requests, then each document is written in batched upserts.
+        """
+        scopes = [scope if isinstance(scope, DocumentScope) else DocumentScope(scope) for scope, *_ in items]
+        managers = [cls(db_path=db_path, scope=scope) for scope in scopes]
+        chunked = [manager.split_document(content) for manager, (*_, content) in zip(managers, items)]
+        all_chunks = [chunk for chunks in chunked for chunk in chunks]
+        if not all_chunks:
+            return 0
+        embeddings = managers[0].get_embedding(all_chunks)
+        if embeddings is None:
+            raise RuntimeError("Failed to embed documents")
+
+        offset = 0
+        for manager, chunks, (_, document_id, user_id, _) in zip(managers, chunked, items):
+            ids, metadatas = manager.chunk_records(chunks, document_id=document_id, user_id=user_id)
+            manager.write_chunks(ids, chunks, embeddings[offset:offset + len(chunks)], metadatas)
+            offset += len(chunks)
+        for manager, chunks, (_, document_id, user_id, _) in zip(managers, chunked, items):
+            manager._finish_ingest(document_id, user_id, len(chunks))
+        return len(all_chunks)
 
     def get_document_content(self, request: str, num_results=20):
-        results = self.collection.query(query_texts=request, n_results=num_results)
-        return results  # ['documents'] if results['documents'][0] else None
-
-    def answer_query_base(self, request: str):
-        context = "".join(self.get_document_content(request=request)["documents"][0])
-        system_prompt = {
-            "role": "system",
-            "content": """
-                "You are a knowledgeable assistant for the RAG system." 
-                "Your role is to help the student understand and engage with the provided study materials." 
-                "You will be given:"
-                "1. **Document Chunks**: Relevant excerpts from the study material retrieved from a vector database."
-                "2. **User's Request**: The current question or statement from the student."
-
-                "**Guidelines:**"
-                    "- **Use Only Provided Information**:" 
-                        "Base your responses solely on the **Chat History** and **Document Chunks**." 
-                        "Do not incorporate any external knowledge or make assumptions beyond the given data."
-
-                    "- **Be Clear and Concise**:" 
-                        "Provide explanations that are easy to understand, avoiding unnecessary jargon unless it is part" 
-                        "of the provided material."
-
-                    "- **Maintain Context**: "
-                        "Ensure continuity by considering the **Chat History**. Your responses should build upon previous" 
-                        "interactions when relevant."
-
-                    "- **Stay Relevant**:" 
-                        "Address the **User's Request** directly, ensuring that your response is pertinent and helpful."
-
-                    "- **Format**:" 
-                        "Respond in a clear and organized manner, using bullet points or numbered lists if it enhances clarity."
-
-                    "- **Be interactive with user and pretend to be a human**:" 
-                        "If the user asks you simple questions, for a small talk, you can play and interact like a users friend"
-                    "- **Be flexible**"
-                        "If the user's question is about a general knowledge that is well known to everyone provide an answer"
-                         "on the user's question even if there is nothing mentioned in the provided context"
-                    """,
-        }
-        human_prompt = {
-            "role": "user",
-            "content": f"""
-                "### Document Chunks:"
-                    "{context}"
-                "### User's Request:"
-                    "{request}"
-                """,
+        query_embedding = self.get_embedding([request])
+        if query_embedding is None:
+            raise RuntimeError("Failed to embed query")
+        ids, documents, _, distances = self.vector_query(query_embedding[0], num_results)
+        return {"ids": [ids], "documents": [documents], "distances": [distances]}
+
+    def vector_query(self, query_embedding, num_results, where=None):
+        """`(ids, documents, embeddings, distances)` of the nearest chunks, re-scored if the layout says so.
+
+        `where` replaces the scope's own filter, e.g. to select all of a user's documents in a shard.
+        """
+        return query_collection(
+            self.collection, self.layout, self.vector_store, query_embedding, num_results, where=where or self.where
+        )
+
+    @property
+    def openai(self):
+        """OpenAI client, built on first use: not every deployment has an OpenAI key."""
+        return self.registry.openai
+
+    @property
+    def lexical_index(self):
+        """BM25 index of the collection, or None when LEXICAL_INDEX_ENABLED is off."""
+        if not settings.LEXICAL_INDEX_ENABLED:
+            return None
+        return self.registry.get_lexical_index(self.collection_name)
+
+    @property
+    def vector_store(self):
+        return self.registry.get_vector_store(self.collection_name)
+
+    def _lexical_filter(self):
+        return [self.scope.group] if self.scope.shared else None
+
+    def _get_chunks(self, ids):
+        """`{id: (document, embedding)}` for the stored chunks among `ids`."""
+        if not ids:
+            return {}
+        stored = self.collection.get(ids=ids, include=["documents", "embeddings"])
+        if self.vector_store is None:
+            return dict(zip(stored["ids"], zip(stored["documents"], stored["embeddings"])))
+        vectors = self.vector_store.get(stored["ids"])
+        return {
+            chunk_id: (document, vectors[chunk_id] if chunk_id in vectors else self.layout.pad(embedding))
+            for chunk_id, document, embedding in zip(stored["ids"], stored["documents"], stored["embeddings"])
         }
+
+    def search(self, request: str, num_results=20, mode=settings.RETRIEVAL_MODE):
+        """Candidate chunks for `request` as `(documents, embeddings, distances)`, best first.
+
+        `mode` is "vector" (HNSW cosine search), "lexical" (BM25 only, no
+        embedding call) or "hybrid" (both, fused by reciprocal rank). Hybrid
+        queries that are just a keyword or two are answered lexically.
+        """
+        if mode != "vector" and not settings.LEXICAL_INDEX_ENABLED:
+            raise ValueError(f'Retrieval mode "{mode}" needs LEXICAL_INDEX_ENABLED=true')
+        if mode == "hybrid" and len(tokenize(request)) <= settings.KEYWORD_QUERY_MAX_TERMS:
+            mode = "lexical"
+
+        if mode == "lexical":
+            with span("lexical_query"):
+                hits = self.lexical_index.search(request, k=num_results, groups=self._lexical_filter())
+            if not hits:
+                return [], [], []
+            best = hits[0][1]
+            stored = self._get_chunks([chunk_id for chunk_id, _ in hits])
+            hits = [(chunk_id, score) for chunk_id, score in hits if chunk_id in stored]
+            return (
+                [stored[chunk_id][0] for chunk_id, _ in hits],
+                [stored[chunk_id][1] for chunk_id, _ in hits],
+                [1.0 - score / best for _, score in hits],
+            )
+
+        query_embedding = self.get_embedding([request])
+        if query_embedding is None:
+            raise RuntimeError("Failed to embed query")
+        with span("vector_query"):
+            vector_ids, documents, embeddings, distances = self.vector_query(query_embedding[0], num_results)
+        if mode == "vector":
+            return documents, embeddings, distances
+
+        with span("lexical_query"):
+            lexical_hits = self.lexical_index.search(request, k=num_results, groups=self._lexical_filter())
+            lexical_ids = [chunk_id for chunk_id, _ in lexical_hits]
+        fused = [chunk_id for chunk_id, _ in reciprocal_rank_fusion([vector_ids, lexical_ids])[:num_results]]
+        known = {chunk_id: i for i, chunk_id in enumerate(vector_ids)}
+        lexical_only = self._get_chunks([chunk_id for chunk_id in fused if chunk_id not in known])
+
+        query = self.layout.rescore_vectors(query_embedding)[0]
+        fused_documents, fused_embeddings, fused_distances = [], [], []
+        for chunk_id in fused:
+            if chunk_id in known:
+                i = known[chunk_id]
+                fused_documents.append(documents[i])
+                fused_embeddings.append(embeddings[i])
+                fused_distances.append(distances[i])
+                continue
+            if chunk_id not in lexical_only:
+                continue
+            document, embedding = lexical_only[chunk_id]
+            embedding = np.asarray(embedding, dtype=np.float32)
+            fused_documents.append(document)
+            fused_embeddings.append(embedding)
+            fused_distances.append(1.0 - float(embedding @ query) / max(float(np.linalg.norm(embedding)), 1e-12))
+        return fused_documents, fused_embeddings, fused_distances
+
+    def retrieve_context(
+        self, request: str, num_results=20, token_budget=settings.CONTEXT_TOKEN_BUDGET, mode=None
+    ):
+        """Retrieve chunks for `request` and assemble them into a prompt context."""
+        mode = mode or settings.RETRIEVAL_MODE
+        started = time.perf_counter()
+        if not settings.CONTEXT_BUILDER_ENABLED:
+            documents = self.get_document_content(request=request, num_results=num_results)["documents"][0]
+            text = " ".join(documents)
+            context = BuiltContext(text=text, chunks=documents, tokens=estimate_tokens(text), candidates=len(documents))
+        else:
+            documents, embeddings, distances = self.search(request, num_results=num_results, mode=mode)
+            with span("context_build"):
+                context = ContextBuilder(token_budget=token_budget).build(documents, embeddings, distances)
+        self.logger.info(
+            "Context for %s (%s): %d/%d chunks, %d duplicates dropped, ~%d tokens, %.1f ms",
+            self.scope_key,
+            mode,
+            len(context.chunks),
+            context.candidates,
+            context.duplicates,
+            context.tokens,
+            (time.perf_counter() - started) * 1000,
+        )
+        return context
+
+    async def cached_answer(self, endpoint: str, request: str, retrieval_mode: str = None):
+        """Look up a semantically similar earlier request; returns `(answer, ticket)`.
+
+        Answers are only shared between requests to the same endpoint, with the
+        same retrieval mode and model. On a miss, hand `ticket` to
+        `cache_answer` with the generated answer.
+        """
+        answer_cache = self.registry.answer_cache
+        if answer_cache is None:
+            return None, None
+        variant = (endpoint, retrieval_mode or settings.RETRIEVAL_MODE, self.ollama_client.model_name)
+        # Read before anything is retrieved: an invalidation from here on makes the answer stale.
+        generation = answer_cache.generation(self.scope_key)
+        query_embedding = await run_blocking(self.get_embedding, [request])
+        if query_embedding is None:
+            return None, None
+        cached = answer_cache.lookup(self.scope_key, variant, query_embedding[0])
+        return cached, (variant, query_embedding[0], generation)
+
+    def cache_answer(self, ticket, answer: str) -> None:
+        if ticket is not None and self.registry.answer_cache is not None:
+            variant, query_embedding, generation = ticket
+            self.registry.answer_cache.store(self.scope_key, variant, query_embedding, answer, generation=generation)
+
+    @timed("retrieve")
+    async def aretrieve_context(self, request: str, num_results=20, mode=None):
+        """`retrieve_context` off the event loop, shared by concurrent identical requests."""
+        mode = mode or settings.RETRIEVAL_MODE
+        key = (self.scope_key, normalize_text(request), num_results, mode)
+        return await retrieval_flight.do(
+            key,
+            lambda: run_blocking(self.retrieve_context, request, num_results=num_results, mode=mode, backend="chroma"),
+        )
+
+    async def answer_query_base(self, request: str, retrieval_mode: str = None, use_cache: bool = True):
+        ticket = None
+        if use_cache:
+            cached, ticket = await self.cached_answer("ask_ai", request, retrieval_mode=retrieval_mode)
+            if cached is not None:
+                return cached
+        # Only requests that cache their answer may share a flight whose leader stores it.
+        key = (
+            self.scope_key, "ask_ai", normalize_text(request), self.ollama_client.model_name, retrieval_mode, use_cache
+        )
+        return await generation_flight.do(
+            key, lambda: self._generate_answer(request, retrieval_mode=retrieval_mode, ticket=ticket)
+        )
+
+    async def _generate_answer(self, request: str, retrieval_mode: str = None, ticket=None):
+        messages = await self.build_answer_messages(request, retrieval_mode=retrieval_mode)
         response_format = Response.model_json_schema()
         try:
-            response = self.ollama_client.generate_response(messages=[system_prompt, human_prompt], format=response_format)
-            return json.loads(response)['answer']
+            response = await self.ollama_client.agenerate_response(
+                messages=messages, format=response_format, budget="ask_ai"
+            )
+            answer = json.loads(response)['answer']
+            self.cache_answer(ticket, answer)
+            return answer
         except ConnectionError as e:
-            self.logger.error(f"Connection error occurred: {e}")
+            self.logger.error("Connection error occurred: %s", e)
             return f"ConnectionError: {e}"
         except ValueError as e:
-            self.logger.error(f"Invalid parameter error: {e}")
+            self.logger.error("Invalid parameter error: %s", e)
             return f"ValueError: {e}"
         except Exception as e:
-            self.logger.error(f"An unexpected error occurred: {e}")
+            self.logger.error("An unexpected error occurred: %s", e)
             return f"Exception: {e}"
+
+    async def stream_answer_query_base(self, request: str, retrieval_mode: str = None):
+        """Yield answer tokens as they are generated (plain text, including any reasoning)."""
+        messages = await self.build_answer_messages(request, retrieval_mode=retrieval_mode)
+        async for token in self.ollama_client.astream_response(messages=messages, budget="ask_ai"):
+            yield token
+
+    async def build_answer_messages(self, request: str, retrieval_mode: str = None):
+        context = (await self.aretrieve_context(request, mode=retrieval_mode)).text
+        return answer_messages(context, request)
@@ -1,23 +1,82 @@
+import asyncio
 import json
-from utils.openai_client import ChatGPTClient
+import time
 from ai.services.rag_service import VectorDBManager
-from utils.ollama import ChatOllama
+from utils import settings
+from utils.concurrency import run_blocking
+from utils.logger import Logger
+from utils.metrics import span
+from utils.singleflight import generation_flight, normalize_text
+from utils.storage import DocumentScope
+from utils.summary_cache import SummaryCache
 from pydantic import BaseModel
 
+# Bump when the prompts below change, so cached summaries are not reused.
+SUMMARY_PROMPT_VERSION = "1"
+
+CHUNK_SUMMARY_PROMPT = """
+    You are an expert AI assistant that summarizes study material for a student.
+    You will be given one excerpt of a longer document.
+    Summarize its main ideas in a few precise sentences, keeping key terms, names and figures.
+    Do not add any commentary or information that is not in the excerpt.
+"""
+
+MERGE_SUMMARY_PROMPT = """
+    You are an expert AI assistant that summarizes study material for a student.
+    You will be given summaries of consecutive parts of a longer document, in order.
+    Combine them into one concise and coherent summary that encapsulates the main ideas of all parts.
+    Do not add any commentary or information that is not in the summaries.
+"""
+
 
 class Response(BaseModel):
     summary: str
 
 
+def reduce_groups(keys, fanout=settings.SUMMARY_REDUCE_FANOUT):
+    """Split consecutive summary keys into the groups merged by one reduce step.
+
+    A group ends after a key whose hash falls on a boundary (about one key in
+    `fanout`) or once it holds `2 * fanout` keys. Boundaries follow content,
+    not position, so inserting or removing a chunk only changes the groups
+    around it. Groups have at least two keys except possibly the last.
+    """
+    fanout = max(fanout, 2)
+    groups, current = [], []
+    for key in keys:
+        current.append(key)
+        if len(current) >= 2 * fanout or (len(current) >= 2 and int(key[:8], 16) % fanout == 0):
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+
 class SummarizeService:
-    def __init__(self, collection_name):
-        self.ollama_client = ChatOllama(host='http://localhost:11434')
-        self.vector_db_manager = VectorDBManager(collection_name=collection_name)
-        self.openai_client = ChatGPTClient()
-
-    def summary(self, request):
-        context = " ".join(
-            self.vector_db_manager.collection.query(query_texts=request, n_results=3)["documents"][0])
+    def __init__(self, collection_name=None, scope: DocumentScope = None):
+        self.vector_db_manager = VectorDBManager(scope=scope or DocumentScope(collection_name))
+        self.ollama_client = self.vector_db_manager.registry.ollama
+        self.summary_cache = self.vector_db_manager.registry.summary_cache
+        self.logger = Logger("SummarizeService")
+
+    async def summary(self, request, use_cache: bool = True):
+        ticket = None
+        if use_cache:
+            cached, ticket = await self.vector_db_manager.cached_answer("summarize", request)
+            if cached is not None:
+                return cached
+        key = (
+            self.vector_db_manager.scope_key,
+            "summarize",
+            normalize_text(request),
+            self.ollama_client.model_name,
+            use_cache,
+        )
+        return await generation_flight.do(key, lambda: self._summarize(request, ticket=ticket))
+
+    async def _summarize(self, request, ticket=None):
+        context = (await self.vector_db_manager.aretrieve_context(request, num_results=3)).text
         system_prompt = {
             "role": "system",
             "content": """
@@ -43,12 +102,106 @@ class SummarizeService:
         }
         response_format = Response.model_json_schema()
         try:
-            response = self.ollama_client.generate_response(messages=[system_prompt, human_prompt],
-                                                            format=response_format)
-            return json.loads(response.message.content)['summary']
+            response = await self.ollama_client.agenerate_response(messages=[system_prompt, human_prompt],
+                                                                   format=response_format, budget="summarize")
+            summary = json.loads(response)['summary']
+            self.vector_db_manager.cache_answer(ticket, summary)
+            return summary
+        except ConnectionError as e:
+            return f"ConnectionError: {e}"
+        except ValueError as e:
+            return f"ValueError: {e}"
+        except Exception as e:
+            return f"Exception: {e}"
+
+    async def summarize_document(self, use_cache: bool = True):
+        """Summary of every chunk of the document, built as a map-reduce tree.
+
+        Chunks are summarized in parallel, then consecutive summaries are
+        merged level by level (see `reduce_groups`) until one remains. Every
+        chunk and intermediate summary is cached by the hash of what it covers,
+        so repeating the request or editing part of the document only
+        regenerates the branches above changed chunks. `use_cache=False`
+        regenerates everything.
+        """
+        chunks = await run_blocking(self.vector_db_manager.document_chunks, backend="chroma")
+        if not chunks:
+            raise ValueError("The document has no content to summarize")
+        key = (
+            self.vector_db_manager.scope_key,
+            "summarize_document",
+            tuple(chunk_hash for chunk_hash, _ in chunks),
+            self.ollama_client.model_name,
+            use_cache,
+        )
+        try:
+            return await generation_flight.do(key, lambda: self._summarize_document(chunks, use_cache))
         except ConnectionError as e:
             return f"ConnectionError: {e}"
         except ValueError as e:
             return f"ValueError: {e}"
         except Exception as e:
             return f"Exception: {e}"
+
+    async def _summarize_document(self, chunks, use_cache: bool):
+        started = time.perf_counter()
+        model = self.ollama_client.model_name
+        semaphore = asyncio.Semaphore(settings.SUMMARY_CONCURRENCY)
+        generated = 0
+
+        async def resolve(items, prompt):
+            """`{key: summary}` for `{key: text}` items, from the cache or generated in parallel."""
+            nonlocal generated
+            summaries = {}
+            if use_cache and self.summary_cache is not None:
+                summaries = await run_blocking(self.summary_cache.get_many, list(items))
+            missing = [key for key in items if key not in summaries]
+            generated += len(missing)
+            results = await asyncio.gather(*(generate(key, items[key], prompt) for key in missing))
+            return {**summaries, **dict(zip(missing, results))}
+
+        async def generate(key, text, prompt):
+            async with semaphore:
+                summary = await self._generate_summary(prompt, text)
+            if self.summary_cache is not None:
+                await run_blocking(self.summary_cache.put, key, summary)
+            return summary
+
+        keys = [SummaryCache.leaf_key(model, SUMMARY_PROMPT_VERSION, chunk_hash) for chunk_hash, _ in chunks]
+        with span("summary_map"):
+            summaries = await resolve(dict(zip(keys, (text for _, text in chunks))), CHUNK_SUMMARY_PROMPT)
+        levels = 0
+        with span("summary_reduce"):
+            while len(keys) > 1:
+                levels += 1
+                parents = []
+                items = {}
+                for group in reduce_groups(keys):
+                    if len(group) == 1:
+                        parents.append(group[0])
+                        continue
+                    parent = SummaryCache.node_key(model, SUMMARY_PROMPT_VERSION, group)
+                    parents.append(parent)
+                    items[parent] = "\n\n".join(
+                        f"### Part {i}:\n{summaries[child]}" for i, child in enumerate(group, start=1)
+                    )
+                summaries.update(await resolve(items, MERGE_SUMMARY_PROMPT))
+                keys = parents
+        self.logger.info(
+            "Summarized %s: %d chunks, %d reduce levels, %d summaries generated, %.1f s",
+            self.vector_db_manager.scope_key,
+            len(chunks),
+            levels,
+            generated,
+            time.perf_counter() - started,
+        )
+        return summaries[keys[0]]
+
+    async def _generate_summary(self, prompt: str, text: str) -> str:
+        response = await self.ollama_client.agenerate_response(
+            messages=[{"role": "system", "content": prompt}, {"role": "user", "content": text}],
+            format=Response.model_json_schema(),
+            budget="summarize",
+        )
+        # Errors come back as text, which fails to parse and is never cached.
+        return json.loads(response)["summary"]
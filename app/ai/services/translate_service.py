@@ -1,66 +1,171 @@
-from utils.openai_client import ChatGPTClient
+import re
+import time
+from nltk.tokenize import sent_tokenize
 from ai.services.rag_service import VectorDBManager
+from utils import settings
+from utils.concurrency import run_blocking
+from utils.logger import Logger
+from utils.metrics import span
+from utils.nltk_resources import ensure_nltk_resources
+from utils.singleflight import generation_flight, normalize_text
+from utils.storage import DocumentScope
+from utils.tokens import estimate_tokens, token_budget_batches
+from utils.translation_memory import TranslationMemory
+import asyncio
 import json
-from utils.ollama import ChatOllama
 from pydantic import BaseModel
 
+# Line breaks, with the whitespace around them, separate paragraphs and are kept verbatim.
+PARAGRAPH_BREAK = re.compile(r"(\s*\n\s*)")
+# Only the start of the untranslated text is used to retrieve context; it is a topic hint.
+CONTEXT_QUERY_CHARS = 2000
+
+SYSTEM_PROMPT = """
+    You are an expert translator with deep proficiency in accurately converting text from one language to another.
+    Your translations are precise, contextually appropriate, and adapted to the specific context provided.
+    You prioritize maintaining the original meaning, tone, and cultural nuances of the source text
+    while ensuring clarity and fluency in the target language.
+    You will be given:
+        1. **Document Chunks**: Relevant excerpts from the study material retrieved from a vector database.
+        2. **Segments to translate**: A JSON object of numbered, consecutive sentences of one text.
+    You must:
+        1. Analyze the context carefully and tailor your translation to align with the provided purpose and audience.
+        2. Avoid overly literal translations unless explicitly requested.
+           Focus on natural phrasing that conveys the intended meaning accurately.
+        3. Maintain key terminology and style consistent with the context.
+        4. Translate every segment on its own, under the same number, without merging or splitting segments.
+        5. Do not include any additional commentary or information beyond the required JSON format.
+"""
+
 
 class Response(BaseModel):
     summary: str
 
 
+def split_segments(text):
+    """`(piece, translatable)` pairs that concatenate back to `text`.
+
+    Sentences are the translatable segments; the whitespace and line breaks
+    between them are kept as they are.
+    """
+    ensure_nltk_resources()
+    pieces = []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        if not paragraph.strip():
+            if paragraph:
+                pieces.append((paragraph, False))
+            continue
+        position = 0
+        for sentence in sent_tokenize(paragraph):
+            start = paragraph.find(sentence, position)
+            if start < 0:
+                # The tokenizer changed the sentence; keep the rest of the paragraph as one segment.
+                break
+            if start > position:
+                pieces.append((paragraph[position:start], False))
+            pieces.append((sentence, True))
+            position = start + len(sentence)
+        if position < len(paragraph):
+            rest = paragraph[position:]
+            pieces.append((rest, bool(rest.strip())))
+    return pieces
+
+
 class TranslateService:
-    def __init__(self, collection_name):
-        self.gpt_model = ChatGPTClient()
-        self.ollama_model = ChatOllama(host='http://localhost:11434')
-        self.vector_db = VectorDBManager(collection_name=collection_name)
-
-    def translate(self, text, language):
-        system_prompt = {
-            "role": "system",
-            "content": """
-                                "You are an expert translator with deep proficiency in accurately converting text from one language to another. 
-                                "Your translations are precise, contextually appropriate, and adapted to the specific context provided." 
-                                "You prioritize maintaining the original meaning, tone, and cultural nuances of the source text while ensuring clarity and fluency in the target language."  
-                                "You will be given:"
-                                    "1. **Document Chunks**: Relevant excerpts from the study material retrieved from a vector database."
-                                    "2. **Text to translate**: A specific context for the translation (e.g., technical, legal, literary, or conversational)."
-                                "When given a context, you must:"
-                                    "1. Analyze the context carefully and tailor your translation to align with the provided purpose and audience."
-                                    "2. Avoid overly literal translations unless explicitly requested. Focus on natural phrasing that conveys the intended meaning accurately."
-                                    "3. Maintain key terminology and style consistent with the context."
-                                    "4. Do not include any additional commentary or information beyond the required JSON format." 
-                                    "5. Adhere strictly to the context provided, ensuring your translations meet the specific needs outlined."
-                                """,
-        }
+    """Translates text sentence by sentence through a translation memory.
 
-        context = "".join(self.vector_db.collection.query(query_texts=text, n_results=3)["documents"][0])
+    Sentences already translated into the language for the same document
+    collection come from the memory; only the others are sent to the model,
+    in parallel batches, and the result is reassembled in the original order.
+    """
 
-        human_prompt = f"""
-        Here is the context in which you have to translate: {context}
-        Here is the text you have to translate to {language}: {text}"""
+    def __init__(self, collection_name=None, scope: DocumentScope = None):
+        self.vector_db = VectorDBManager(scope=scope or DocumentScope(collection_name))
+        self.gpt_model = self.vector_db.registry.openai
+        self.ollama_model = self.vector_db.registry.ollama
+        self.translation_memory = self.vector_db.registry.translation_memory
+        self.logger = Logger("TranslateService")
+
+    async def translate(self, text, language):
+        key = (
+            self.vector_db.scope_key,
+            "translate",
+            normalize_text(text),
+            language.casefold(),
+            self.gpt_model.model,
+        )
+        return await generation_flight.do(key, lambda: self._translate(text, language))
+
+    async def _translate(self, text, language):
+        started = time.perf_counter()
+        pieces = split_segments(text)
+        segments = {TranslationMemory.segment_hash(piece): piece for piece, translatable in pieces if translatable}
+        context, model = self.vector_db.scope_key, self.gpt_model.model
+
+        translations = {}
+        if self.translation_memory is not None:
+            translations = await run_blocking(
+                self.translation_memory.get_many, list(segments), language, context, model
+            )
+        missing = [segment_hash for segment_hash in segments if segment_hash not in translations]
+        if missing:
+            translated = dict(zip(missing, await self._translate_segments([segments[h] for h in missing], language)))
+            if self.translation_memory is not None:
+                await run_blocking(self.translation_memory.put_many, translated, language, context, model)
+            translations.update(translated)
+
+        self.logger.info(
+            "Translated %d segments into %s for %s: %d from memory, %.1f ms",
+            len(segments),
+            language,
+            context,
+            len(segments) - len(missing),
+            (time.perf_counter() - started) * 1000,
+        )
+        return "".join(
+            translations[TranslationMemory.segment_hash(piece)] if translatable else piece
+            for piece, translatable in pieces
+        )
+
+    async def _translate_segments(self, segments, language):
+        """Translations of `segments`, in order, from parallel batched model calls."""
+        context = (await self.vector_db.aretrieve_context(" ".join(segments)[:CONTEXT_QUERY_CHARS], num_results=3)).text
+        batches = token_budget_batches(segments, settings.TRANSLATION_BATCH_TOKENS, settings.TRANSLATION_BATCH_SEGMENTS)
+        with span("translate"):
+            results = await asyncio.gather(
+                *(self._translate_batch([segments[i] for i in batch], language, context) for batch in batches)
+            )
+        return [translation for result in results for translation in result]
+
+    async def _translate_batch(self, segments, language, context):
+        numbered = {str(i): segment for i, segment in enumerate(segments, start=1)}
+        # One required property per segment, so the reply has exactly one translation for each.
         response_format = {
             "type": "json_schema",
             "json_schema": {
-                "name": "reply_schema",
+                "name": "translations",
+                "strict": True,
                 "schema": {
                     "type": "object",
-                    "properties": {
-                        "ai_reply": {
-                            "description": "The AI's answer to the user's question based on the provided information.",
-                            "type": "string",
-                        }
-                    },
-                    "required": ["ai_reply"],
+                    "properties": {number: {"type": "string"} for number in numbered},
+                    "required": list(numbered),
                     "additionalProperties": False,
                 },
             },
         }
+        human_prompt = f"""
+        Here is the context in which you have to translate: {context}
+        Here are the segments you have to translate to {language}: {json.dumps(numbered, ensure_ascii=False)}"""
 
-        result = self.gpt_model.generate_response(
-            system_prompt=system_prompt,
+        result = await self.gpt_model.agenerate_response(
+            system_prompt=SYSTEM_PROMPT,
             request=human_prompt,
             response_format=response_format,
-            max_tokens=1000,
+            # Translations can take more tokens than the source, e.g. into non-Latin scripts.
+            max_tokens=3 * sum(estimate_tokens(segment) for segment in segments) + 100,
         )
-        return json.loads(result)["ai_reply"]
+        translations = json.loads(result)
+        missing = [number for number in numbered if not isinstance(translations.get(number), str)]
+        if missing:
+            raise ValueError(f"Translation is missing segments {', '.join(missing)}")
+        return [translations[number] for number in numbered]
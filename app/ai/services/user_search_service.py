@@ -0,0 +1,209 @@
+import asyncio
+import heapq
+import json
+import time
+
+from ai.services.context_builder import ContextBuilder
+from ai.services.rag_service import Response, VectorDBManager, answer_messages
+from utils import settings
+from utils.concurrency import run_blocking
+from utils.db_helper import list_user_documents
+from utils.logger import Logger
+from utils.metrics import span, timed
+from utils.registry import get_registry
+from utils.singleflight import generation_flight, normalize_text, retrieval_flight
+from utils.storage import stored_document_scope, user_scope_key
+from utils.vector_store import truncate
+
+
+class UserDocumentsManager:
+    """Answers over all documents of a user instead of a single one.
+
+    The query is embedded once and sent concurrently to every collection
+    holding the user's documents: one per document in the "per_document"
+    layout, or the user's shard, filtered by `user_id`, in the "shared" one.
+    Each collection is searched through a `VectorDBManager` of its own. Hits
+    are merged by distance into a global top-k before the context is built,
+    and the answer comes from a single generation. Retrieval is vector only,
+    and all collections must share the configured embedding backend.
+    """
+
+    def __init__(self, user_id: str, documents, db_path=settings.CHROMA_DB_PATH):
+        """`documents` are `(document_id, collection_name)` pairs, as recorded in the documents table."""
+        self.db_path = db_path
+        self.user_id = user_id
+        self.scopes = [
+            stored_document_scope(collection_name, user_id, document_id) for document_id, collection_name in documents
+        ]
+        self.scope_key = user_scope_key(user_id)
+        self.registry = get_registry(db_path)
+        self.ollama_client = self.registry.ollama
+        self._managers = {}
+        self.logger = Logger("UserDocumentsManager")
+
+    @classmethod
+    def for_user(cls, user_id: str, db_path=settings.CHROMA_DB_PATH):
+        """Manager over the user's ingested documents, or None if there are none."""
+        documents = list_user_documents(user_id)
+        if not documents:
+            return None
+        return cls(
+            user_id, [(document["document_id"], document["collection_name"]) for document in documents], db_path=db_path
+        )
+
+    def manager(self, collection_name: str) -> VectorDBManager:
+        """Manager of one of the user's collections, searched without a document filter."""
+        manager = self._managers.get(collection_name)
+        if manager is None:
+            manager = self._managers[collection_name] = VectorDBManager(
+                db_path=self.db_path, collection_name=collection_name
+            )
+        return manager
+
+    def query_targets(self):
+        """`(collection_name, where)` pairs that together cover the user's documents."""
+        targets = {}
+        for scope in self.scopes:
+            targets[scope.collection_name] = {"user_id": self.user_id} if scope.shared else None
+        return list(targets.items())
+
+    def _query_collection(self, collection_name, where, query_embedding, num_results):
+        _, documents, embeddings, distances = self.manager(collection_name).vector_query(
+            query_embedding[0], num_results, where=where
+        )
+        return list(zip(distances, documents, embeddings))
+
+    def open_targets(self):
+        """Open every target collection, refusing collections the configured backend cannot query.
+
+        One query vector serves all collections, so they must all have been built with the
+        configured embedding backend and dimension; `get_collection` raises ValueError otherwise.
+        """
+        targets = self.query_targets()
+        for collection_name, _ in targets:
+            self.manager(collection_name)
+        return targets
+
+    def get_embedding(self, content):
+        """Embed with the registry's backend, the one every target collection was checked against."""
+        try:
+            return self.registry.embedding.embed(content)
+        except Exception as e:
+            self.logger.error("Error fetching embedding: %s", e)
+            return None
+
+    async def _retrieve_user_context(self, request: str, num_results: int, token_budget: int, query_embedding=None):
+        started = time.perf_counter()
+        targets = await run_blocking(self.open_targets, backend="chroma")
+        if query_embedding is None:
+            query_embedding = await run_blocking(self.get_embedding, [request])
+        if query_embedding is None:
+            raise RuntimeError("Failed to embed query")
+        with span("vector_query"):
+            results = await asyncio.gather(
+                *(
+                    run_blocking(
+                        self._query_collection, collection_name, where, query_embedding, num_results, backend="chroma"
+                    )
+                    for collection_name, where in targets
+                )
+            )
+        hits = heapq.nsmallest(num_results, (hit for hits in results for hit in hits), key=lambda hit: hit[0])
+        embeddings = [embedding for _, _, embedding in hits]
+        if len({len(embedding) for embedding in embeddings}) > 1:
+            # Collections with different vector layouts: compare on the dimensions they share.
+            shared = min(len(embedding) for embedding in embeddings)
+            embeddings = list(truncate([embedding[:shared] for embedding in embeddings], shared))
+        with span("context_build"):
+            context = ContextBuilder(token_budget=token_budget).build(
+                [document for _, document, _ in hits], embeddings, [distance for distance, _, _ in hits]
+            )
+        self.logger.info(
+            "Context for %s over %d documents in %d collections: %d/%d chunks, ~%d tokens, %.1f ms",
+            self.scope_key,
+            len(self.scopes),
+            len(targets),
+            len(context.chunks),
+            context.candidates,
+            context.tokens,
+            (time.perf_counter() - started) * 1000,
+        )
+        return context
+
+    @timed("retrieve")
+    async def aretrieve_context(self, request: str, num_results=20, mode=None, query_embedding=None):
+        """Vector retrieval across the user's documents; other retrieval modes are rejected.
+
+        Pass `query_embedding` (a list holding the request's vector) when it is already known.
+        """
+        if mode not in (None, "vector"):
+            raise ValueError(f'Retrieval mode "{mode}" is not supported across documents; use "vector"')
+        key = (self.scope_key, normalize_text(request), num_results, "vector")
+        return await retrieval_flight.do(
+            key,
+            lambda: self._retrieve_user_context(
+                request, num_results, settings.CONTEXT_TOKEN_BUDGET, query_embedding=query_embedding
+            ),
+        )
+
+    async def cached_answer(self, endpoint: str, request: str):
+        """Look up a semantically similar earlier request; returns `(answer, ticket)`, as `VectorDBManager` does."""
+        answer_cache = self.registry.answer_cache
+        if answer_cache is None:
+            return None, None
+        variant = (endpoint, "vector", self.ollama_client.model_name)
+        # Read before anything is retrieved: an ingestion from here on makes the answer stale.
+        generation = answer_cache.generation(self.scope_key)
+        query_embedding = await run_blocking(self.get_embedding, [request])
+        if query_embedding is None:
+            return None, None
+        cached = answer_cache.lookup(self.scope_key, variant, query_embedding[0])
+        return cached, (variant, query_embedding[0], generation)
+
+    def cache_answer(self, ticket, answer: str) -> None:
+        if ticket is not None and self.registry.answer_cache is not None:
+            variant, query_embedding, generation = ticket
+            self.registry.answer_cache.store(self.scope_key, variant, query_embedding, answer, generation=generation)
+
+    async def answer_query_base(self, request: str, retrieval_mode: str = None, use_cache: bool = True):
+        ticket = None
+        if use_cache:
+            cached, ticket = await self.cached_answer("ask_ai", request)
+            if cached is not None:
+                return cached
+        key = (
+            self.scope_key, "ask_ai", normalize_text(request), self.ollama_client.model_name, retrieval_mode, use_cache
+        )
+        return await generation_flight.do(
+            key, lambda: self._generate_answer(request, retrieval_mode=retrieval_mode, ticket=ticket)
+        )
+
+    async def _generate_answer(self, request: str, retrieval_mode: str = None, ticket=None):
+        # The cache lookup already embedded the request; retrieval reuses that vector.
+        query_embedding = [ticket[1]] if ticket is not None else None
+        messages = await self.build_answer_messages(
+            request, retrieval_mode=retrieval_mode, query_embedding=query_embedding
+        )
+        try:
+            response = await self.ollama_client.agenerate_response(
+                messages=messages, format=Response.model_json_schema(), budget="ask_ai"
+            )
+            answer = json.loads(response)["answer"]
+        except ConnectionError as e:
+            self.logger.error("Connection error occurred: %s", e)
+            return f"ConnectionError: {e}"
+        except Exception as e:
+            self.logger.error("An unexpected error occurred: %s", e)
+            return f"Exception: {e}"
+        self.cache_answer(ticket, answer)
+        return answer
+
+    async def stream_answer_query_base(self, request: str, retrieval_mode: str = None):
+        """Yield answer tokens as they are generated (plain text, including any reasoning)."""
+        messages = await self.build_answer_messages(request, retrieval_mode=retrieval_mode)
+        async for token in self.ollama_client.astream_response(messages=messages, budget="ask_ai"):
+            yield token
+
+    async def build_answer_messages(self, request: str, retrieval_mode: str = None, query_embedding=None):
+        context = (await self.aretrieve_context(request, mode=retrieval_mode, query_embedding=query_embedding)).text
+        return answer_messages(context, request)
@@ -1,21 +1,64 @@
-from fastapi import FastAPI, HTTPException, Form, Query
+from fastapi import FastAPI, File, HTTPException, Form, Query, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
 
 from ai.services.ask_ai_service import AskAIService
-from ai.services.quiz_gen import QuizGeneration
+from ai.services.conversation_memory import ConversationMemory
+from ai.services.ingest_service import IngestJobQueue, QueueFullError
 from ai.services.translate_service import TranslateService
 from ai.services.summarize_service import SummarizeService
-from ai.services.rag_service import VectorDBManager
-from uuid_shortener import UUIDShortener
-from utils.db_helper import init_db, add_message, get_chat_history
-from utils.logger import Logger
-from ollama import Client
+from ai.services.user_search_service import UserDocumentsManager
+from ai.services.rag_service import VectorDBManager, read_text_blocks
+from utils import metrics
+from utils.concurrency import queue_depth, run_blocking
+from utils.db_helper import (
+    init_db, add_turn, get_chat_history_page, get_ingest_job, list_user_documents
+)
+from utils.logger import Logger, RequestIdMiddleware
+from utils.model_lifecycle import ModelLifecycle
+from utils.nltk_resources import ensure_nltk_resources
+from utils.registry import get_registry
+from utils.singleflight import generation_flight, retrieval_flight
+from utils.sse import SSE_HEADERS, stream_events
+from utils.storage import document_scope
 app = FastAPI()
 logger = Logger("RAG-DB")
+ingest_queue = IngestJobQueue()
+model_lifecycle = ModelLifecycle()
+conversation_memory = ConversationMemory()
+if metrics.ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+
+RETRIEVAL_MODE_PATTERN = "^(vector|hybrid|lexical)$"
+
+
+class DocumentItem(BaseModel):
+    user_id: str
+    document_id: str
+    content: str
+
+
+class BulkDocumentsRequest(BaseModel):
+    documents: list[DocumentItem]
 
 
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     init_db()
+    ensure_nltk_resources()
+    router = get_registry().ollama.router
+    router.start()
+    model_lifecycle.start(router)
+    await ingest_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await ingest_queue.stop()
+    await model_lifecycle.stop()
+    await conversation_memory.stop()
+    await get_registry().ollama.router.stop()
 
 
 @app.get("/api")
@@ -28,28 +71,131 @@ async def add_document(
     user_id: str = Query(...), document_id: str = Query(...), document: str = Query(...)
 ):
     try:
-        collection_name = UUIDShortener.encode(f"{user_id}{document_id}")
-        vectordb_manager = VectorDBManager(collection_name=collection_name)
-        vectordb_manager.add_document(
-            content=document, document_id=document_id, user_id=user_id
+        scope = document_scope(user_id, document_id)
+        vectordb_manager = await run_blocking(VectorDBManager, scope=scope, backend="chroma")
+        await run_blocking(
+            vectordb_manager.add_document, content=document, document_id=document_id, user_id=user_id
         )
         return {"message": "Document added successfully"}
     except ValueError as ve:
-        logger.error(f"{ve}")
+        logger.error("%s", ve)
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logger.error("%s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/upload_document")
+async def upload_document(
+    user_id: str = Query(...), document_id: str = Query(...), file: UploadFile = File(...)
+):
+    try:
+        scope = document_scope(user_id, document_id)
+        vectordb_manager = await run_blocking(VectorDBManager, scope=scope, backend="chroma")
+        chunks = await run_blocking(
+            vectordb_manager.add_document_stream,
+            read_text_blocks(file.file),
+            document_id=document_id,
+            user_id=user_id,
+        )
+        return {"message": "Document added successfully", "chunks": chunks}
+    except ValueError as ve:
+        logger.error("%s", ve)
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
-        logger.error(f"{e}")
+        logger.error("%s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await file.close()
+
+
+@app.post("/api/ingest_jobs", status_code=202)
+async def submit_ingest_job(
+    user_id: str = Query(...),
+    document_id: str = Query(...),
+    document: str = Query(None),
+    file: UploadFile = File(None),
+):
+    if (document is None) == (file is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of `document` or `file`")
+    try:
+        scope = document_scope(user_id, document_id)
+        job_id = await ingest_queue.submit(
+            scope, document_id=document_id, user_id=user_id, source=document if file is None else file.file
+        )
+        return {"job_id": job_id, "status": "queued"}
+    except QueueFullError as qe:
+        raise HTTPException(status_code=429, detail=str(qe), headers={"Retry-After": "30"})
+    except ValueError as ve:
+        logger.error("%s", ve)
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logger.error("%s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if file is not None:
+            await file.close()
+
+
+@app.get("/api/ingest_jobs/{job_id}")
+async def ingest_job_status(job_id: str):
+    job = await run_blocking(get_ingest_job, job_id, backend="sqlite")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    job.pop("path")
+    job.pop("collection_name")
+    job["progress"] = job["bytes_done"] / job["bytes_total"] if job["bytes_total"] else float(job["status"] == "done")
+    return job
+
+
+@app.post("/api/reingest_document")
+async def reingest_document(
+    user_id: str = Query(...), document_id: str = Query(...), document: str = Query(...)
+):
+    try:
+        scope = document_scope(user_id, document_id)
+        vectordb_manager = await run_blocking(VectorDBManager, scope=scope, backend="chroma")
+        stats = await run_blocking(
+            vectordb_manager.reingest_document, content=document, document_id=document_id, user_id=user_id
+        )
+        return {"message": "Document re-ingested successfully", **stats}
+    except ValueError as ve:
+        logger.error("%s", ve)
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logger.error("%s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/add_documents")
+async def add_documents(body: BulkDocumentsRequest):
+    try:
+        items = [
+            (document_scope(item.user_id, item.document_id), item.document_id, item.user_id, item.content)
+            for item in body.documents
+        ]
+        chunks = await run_blocking(VectorDBManager.add_documents, items)
+        return {"message": "Documents added successfully", "documents": len(items), "chunks": chunks}
+    except ValueError as ve:
+        logger.error("%s", ve)
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logger.error("%s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/ask_ai")
 async def ask_ai(
-    user_id: str = Query(...), document_id: str = Query(...), request: str = Query(...)
+    user_id: str = Query(...),
+    document_id: str = Query(...),
+    request: str = Query(...),
+    retrieval_mode: str = Query(None, pattern=RETRIEVAL_MODE_PATTERN),
+    no_cache: bool = Query(False),
 ):
     try:
-        collection_name = UUIDShortener.encode(f"{user_id}{document_id}")
-        rag_db = VectorDBManager(collection_name=collection_name)
-        completion = rag_db.answer_query_base(request)
+        scope = document_scope(user_id, document_id)
+        rag_db = await run_blocking(VectorDBManager, scope=scope, backend="chroma")
+        completion = await rag_db.answer_query_base(request, retrieval_mode=retrieval_mode, use_cache=not no_cache)
         return completion
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
@@ -57,17 +203,100 @@ async def ask_ai(
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
 
+@app.get("/api/ask_ai/stream")
+async def ask_ai_stream(
+    http_request: Request,
+    user_id: str = Query(...),
+    document_id: str = Query(...),
+    request: str = Query(...),
+    hide_reasoning: bool = Query(False),
+    retrieval_mode: str = Query(None, pattern=RETRIEVAL_MODE_PATTERN),
+):
+    try:
+        scope = document_scope(user_id, document_id)
+        rag_db = await run_blocking(VectorDBManager, scope=scope, backend="chroma")
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+    return StreamingResponse(
+        stream_events(
+            rag_db.stream_answer_query_base(request, retrieval_mode=retrieval_mode),
+            http_request,
+            hide_reasoning=hide_reasoning,
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+@app.get("/api/documents")
+async def documents(user_id: str = Query(...)):
+    return await run_blocking(list_user_documents, user_id, backend="sqlite")
+
+
+async def user_documents_manager(user_id: str) -> UserDocumentsManager:
+    manager = await run_blocking(UserDocumentsManager.for_user, user_id, backend="sqlite")
+    if manager is None:
+        raise HTTPException(status_code=404, detail="No documents found for user")
+    return manager
+
+
+@app.get("/api/ask_ai/user")
+async def ask_ai_user(
+    user_id: str = Query(...),
+    request: str = Query(...),
+    no_cache: bool = Query(False),
+    retrieval_mode: str = Query(None, pattern=RETRIEVAL_MODE_PATTERN),
+):
+    """Answer from all of the user's documents at once."""
+    rag_db = await user_documents_manager(user_id)
+    try:
+        return await rag_db.answer_query_base(request, retrieval_mode=retrieval_mode, use_cache=not no_cache)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+
+@app.get("/api/ask_ai/user/stream")
+async def ask_ai_user_stream(
+    http_request: Request,
+    user_id: str = Query(...),
+    request: str = Query(...),
+    hide_reasoning: bool = Query(False),
+    retrieval_mode: str = Query(None, pattern=RETRIEVAL_MODE_PATTERN),
+):
+    rag_db = await user_documents_manager(user_id)
+    return StreamingResponse(
+        stream_events(
+            rag_db.stream_answer_query_base(request, retrieval_mode=retrieval_mode),
+            http_request,
+            hide_reasoning=hide_reasoning,
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
 @app.get("/api/ai_chat")
 async def chat_with_ai(
-    user_id: str = Query(...), document_id: str = Query(...), request: str = Query(...)
+    user_id: str = Query(...),
+    document_id: str = Query(...),
+    request: str = Query(...),
+    retrieval_mode: str = Query(None, pattern=RETRIEVAL_MODE_PATTERN),
 ):
     try:
-        previous_messages = get_chat_history(user_id=user_id)
-        add_message(user_id=user_id, role="user", content=request)
-        collection_name = UUIDShortener.encode(f"{user_id}{document_id}")
-        ask_ai_manager = AskAIService(collection_name=collection_name)
-        completion = ask_ai_manager.local_model(request=request, chat_history=previous_messages)
-        add_message(user_id=user_id, role="assistant", content=completion)
+        previous_messages = await conversation_memory.history(user_id, document_id)
+        scope = document_scope(user_id, document_id)
+        ask_ai_manager = await run_blocking(AskAIService, scope=scope, backend="chroma")
+        completion = await ask_ai_manager.local_model(
+            request=request, chat_history=previous_messages, retrieval_mode=retrieval_mode
+        )
+        await run_blocking(
+            add_turn, user_id=user_id, request=request, answer=completion, document_id=document_id, backend="sqlite"
+        )
+        conversation_memory.schedule_update(user_id, document_id)
         return completion
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
@@ -75,6 +304,66 @@ async def chat_with_ai(
         raise HTTPException(status_code=500, detail=str(e) or "An unexpected error occurred")
 
 
+@app.get("/api/ai_chat/stream")
+async def chat_with_ai_stream(
+    http_request: Request,
+    user_id: str = Query(...),
+    document_id: str = Query(...),
+    request: str = Query(...),
+    hide_reasoning: bool = Query(False),
+    retrieval_mode: str = Query(None, pattern=RETRIEVAL_MODE_PATTERN),
+):
+    try:
+        previous_messages = await conversation_memory.history(user_id, document_id)
+        scope = document_scope(user_id, document_id)
+        ask_ai_manager = await run_blocking(AskAIService, scope=scope, backend="chroma")
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e) or "An unexpected error occurred")
+
+    async def save_turn(answer: str):
+        # Only a completed answer is stored, together with its question: a failed or abandoned
+        # stream leaves no unanswered user message behind in the history.
+        await run_blocking(
+            add_turn, user_id=user_id, request=request, answer=answer, document_id=document_id, backend="sqlite"
+        )
+        conversation_memory.schedule_update(user_id, document_id)
+
+    return StreamingResponse(
+        stream_events(
+            ask_ai_manager.stream_local_model(
+                request=request, chat_history=previous_messages, retrieval_mode=retrieval_mode
+            ),
+            http_request,
+            hide_reasoning=hide_reasoning,
+            on_complete=save_turn,
+        ),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+@app.get("/api/chat_history")
+async def chat_history(
+    user_id: str = Query(...),
+    document_id: str = Query(...),
+    limit: int = Query(50, ge=1, le=500),
+    before_id: int = Query(None),
+):
+    try:
+        return await run_blocking(
+            get_chat_history_page,
+            user_id=user_id,
+            document_id=document_id,
+            limit=limit,
+            before_id=before_id,
+            backend="sqlite",
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+
 @app.get("/api/translate")
 async def translate(
     user_id: str = Query(...),
@@ -83,9 +372,9 @@ async def translate(
     language: str = Query(...),
 ):
     try:
-        collection_name = UUIDShortener.encode(f"{user_id}{document_id}")
-        translate_manager = TranslateService(collection_name=collection_name)
-        completion = translate_manager.translate(text=request, language=language)
+        scope = document_scope(user_id, document_id)
+        translate_manager = await run_blocking(TranslateService, scope=scope, backend="chroma")
+        completion = await translate_manager.translate(text=request, language=language)
         return completion
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
@@ -97,14 +386,99 @@ async def translate(
 
 @app.get("/api/summarize")
 async def summarize(
-    user_id: str = Query(...), document_id: str = Query(...), text: str = Query(...)
+    user_id: str = Query(...), document_id: str = Query(...), text: str = Query(None), no_cache: bool = Query(False)
 ):
     try:
-        collection_name = UUIDShortener.encode(f"{user_id}{document_id}")
-        summary_manager = SummarizeService(collection_name=collection_name)
-        completion = summary_manager.summary(request=text)
+        scope = document_scope(user_id, document_id)
+        summary_manager = await run_blocking(SummarizeService, scope=scope, backend="chroma")
+        if text is None:
+            return await summary_manager.summarize_document(use_cache=not no_cache)
+        completion = await summary_manager.summary(request=text, use_cache=not no_cache)
         return completion
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+
+def collect_service_metrics():
+    registry = get_registry()
+    caches = {"collections": registry.stats()}
+    if registry.embedding_cache is not None:
+        embedding_stats = registry.embedding_cache.stats()
+        caches["embedding"] = {
+            "hits": embedding_stats["memory_hits"] + embedding_stats["disk_hits"],
+            "misses": embedding_stats["misses"],
+        }
+    if registry.answer_cache is not None:
+        caches["answer"] = registry.answer_cache.stats()
+    if registry.summary_cache is not None:
+        caches["summary"] = registry.summary_cache.stats()
+    if registry.translation_memory is not None:
+        caches["translation"] = registry.translation_memory.stats()
+    yield (
+        "rag_cache_hits_total", "counter", "Cache hits.",
+        [({"cache": name}, stats["hits"]) for name, stats in caches.items()],
+    )
+    yield (
+        "rag_cache_misses_total", "counter", "Cache misses.",
+        [({"cache": name}, stats["misses"]) for name, stats in caches.items()],
+    )
+    flights = {"retrieval": retrieval_flight.stats(), "generation": generation_flight.stats()}
+    yield (
+        "rag_coalesced_requests_total", "counter", "Requests served by an identical in-flight request.",
+        [({"flight": name}, stats["coalesced"]) for name, stats in flights.items()],
+    )
+    yield (
+        "rag_in_flight", "gauge", "Distinct retrievals/generations in flight.",
+        [({"flight": name}, stats["in_flight"]) for name, stats in flights.items()],
+    )
+    hosts = registry.ollama.router.stats()["hosts"]
+    yield (
+        "rag_llm_backend_in_flight", "gauge", "Model calls in flight or queued per Ollama host.",
+        [({"backend": host}, stats["in_flight"]) for host, stats in hosts.items()],
+    )
+    yield (
+        "rag_llm_backend_healthy", "gauge", "Whether an Ollama host is in rotation.",
+        [({"backend": host}, stats["healthy"]) for host, stats in hosts.items()],
+    )
+    yield "rag_blocking_queue_depth", "gauge", "Calls waiting for a blocking-IO thread.", [({}, queue_depth())]
+    yield "rag_ingest_queue_depth", "gauge", "Ingest jobs waiting for a worker.", [({}, ingest_queue.queued())]
+
+
+metrics.register_collector(collect_service_metrics)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/stats")
+async def stats():
+    registry = get_registry()
+    embedding_cache = registry.embedding_cache
+    answer_cache = registry.answer_cache
+    return {
+        "registry": registry.stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "summary_cache": registry.summary_cache.stats() if registry.summary_cache is not None else None,
+        "translation_memory": (
+            registry.translation_memory.stats() if registry.translation_memory is not None else None
+        ),
+        "coalescing": {"retrieval": retrieval_flight.stats(), "generation": generation_flight.stats()},
+        "ingest_queue": {"queued": ingest_queue.queued()},
+        "ollama": registry.ollama.router.stats(),
+        "models": model_lifecycle.stats(),
+        "chat_memory": conversation_memory.stats(),
+    }
+
+
+@app.get("/api/ready")
+async def ready():
+    """200 once every preloaded model is resident on every healthy Ollama host, 503 until then."""
+    status = model_lifecycle.stats()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
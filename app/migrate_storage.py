@@ -0,0 +1,208 @@
+"""Copy documents from per-document collections into the shared layout.
+
+Every chunk is copied with its stored embedding (nothing is re-embedded) into
+the shard collection of its user, under the ID the shared layout gives it, and
+added to the shard's BM25 index (with LEXICAL_INDEX_ENABLED). Vectors are taken from the side store of
+collections with a compact layout (see `utils.vector_store`) and stored in the
+shard's own layout; documents whose stored vectors are narrower than the
+shard's layout needs are reported and left for re-ingestion. Documents whose chunks are already in place
+are skipped, and chunks a document no longer has are removed from the shard,
+so the tool can be interrupted and re-run at any time. Every document found is
+also recorded in the documents table that user-wide search reads;
+`--register-only` does just that, for deployments staying on the per-document
+layout.
+
+Migrating while the service keeps serving the per-document layout:
+
+    python migrate_storage.py             # bulk copy, service still running
+    # stop the service
+    python migrate_storage.py --verify    # catch up on documents written meanwhile
+    # start the service with STORAGE_LAYOUT=shared
+    python migrate_storage.py --drop      # once satisfied, delete the old collections
+"""
+import argparse
+import os
+from collections import defaultdict
+
+from utils import settings
+from utils.db_helper import init_db, register_document
+from utils.registry import get_registry
+from utils.storage import document_scope, lexical_group
+
+
+def legacy_collection_names(client):
+    prefix = f"{settings.SHARED_COLLECTION_PREFIX}_"
+    return sorted(name for name in client.list_collections() if not name.startswith(prefix))
+
+
+def shared_chunk_id(chunk_id: str, user_id: str, document_id: str) -> str:
+    scope = document_scope(user_id, document_id, layout="shared")
+    legacy_prefix = f"doc_{document_id}_"
+    suffix = chunk_id[len(legacy_prefix):] if chunk_id.startswith(legacy_prefix) else chunk_id
+    return f"{scope.chunk_id_prefix(document_id, user_id)}_{suffix}"
+
+
+def read_collection(collection, page_size: int, layout=None, vector_store=None):
+    """`{(user_id, document_id): [(id, document, embedding, metadata), ...]}` of a collection.
+
+    With a `vector_store`, embeddings are its re-scoring vectors rather than the index's.
+    """
+    documents = defaultdict(list)
+    skipped = 0
+    offset = 0
+    while True:
+        page = collection.get(
+            include=["documents", "embeddings", "metadatas"], limit=page_size, offset=offset
+        )
+        if not page["ids"]:
+            break
+        if vector_store is not None:
+            vectors = vector_store.get(page["ids"])
+            page["embeddings"] = [
+                vectors[chunk_id] if chunk_id in vectors else layout.pad(embedding)
+                for chunk_id, embedding in zip(page["ids"], page["embeddings"])
+            ]
+        for chunk_id, document, embedding, metadata in zip(
+            page["ids"], page["documents"], page["embeddings"], page["metadatas"]
+        ):
+            metadata = metadata or {}
+            if not metadata.get("user_id") or not metadata.get("document_id"):
+                skipped += 1
+                continue
+            documents[(metadata["user_id"], metadata["document_id"])].append(
+                (chunk_id, document, embedding, metadata)
+            )
+        offset += len(page["ids"])
+    return documents, skipped
+
+
+def migrate_document(registry, user_id: str, document_id: str, chunks, batch_size: int, dimension: int) -> str:
+    """Bring one document's chunks in its shard in line with `chunks`; returns what was done.
+
+    `dimension` is the width of the embeddings in `chunks`.
+    """
+    scope = document_scope(user_id, document_id, layout="shared")
+    target = registry.get_collection(scope.collection_name)
+    layout = registry.get_vector_layout(scope.collection_name)
+    if dimension < layout.dimension:
+        raise ValueError(f"{dimension}-dimensional vectors cannot fill a {layout} layout")
+    ids = [shared_chunk_id(chunk_id, user_id, document_id) for chunk_id, *_ in chunks]
+    existing = set(target.get(where=scope.where, include=[])["ids"])
+    stale = list(existing - set(ids))
+    if existing == set(ids):
+        return "skipped"
+
+    lexical_index = registry.get_lexical_index(scope.collection_name) if settings.LEXICAL_INDEX_ENABLED else None
+    vector_store = registry.get_vector_store(scope.collection_name)
+    for offset in range(0, len(chunks), batch_size):
+        batch = chunks[offset:offset + batch_size]
+        batch_ids = ids[offset:offset + batch_size]
+        texts = [document for _, document, _, _ in batch]
+        embeddings = [embedding for _, _, embedding, _ in batch]
+        target.upsert(
+            ids=batch_ids,
+            documents=texts,
+            embeddings=layout.index_vectors(embeddings),
+            metadatas=[metadata for _, _, _, metadata in batch],
+        )
+        if lexical_index is not None:
+            lexical_index.add(batch_ids, texts, groups=[scope.group] * len(batch_ids))
+        if vector_store is not None:
+            vector_store.add(batch_ids, layout.rescore_vectors(embeddings))
+    if stale:
+        target.delete(ids=stale)
+        if lexical_index is not None:
+            lexical_index.remove(stale)
+        if vector_store is not None:
+            vector_store.remove(stale)
+    return "migrated"
+
+
+def verify_collection(registry, documents) -> list:
+    """Documents whose shared copy does not have exactly the chunks of the legacy collection."""
+    mismatched = []
+    for (user_id, document_id), chunks in documents.items():
+        scope = document_scope(user_id, document_id, layout="shared")
+        stored = set(registry.get_collection(scope.collection_name).get(where=scope.where, include=[])["ids"])
+        expected = {shared_chunk_id(chunk_id, user_id, document_id) for chunk_id, *_ in chunks}
+        if stored != expected:
+            mismatched.append((user_id, document_id))
+    return mismatched
+
+
+def drop_collection(registry, name: str) -> None:
+    registry.chroma_client.delete_collection(name)
+    registry.drop_collection(name)
+    registry.discard_lexical_index(name)
+    path = os.path.join(registry.db_path, "vectors", f"{name}.npz")
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-path", default=settings.CHROMA_DB_PATH)
+    parser.add_argument("--batch-size", type=int, default=settings.CHROMA_WRITE_BATCH_SIZE)
+    parser.add_argument("--verify", action="store_true", help="check every migrated document afterwards")
+    parser.add_argument("--drop", action="store_true", help="delete legacy collections once they are fully migrated")
+    parser.add_argument("--register-only", action="store_true", help="only record documents, copy nothing")
+    args = parser.parse_args()
+
+    init_db()
+    registry = get_registry(args.db_path)
+    totals = defaultdict(int)
+    shards = set()
+    for name in legacy_collection_names(registry.chroma_client):
+        try:
+            collection = registry.get_collection(name)
+        except ValueError as e:
+            print(f"{name}: skipped ({e})")
+            totals["failed_collections"] += 1
+            continue
+        layout = registry.get_vector_layout(name)
+        documents, skipped = read_collection(
+            collection, args.batch_size, layout=layout, vector_store=registry.get_vector_store(name)
+        )
+        totals["unattributed_chunks"] += skipped
+        for (user_id, document_id), chunks in documents.items():
+            totals["chunks"] += len(chunks)
+            if args.register_only:
+                register_document(user_id, document_id, name, len(chunks))
+                totals["registered"] += 1
+                continue
+            try:
+                totals[migrate_document(registry, user_id, document_id, chunks, args.batch_size, layout.dimension)] += 1
+            except ValueError as e:
+                print(f"{name}: document {lexical_group(user_id, document_id)} skipped ({e})")
+                totals["failed_documents"] += 1
+                continue
+            shard = document_scope(user_id, document_id, layout="shared").collection_name
+            register_document(user_id, document_id, shard, len(chunks))
+            shards.add(shard)
+        if args.register_only:
+            registry.drop_collection(name)
+            continue
+
+        mismatched = verify_collection(registry, documents) if args.verify or args.drop else []
+        for user_id, document_id in mismatched:
+            print(f"{name}: document {lexical_group(user_id, document_id)} does not match its shared copy")
+        totals["mismatched"] += len(mismatched)
+        if args.drop and not mismatched and not skipped:
+            drop_collection(registry, name)
+            totals["dropped_collections"] += 1
+        # Keep memory flat: legacy handles are not needed again.
+        registry.drop_collection(name)
+
+    for shard in sorted(shards):
+        if settings.LEXICAL_INDEX_ENABLED:
+            registry.get_lexical_index(shard).save()
+        else:
+            registry.discard_lexical_index(shard)
+        vector_store = registry.get_vector_store(shard)
+        if vector_store is not None:
+            vector_store.save()
+    print(", ".join(f"{key}={value}" for key, value in sorted(totals.items())) or "nothing to migrate")
+
+
+if __name__ == "__main__":
+    main()
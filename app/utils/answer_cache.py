@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import numpy as np
+
+from utils import settings
+
+
+class _CachedAnswers:
+    """Answers cached for one (collection, variant), with their query embeddings."""
+
+    def __init__(self):
+        self.queries = []
+        self.answers = []
+        self.created_at = []
+        self.last_used = []
+        self._matrix = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.vstack(self.queries)
+        return self._matrix
+
+    def remove(self, i: int) -> None:
+        for values in (self.queries, self.answers, self.created_at, self.last_used):
+            del values[i]
+        self._matrix = None
+
+    def append(self, query: np.ndarray, answer: str, now: float) -> None:
+        self.queries.append(query)
+        self.answers.append(answer)
+        self.created_at.append(now)
+        self.last_used.append(now)
+        self._matrix = None
+
+
+class SemanticAnswerCache:
+    """Per-collection cache of generated answers, looked up by query-embedding similarity.
+
+    A variant is whatever besides the collection decides the answer, e.g.
+    `(endpoint, retrieval_mode, model)`; answers are only shared within one.
+    Each (collection, variant) group keeps at most `max_entries` answers and
+    at most `max_collections` groups are kept, both evicted least recently used
+    first. Entries older than `ttl_seconds` are dropped when matched. Callers
+    must `invalidate` a collection when its content changes, and pass the
+    `generation` read before generating an answer to `store`, so an answer
+    built from content invalidated meanwhile is not cached.
+
+    Generations are only remembered for the `max_collections` most recently
+    invalidated collections; a forgotten one reports the newest generation
+    forgotten so far, so it never appears unchanged across an invalidation.
+    """
+
+    def __init__(
+        self,
+        similarity: float = settings.ANSWER_CACHE_SIMILARITY,
+        max_entries: int = settings.ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = settings.ANSWER_CACHE_TTL_SECONDS,
+        max_collections: int = settings.COLLECTION_CACHE_SIZE,
+    ):
+        self.similarity = similarity
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_collections = max_collections
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Value of `invalidations` at each collection's last invalidation, least recent first.
+        self._generations = OrderedDict()
+        self._forgotten_generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_stores = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def generation(self, collection_name: str) -> int:
+        with self._lock:
+            return self._generation(collection_name)
+
+    def _generation(self, collection_name: str) -> int:
+        return self._generations.get(collection_name, self._forgotten_generation)
+
+    def lookup(self, collection_name: str, variant: Hashable, query_embedding) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            cached = self._entries.get((collection_name, variant))
+            if cached is not None and cached.queries:
+                self._entries.move_to_end((collection_name, variant))
+                scores = cached.matrix() @ self._normalize(query_embedding)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    if self.ttl_seconds > 0 and now - cached.created_at[best] > self.ttl_seconds:
+                        cached.remove(best)
+                    else:
+                        cached.last_used[best] = now
+                        self.hits += 1
+                        return cached.answers[best]
+            self.misses += 1
+            return None
+
+    def store(
+        self, collection_name: str, variant: Hashable, query_embedding, answer: str, generation: Optional[int] = None
+    ) -> None:
+        now = time.time()
+        with self._lock:
+            if generation is not None and generation != self._generation(collection_name):
+                # The collection changed while the answer was being generated.
+                self.stale_stores += 1
+                return
+            key = (collection_name, variant)
+            cached = self._entries.get(key)
+            if cached is None:
+                cached = self._entries[key] = _CachedAnswers()
+            self._entries.move_to_end(key)
+            cached.append(self._normalize(query_embedding), answer, now)
+            while len(cached.answers) > self.max_entries:
+                cached.remove(int(np.argmin(cached.last_used)))
+            while len(self._entries) > self.max_collections:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, collection_name: str) -> None:
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == collection_name]:
+                del self._entries[key]
+            self.invalidations += 1
+            self._generations[collection_name] = self.invalidations
+            self._generations.move_to_end(collection_name)
+            while len(self._generations) > self.max_collections:
+                _, forgotten = self._generations.popitem(last=False)
+                self._forgotten_generation = max(self._forgotten_generation, forgotten)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": sum(len(cached.answers) for cached in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "stale_stores": self.stale_stores,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,411 @@
+import os
+import re
+import shutil
+import threading
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+# Words plus dotted/hyphenated identifiers ("H2O", "v1.2", "x-ray", "SN-2").
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-]\w+)*")
+# Files of a persisted index: "<seq>.base.npz" holds every chunk, "<seq>.npz" the changes of one save.
+SEGMENT_FILE = re.compile(r"^(\d{8})(\.base)?\.npz$")
+# A loaded index writes a new base instead of another segment once the changes saved since the
+# last base reach its size (and at least COMPACT_MIN_CHANGES), or after MAX_SEGMENTS segments.
+COMPACT_MIN_CHANGES = 1000
+MAX_SEGMENTS = 64
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class _Corpus:
+    """Forward index (chunk -> term ids/frequencies) with its vocabulary and chunk groups."""
+
+    def __init__(self):
+        self.vocabulary: Dict[str, int] = {}
+        self.terms: List[str] = []
+        self.documents: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.groups: Dict[str, str] = {}
+
+    def term_ids(self, terms: Iterable[str]) -> np.ndarray:
+        ids = []
+        for term in terms:
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                term_id = self.vocabulary[term] = len(self.terms)
+                self.terms.append(term)
+            ids.append(term_id)
+        return np.array(ids, dtype=np.int32)
+
+    def set(self, doc_id: str, term_ids: np.ndarray, frequencies: np.ndarray, group: Optional[str] = None) -> None:
+        self.documents[doc_id] = (term_ids, frequencies)
+        if group:
+            self.groups[doc_id] = group
+
+    def remove(self, doc_id: str) -> None:
+        self.documents.pop(doc_id, None)
+        self.groups.pop(doc_id, None)
+
+    def read(self, path: str) -> int:
+        """Apply a segment file: drop the chunks it removed, then set the ones it holds. Returns its changes."""
+        with np.load(path, allow_pickle=False) as data:
+            # Single-file indexes from before segments call their terms "vocabulary".
+            terms = data["terms"] if "terms" in data.files else data["vocabulary"]
+            mapping = self.term_ids(terms.tolist())
+            removed = data["removed"].tolist() if "removed" in data.files else []
+            for doc_id in removed:
+                self.remove(doc_id)
+            offsets = data["offsets"]
+            term_ids = mapping[data["term_ids"]]
+            frequencies = data["frequencies"]
+            groups = data["groups"].tolist() if "groups" in data.files else None
+            doc_ids = data["doc_ids"].tolist()
+        for row, doc_id in enumerate(doc_ids):
+            start, end = offsets[row], offsets[row + 1]
+            self.set(doc_id, term_ids[start:end], frequencies[start:end], groups[row] if groups else None)
+        return len(doc_ids) + len(removed)
+
+
+def _write_segment(path: str, documents, groups, removed: Sequence[str], terms: List[str]) -> None:
+    """Write chunks and removed chunk ids as one segment, with a vocabulary of its own."""
+    doc_ids = list(documents)
+    offsets = np.zeros(len(doc_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(documents[doc_id][0]) for doc_id in doc_ids])
+    empty = np.zeros(0, dtype=np.int32)
+    term_ids = np.concatenate([documents[doc_id][0] for doc_id in doc_ids]) if doc_ids else empty
+    used, local_ids = np.unique(term_ids, return_inverse=True)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp.npz"
+    # Not compressed: saves stay cheap, and postings are small integers that compress poorly anyway.
+    np.savez(
+        tmp_path,
+        terms=np.array([terms[i] for i in used], dtype=str),
+        doc_ids=np.array(doc_ids, dtype=str),
+        groups=np.array([groups.get(doc_id, "") for doc_id in doc_ids], dtype=str),
+        offsets=offsets,
+        term_ids=local_ids.astype(np.int32).ravel(),
+        frequencies=np.concatenate([documents[doc_id][1] for doc_id in doc_ids]) if doc_ids else empty,
+        removed=np.array(list(removed), dtype=str),
+    )
+    os.replace(tmp_path, path)
+
+
+class _Weights(NamedTuple):
+    version: int
+    matrix: sparse.csc_matrix
+    row_ids: List[str]
+    group_rows: Dict[str, np.ndarray]
+
+
+class BM25Index:
+    """Okapi BM25 index over the chunks of one collection.
+
+    Chunks are kept as a forward index (chunk -> term ids/frequencies) and can
+    be tagged with a group (e.g. one document of a shared collection) that
+    searches can be restricted to. A query is a sparse column sum over a
+    doc x term BM25 weight matrix.
+
+    On disk the index is a directory of segments: a base holding every chunk
+    as of some point, then one segment per save with only the chunks added and
+    removed since, replayed in order on load. Once the saved changes outweigh
+    the base, a loaded index writes a new base instead. The index is loaded on
+    its first search; until then changes are only buffered and flushed as
+    segments, automatically once `flush_after` chunks are pending, so
+    ingesting a large document does not hold its whole index in memory.
+    After changes the weight matrix is rebuilt outside the lock, and
+    searches running meanwhile keep using the previous one.
+
+    `backfill`, if given, returns `(ids, texts, groups)` of every chunk the
+    index should hold; it is called on load when no base has been persisted
+    yet (e.g. for a collection ingested while lexical indexing was disabled).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        k1: float = 1.5,
+        b: float = 0.75,
+        backfill: Optional[Callable[[], Tuple[Sequence[str], Sequence[str], Optional[Sequence[str]]]]] = None,
+        flush_after: Optional[int] = None,
+    ):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.backfill = backfill
+        self.flush_after = flush_after
+        # `lock` guards the in-memory state; `save_lock` the files, and is held while loading so no save is missed.
+        self.lock = threading.RLock()
+        self.save_lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.corpus = _Corpus()
+        self.loaded = False
+        # Chunks added and removed since the last save.
+        self._added = set()
+        self._removed = set()
+        self._version = 0
+        self._weights: Optional[_Weights] = None
+        self._base_size = 0
+        self._changes = 0
+        self._segments = 0
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls(path)
+        index.ensure_loaded()
+        return index
+
+    @staticmethod
+    def delete(path: str) -> None:
+        """Remove an index from disk, including an index in the single-file format."""
+        shutil.rmtree(path, ignore_errors=True)
+        if os.path.exists(f"{path}.npz"):
+            os.remove(f"{path}.npz")
+
+    def _files(self) -> List[Tuple[int, bool, str]]:
+        """`(seq, is_base, path)` of the index files, oldest first; a single-file index is base 0."""
+        files = []
+        if os.path.exists(f"{self.path}.npz"):
+            files.append((0, True, f"{self.path}.npz"))
+        if os.path.isdir(self.path):
+            for name in os.listdir(self.path):
+                match = SEGMENT_FILE.match(name)
+                if match:
+                    files.append((int(match.group(1)), bool(match.group(2)), os.path.join(self.path, name)))
+        return sorted(files)
+
+    @property
+    def exists(self) -> bool:
+        """Whether a base has been persisted, i.e. the files hold every chunk of the collection."""
+        return any(is_base for _, is_base, _ in self._files())
+
+    def __len__(self) -> int:
+        self.ensure_loaded()
+        return len(self.corpus.documents)
+
+    def _install(self, corpus: _Corpus, base_size: int, changes: int, segments: int) -> None:
+        """Make `corpus`, read from disk, the loaded state, with the unsaved changes on top."""
+        with self.lock:
+            pending = self.corpus
+            for doc_id in self._removed:
+                corpus.remove(doc_id)
+            for doc_id in self._added:
+                term_ids, frequencies = pending.documents[doc_id]
+                corpus.set(
+                    doc_id,
+                    corpus.term_ids([pending.terms[i] for i in term_ids]),
+                    frequencies,
+                    pending.groups.get(doc_id),
+                )
+            self.corpus = corpus
+            self.loaded = True
+            self._base_size, self._changes, self._segments = base_size, changes, segments
+            self._version += 1
+
+    def ensure_loaded(self) -> None:
+        if self.loaded:
+            return
+        with self.save_lock:
+            if self.loaded:
+                return
+            files = self._files()
+            bases = [i for i, (_, is_base, _) in enumerate(files) if is_base]
+            if not bases and self.backfill is not None:
+                self._rebuild(*self.backfill())
+                return
+            files = files[bases[-1]:] if bases else files
+            corpus = _Corpus()
+            base_size = corpus.read(files[0][2]) if bases else 0
+            changes = sum(corpus.read(path) for _, _, path in files[1 if bases else 0:])
+            self._install(corpus, base_size, changes, len(files) - (1 if bases else 0))
+
+    def rebuild(self, ids: Sequence[str], texts: Sequence[str], groups: Optional[Sequence[str]] = None) -> None:
+        """Persist a new base holding exactly the given chunks, e.g. every chunk of a collection."""
+        with self.save_lock:
+            self._rebuild(ids, texts, groups)
+
+    def _rebuild(self, ids, texts, groups) -> None:
+        corpus = _Corpus()
+        for i, (doc_id, counts) in enumerate(zip(ids, self._count(texts))):
+            corpus.set(
+                doc_id,
+                corpus.term_ids(counts),
+                np.fromiter(counts.values(), dtype=np.int32, count=len(counts)),
+                groups[i] if groups is not None else None,
+            )
+        files = self._files()
+        seq = (files[-1][0] if files else 0) + 1
+        _write_segment(
+            os.path.join(self.path, f"{seq:08d}.base.npz"), corpus.documents, corpus.groups, [], corpus.terms
+        )
+        for _, _, path in files:
+            os.remove(path)
+        self._install(corpus, len(corpus.documents), 0, 0)
+
+    @staticmethod
+    def _count(texts: Sequence[str]) -> List[Counter]:
+        return [Counter(tokenize(text)) for text in texts]
+
+    def add(self, ids: Sequence[str], texts: Sequence[str], groups: Optional[Sequence[str]] = None) -> None:
+        counts = self._count(texts)
+        with self.lock:
+            for i, (doc_id, doc_counts) in enumerate(zip(ids, counts)):
+                self.corpus.set(
+                    doc_id,
+                    self.corpus.term_ids(doc_counts),
+                    np.fromiter(doc_counts.values(), dtype=np.int32, count=len(doc_counts)),
+                    groups[i] if groups is not None else None,
+                )
+                self._added.add(doc_id)
+            self._version += 1
+            flush = not self.loaded and self.flush_after is not None and len(self._added) >= self.flush_after
+        if flush:
+            self.save()
+
+    def remove(self, ids: Sequence[str]) -> None:
+        with self.lock:
+            for doc_id in ids:
+                self.corpus.remove(doc_id)
+                self._added.discard(doc_id)
+                self._removed.add(doc_id)
+            self._version += 1
+
+    def save(self) -> None:
+        """Persist the changes made since the last save, as a segment or, when due, a new base."""
+        with self.save_lock:
+            with self.lock:
+                if not self._added and not self._removed:
+                    return
+                added, removed = self._added, self._removed
+                self._added, self._removed = set(), set()
+                files = self._files()
+                has_base = any(is_base for _, is_base, _ in files)
+                changes = len(added) + len(removed)
+                corpus = self.corpus
+                base = self.loaded and (
+                    not has_base
+                    or self._changes + changes >= max(self._base_size, COMPACT_MIN_CHANGES)
+                    or self._segments >= MAX_SEGMENTS
+                )
+                if base:
+                    documents, groups, removed_ids = dict(corpus.documents), dict(corpus.groups), []
+                else:
+                    documents = {doc_id: corpus.documents[doc_id] for doc_id in added}
+                    groups = {doc_id: corpus.groups[doc_id] for doc_id in added if doc_id in corpus.groups}
+                    removed_ids = list(removed)
+            seq = (files[-1][0] if files else 0) + 1
+            try:
+                _write_segment(
+                    os.path.join(self.path, f"{seq:08d}{'.base' if base else ''}.npz"),
+                    documents,
+                    groups,
+                    removed_ids,
+                    corpus.terms,
+                )
+            except Exception:
+                with self.lock:
+                    restored_removed = {doc_id for doc_id in removed if doc_id not in self._added}
+                    restored_added = {doc_id for doc_id in added if doc_id not in self._removed}
+                    self._removed |= restored_removed
+                    self._added |= restored_added
+                raise
+            with self.lock:
+                if base:
+                    self._base_size, self._changes, self._segments = len(documents), 0, 0
+                else:
+                    self._changes += changes
+                    self._segments += 1
+                if not self.loaded:
+                    # Flushed chunks are on disk now; keep only what changed since.
+                    for doc_id in added - self._added:
+                        corpus.remove(doc_id)
+                    if not corpus.documents:
+                        self.corpus = _Corpus()
+            if base:
+                for _, _, path in files:
+                    os.remove(path)
+
+    def _build_weights(self, version: int, documents, groups, term_count: int) -> _Weights:
+        row_ids = list(documents)
+        group_rows: Dict[str, List[int]] = {}
+        for row, doc_id in enumerate(row_ids):
+            group = groups.get(doc_id)
+            if group is not None:
+                group_rows.setdefault(group, []).append(row)
+        group_rows = {group: np.array(rows, dtype=np.int64) for group, rows in group_rows.items()}
+        shape = (len(row_ids), term_count)
+        if not row_ids:
+            return _Weights(version, sparse.csc_matrix(shape, dtype=np.float32), row_ids, group_rows)
+
+        rows = np.concatenate([np.full(len(documents[d][0]), row, dtype=np.int32) for row, d in enumerate(row_ids)])
+        cols = np.concatenate([documents[d][0] for d in row_ids])
+        tf = np.concatenate([documents[d][1] for d in row_ids]).astype(np.float32)
+        doc_lengths = np.array([documents[d][1].sum() for d in row_ids], dtype=np.float32)
+        avg_length = max(float(doc_lengths.mean()), 1.0)
+        doc_freq = np.bincount(cols, minlength=shape[1]).astype(np.float32)
+        idf = np.log1p((shape[0] - doc_freq + 0.5) / (doc_freq + 0.5))
+        norm = self.k1 * (1.0 - self.b + self.b * doc_lengths[rows] / avg_length)
+        weights = idf[cols] * tf * (self.k1 + 1.0) / (tf + norm)
+        matrix = sparse.csc_matrix((weights, (rows, cols)), shape=shape, dtype=np.float32)
+        return _Weights(version, matrix, row_ids, group_rows)
+
+    def _current_weights(self) -> _Weights:
+        with self.lock:
+            weights = self._weights
+            if weights is not None and weights.version == self._version:
+                return weights
+        # One rebuild at a time; searches arriving while it runs use the previous matrix if there is one.
+        if not self.build_lock.acquire(blocking=weights is None):
+            return weights
+        try:
+            with self.lock:
+                if self._weights is not None and self._weights.version == self._version:
+                    return self._weights
+                version = self._version
+                documents, groups = dict(self.corpus.documents), dict(self.corpus.groups)
+                term_count = len(self.corpus.terms)
+            weights = self._build_weights(version, documents, groups, term_count)
+            with self.lock:
+                self._weights = weights
+            return weights
+        finally:
+            self.build_lock.release()
+
+    def search(self, query: str, k: int = 10, groups: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """Top `k` `(chunk id, score)` pairs for `query`, best first, optionally only within `groups`."""
+        self.ensure_loaded()
+        weights = self._current_weights()
+        with self.lock:
+            vocabulary = self.corpus.vocabulary
+            term_ids = sorted({vocabulary[t] for t in tokenize(query) if t in vocabulary})
+        term_ids = [term_id for term_id in term_ids if term_id < weights.matrix.shape[1]]
+        if not term_ids or not weights.row_ids:
+            return []
+        scores = np.asarray(weights.matrix[:, term_ids].sum(axis=1)).ravel()
+        rows = None
+        if groups is not None:
+            selected = [weights.group_rows[group] for group in groups if group in weights.group_rows]
+            if not selected:
+                return []
+            rows = np.concatenate(selected)
+        candidates = scores[rows] if rows is not None else scores
+        k = min(k, int(np.count_nonzero(candidates)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-candidates, k - 1)[:k]
+        top = top[np.argsort(-candidates[top])]
+        if rows is not None:
+            top = rows[top]
+        return [(weights.row_ids[i], float(scores[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse several best-first id rankings into one, scored by sum(1 / (k + rank))."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
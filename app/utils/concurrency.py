@@ -0,0 +1,42 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import settings
+
+BACKEND_LIMITS = {
+    "ollama": settings.OLLAMA_MAX_CONCURRENCY,
+    "openai": settings.OPENAI_MAX_CONCURRENCY,
+    "chroma": settings.CHROMA_MAX_CONCURRENCY,
+    "sqlite": settings.SQLITE_MAX_CONCURRENCY,
+}
+
+_executor = ThreadPoolExecutor(max_workers=settings.BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io")
+_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+def backend_limit(backend: str) -> asyncio.Semaphore:
+    """Semaphore bounding concurrent calls to `backend` from this process."""
+    semaphore = _semaphores.get(backend)
+    if semaphore is None:
+        semaphore = _semaphores.setdefault(backend, asyncio.Semaphore(BACKEND_LIMITS[backend]))
+    return semaphore
+
+
+def queue_depth() -> int:
+    """Calls waiting for a free thread on the shared executor."""
+    return _executor._work_queue.qsize()
+
+
+async def run_blocking(func, *args, backend: str = None, **kwargs):
+    """Run a blocking callable on the shared executor without stalling the event loop.
+
+    The caller's context variables (e.g. the request's stage timings) are visible to the callable.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    if backend is None:
+        return await loop.run_in_executor(_executor, call)
+    async with backend_limit(backend):
+        return await loop.run_in_executor(_executor, call)
@@ -1,63 +1,354 @@
+import queue
 import sqlite3
-from typing import List, Dict
+from contextlib import contextmanager
+from typing import List, Dict, Optional
 
-DB_NAME = "chat_history.db"
+from utils import settings
+from utils.metrics import timed
+from utils.tokens import estimate_tokens
+
+DB_NAME = settings.CHAT_DB_PATH
+
+
+class ConnectionPool:
+    """A small pool of SQLite connections shared across threads."""
+
+    def __init__(self, path: str, size: int = settings.SQLITE_POOL_SIZE):
+        self.path = path
+        self._connections = queue.LifoQueue(maxsize=size)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._connections.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            try:
+                self._connections.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+
+
+def get_pool(path: str = None) -> ConnectionPool:
+    path = path or DB_NAME
+    pool = _pools.get(path)
+    if pool is None:
+        pool = _pools.setdefault(path, ConnectionPool(path))
+    return pool
 
 
 def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+    with get_pool().connection() as conn:
+        conn.execute(
             """
             CREATE TABLE IF NOT EXISTS chat_messages (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id TEXT NOT NULL,
+                document_id TEXT,
                 role TEXT NOT NULL,
                 content TEXT NOT NULL,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP
             );
         """
         )
-        conn.commit()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chat_messages)")}
+        if "document_id" not in columns:
+            conn.execute("ALTER TABLE chat_messages ADD COLUMN document_id TEXT")
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_chat_messages_user_document_created
+                ON chat_messages (user_id, document_id, created_at)
+        """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                document_id TEXT NOT NULL,
+                collection_name TEXT NOT NULL,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                chunks_done INTEGER NOT NULL DEFAULT 0,
+                bytes_done INTEGER NOT NULL DEFAULT 0,
+                bytes_total INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            );
+        """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                user_id TEXT NOT NULL,
+                document_id TEXT NOT NULL,
+                collection_name TEXT NOT NULL,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, document_id)
+            );
+        """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chat_summaries (
+                user_id TEXT NOT NULL,
+                document_id TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                last_message_id INTEGER NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, document_id)
+            );
+        """
+        )
 
 
-def add_message(user_id: str, role: str, content: str) -> None:
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+@timed("add_message")
+def add_message(user_id: str, role: str, content: str, document_id: Optional[str] = None) -> None:
+    with get_pool().connection() as conn:
+        conn.execute(
             """
-            INSERT INTO chat_messages (user_id, role, content)
-            VALUES (?, ?, ?)
+            INSERT INTO chat_messages (user_id, document_id, role, content)
+            VALUES (?, ?, ?, ?)
         """,
-            (user_id, role, content),
-        )  # <-- Supply parameters here
-        conn.commit()
+            (user_id, document_id, role, content),
+        )
 
 
-def get_chat_history(user_id: str) -> List[Dict[str, str]]:
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+@timed("add_turn")
+def add_turn(user_id: str, request: str, answer: str, document_id: Optional[str] = None) -> None:
+    """Stores a user message and the assistant's answer together, so neither is kept without the other."""
+    with get_pool().connection() as conn:
+        conn.executemany(
             """
-            SELECT role, content
-                FROM chat_messages
-                WHERE user_id = ?
-                ORDER BY created_at ASC
+            INSERT INTO chat_messages (user_id, document_id, role, content)
+            VALUES (?, ?, ?, ?)
         """,
-            (user_id,),
+            [(user_id, document_id, "user", request), (user_id, document_id, "assistant", answer)],
         )
-        rows = cursor.fetchall()
-    history = []
-    for row in rows:
-        role, content = row
-        history.append({"role": role, "content": content})
-    return history
+
+
+def get_chat_history_page(
+    user_id: str, document_id: Optional[str] = None, limit: int = 50, before_id: Optional[int] = None
+) -> Dict:
+    """Newest-first page of messages, oldest-first within the page.
+
+    Pass the returned `next_before_id` as `before_id` to fetch the previous page.
+    """
+    query = "SELECT id, role, content, created_at FROM chat_messages WHERE user_id = ?"
+    params = [user_id]
+    if document_id is not None:
+        query += " AND document_id = ?"
+        params.append(document_id)
+    if before_id is not None:
+        query += " AND id < ?"
+        params.append(before_id)
+    query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit)
+
+    with get_pool().connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+    messages = [
+        {"id": row[0], "role": row[1], "content": row[2], "created_at": row[3]} for row in reversed(rows)
+    ]
+    next_before_id = messages[0]["id"] if len(rows) == limit else None
+    return {"messages": messages, "next_before_id": next_before_id}
+
+
+@timed("chat_history")
+def get_chat_history(
+    user_id: str,
+    document_id: Optional[str] = None,
+    max_messages: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+) -> List[Dict[str, str]]:
+    """Most recent messages as model-ready `{"role", "content"}` dicts, oldest first.
+
+    The window is bounded by `max_messages` and/or an estimated `max_tokens`
+    budget; with neither, the full history is returned.
+    """
+    page_size = max_messages or 200
+    window = []
+    tokens = 0
+    before_id = None
+    while True:
+        page = get_chat_history_page(user_id, document_id=document_id, limit=page_size, before_id=before_id)
+        for message in reversed(page["messages"]):
+            if max_messages is not None and len(window) >= max_messages:
+                break
+            tokens += estimate_tokens(message["content"])
+            if max_tokens is not None and tokens > max_tokens and window:
+                break
+            window.append({"role": message["role"], "content": message["content"]})
+        else:
+            before_id = page["next_before_id"]
+            if before_id is not None:
+                continue
+        break
+    window.reverse()
+    return window
+
+
+def _conversation_filter(user_id: str, document_id: Optional[str]):
+    if document_id is None:
+        return "user_id = ?", [user_id]
+    return "user_id = ? AND document_id = ?", [user_id, document_id]
+
+
+def get_messages_after(
+    user_id: str, document_id: Optional[str] = None, after_id: int = 0, limit: Optional[int] = None
+) -> List[Dict]:
+    """Messages after `after_id`, oldest first; with `limit`, only the `limit` newest of them."""
+    condition, params = _conversation_filter(user_id, document_id)
+    query = f"SELECT id, role, content FROM chat_messages WHERE {condition} AND id > ? ORDER BY id DESC"
+    params.append(after_id)
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    with get_pool().connection() as conn:
+        rows = conn.execute(query, params).fetchall()
+    return [{"id": row[0], "role": row[1], "content": row[2]} for row in reversed(rows)]
+
+
+def get_messages_to_summarize(
+    user_id: str, document_id: Optional[str] = None, after_id: int = 0, keep_recent: int = 0, limit: int = 50
+) -> List[Dict]:
+    """Up to `limit` messages after `after_id`, oldest first, leaving out the `keep_recent` newest."""
+    condition, params = _conversation_filter(user_id, document_id)
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT id, role, content FROM chat_messages
+            WHERE {condition} AND id > ?
+                AND id NOT IN (SELECT id FROM chat_messages WHERE {condition} ORDER BY id DESC LIMIT ?)
+            ORDER BY id LIMIT ?
+        """,
+            (*params, after_id, *params, keep_recent, limit),
+        ).fetchall()
+    return [{"id": row[0], "role": row[1], "content": row[2]} for row in rows]
+
+
+def get_chat_summary(user_id: str, document_id: Optional[str] = None) -> Optional[Dict]:
+    """Running summary of a conversation and the ID of the last message it covers."""
+    with get_pool().connection() as conn:
+        row = conn.execute(
+            "SELECT summary, last_message_id FROM chat_summaries WHERE user_id = ? AND document_id = ?",
+            (user_id, document_id or ""),
+        ).fetchone()
+    return {"summary": row[0], "last_message_id": row[1]} if row else None
+
+
+def save_chat_summary(user_id: str, document_id: Optional[str], summary: str, last_message_id: int) -> None:
+    with get_pool().connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO chat_summaries (user_id, document_id, summary, last_message_id)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, document_id) DO UPDATE SET
+                summary = excluded.summary,
+                last_message_id = excluded.last_message_id,
+                updated_at = CURRENT_TIMESTAMP
+        """,
+            (user_id, document_id or "", summary, last_message_id),
+        )
+
+
+INGEST_JOB_COLUMNS = (
+    "id", "user_id", "document_id", "collection_name", "path", "status",
+    "chunks_done", "bytes_done", "bytes_total", "error", "created_at", "updated_at",
+)
+
+
+def create_ingest_job(
+    job_id: str, user_id: str, document_id: str, collection_name: str, path: str, bytes_total: int
+) -> None:
+    with get_pool().connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO ingest_jobs (id, user_id, document_id, collection_name, path, status, bytes_total)
+            VALUES (?, ?, ?, ?, ?, 'queued', ?)
+        """,
+            (job_id, user_id, document_id, collection_name, path, bytes_total),
+        )
+
+
+def update_ingest_job(job_id: str, **fields) -> None:
+    unknown = set(fields) - set(INGEST_JOB_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown ingest job columns: {sorted(unknown)}")
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    with get_pool().connection() as conn:
+        conn.execute(
+            f"UPDATE ingest_jobs SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (*fields.values(), job_id),
+        )
+
+
+def get_ingest_job(job_id: str) -> Optional[Dict]:
+    with get_pool().connection() as conn:
+        row = conn.execute(
+            f"SELECT {', '.join(INGEST_JOB_COLUMNS)} FROM ingest_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    return dict(zip(INGEST_JOB_COLUMNS, row)) if row else None
+
+
+def list_ingest_jobs(statuses: List[str]) -> List[Dict]:
+    """Jobs in any of `statuses`, oldest first."""
+    placeholders = ", ".join("?" for _ in statuses)
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            f"SELECT {', '.join(INGEST_JOB_COLUMNS)} FROM ingest_jobs"
+            f" WHERE status IN ({placeholders}) ORDER BY created_at, rowid",
+            statuses,
+        ).fetchall()
+    return [dict(zip(INGEST_JOB_COLUMNS, row)) for row in rows]
+
+
+DOCUMENT_COLUMNS = ("document_id", "collection_name", "chunks", "created_at", "updated_at")
+
+
+def register_document(user_id: str, document_id: str, collection_name: str, chunks: int) -> None:
+    with get_pool().connection() as conn:
+        conn.execute(
+            """
+            INSERT INTO documents (user_id, document_id, collection_name, chunks)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id, document_id) DO UPDATE SET
+                collection_name = excluded.collection_name,
+                chunks = excluded.chunks,
+                updated_at = CURRENT_TIMESTAMP
+        """,
+            (user_id, document_id, collection_name, chunks),
+        )
+
+
+def list_user_documents(user_id: str) -> List[Dict]:
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            f"SELECT {', '.join(DOCUMENT_COLUMNS)} FROM documents WHERE user_id = ? ORDER BY created_at, document_id",
+            (user_id,),
+        ).fetchall()
+    return [dict(zip(DOCUMENT_COLUMNS, row)) for row in rows]
 
 
 def delete_table():
-    with sqlite3.connect(DB_NAME) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+    with get_pool().connection() as conn:
+        conn.execute(
             """
         DROP TABLE chat_messages;
         """
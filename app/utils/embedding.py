@@ -1,9 +1,160 @@
-from chromadb.utils import embedding_functions
-import os
+from concurrent.futures import Executor
+from typing import List, Sequence
 
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from sklearn.feature_extraction.text import HashingVectorizer
 
-class Embedding:
-    def __init__(self):
-        self.embedding_function = embedding_functions.OpenAIEmbeddingFunction(
-            api_key=os.getenv("OPENAI_API_KEY"), model_name="text-embedding-3-small"
+from utils import settings
+from utils.embedding_cache import EmbeddingCache
+from utils.tokens import token_budget_batches
+
+OPENAI_EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+# Collections created before backends were recorded in their metadata were all
+# built with OpenAI text-embedding-3-small.
+LEGACY_BACKEND_NAME = "openai:text-embedding-3-small"
+LEGACY_BACKEND_DIMENSION = 1536
+
+
+class EmbeddingBackend:
+    """Turns a batch of texts into a float32 matrix of shape (len(texts), dimension)."""
+
+    name: str
+    dimension: int
+    # Whether results are worth persisting in the EmbeddingCache.
+    cacheable: bool = True
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, client, model_name: str = settings.EMBEDDING_MODEL, executor: Executor = None):
+        self.client = client
+        self.model_name = model_name
+        self.executor = executor
+        self.name = f"openai:{model_name}"
+        self.dimension = OPENAI_EMBEDDING_DIMENSIONS.get(model_name) or len(self._embed_batch(["dimension probe"])[0])
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(model=self.model_name, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        batches = token_budget_batches(
+            texts,
+            max_tokens=settings.EMBEDDING_BATCH_MAX_TOKENS,
+            max_items=settings.EMBEDDING_BATCH_MAX_INPUTS,
         )
+        if len(batches) <= 1 or self.executor is None:
+            vectors = [vector for batch in batches for vector in self._embed_batch([texts[i] for i in batch])]
+        else:
+            futures = [self.executor.submit(self._embed_batch, [texts[i] for i in batch]) for batch in batches]
+            vectors = [vector for future in futures for vector in future.result()]
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dimension)
+
+
+class OllamaEmbeddingBackend(EmbeddingBackend):
+    def __init__(self, client, model_name: str = settings.OLLAMA_EMBEDDING_MODEL, batch_size: int = 64):
+        self.client = client
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.name = f"ollama:{model_name}"
+        self.dimension = len(self.client.embed(model=self.model_name, input=["dimension probe"]).embeddings[0])
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = []
+        for offset in range(0, len(texts), self.batch_size):
+            response = self.client.embed(
+                model=self.model_name,
+                input=texts[offset:offset + self.batch_size],
+                keep_alive=settings.OLLAMA_KEEP_ALIVE,
+            )
+            vectors.extend(response.embeddings)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dimension)
+
+
+class HashingEmbeddingBackend(EmbeddingBackend):
+    """Fully local embeddings: hashed word uni/bi-gram counts, L2-normalised.
+
+    No model, no network and no fitting step, so vectors are stable across
+    processes and machines. Quality is lexical rather than semantic.
+    """
+
+    cacheable = False
+
+    def __init__(self, dimension: int = settings.HASHING_EMBEDDING_DIMENSION):
+        self.dimension = dimension
+        self.name = f"hashing:{dimension}"
+        self.vectorizer = HashingVectorizer(
+            n_features=dimension,
+            ngram_range=(1, 2),
+            alternate_sign=True,
+            norm="l2",
+            dtype=np.float32,
+        )
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.vectorizer.transform(texts).toarray()
+
+
+def create_embedding_backend(
+    backend: str = settings.EMBEDDING_BACKEND, openai_client=None, ollama_client=None, executor: Executor = None
+) -> EmbeddingBackend:
+    if backend == "openai":
+        return OpenAIEmbeddingBackend(openai_client, executor=executor)
+    if backend == "ollama":
+        return OllamaEmbeddingBackend(ollama_client)
+    if backend == "hashing":
+        return HashingEmbeddingBackend()
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+class BackendEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function backed by an `Embedding`, so queries share its cache."""
+
+    def __init__(self, embedding: "Embedding"):
+        self.embedding = embedding
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return list(self.embedding.embed(list(input)))
+
+
+class Embedding:
+    def __init__(self, backend: EmbeddingBackend, cache: EmbeddingCache = None):
+        self.backend = backend
+        self.cache = cache
+        self.embedding_function = BackendEmbeddingFunction(self)
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    @property
+    def dimension(self) -> int:
+        return self.backend.dimension
+
+    def embed(self, texts: Sequence[str]) -> List[np.ndarray]:
+        texts = list(texts)
+        if self.cache is None:
+            return list(self.backend.embed(texts))
+        return self.cache.get_or_compute(self.backend.name, texts, self.backend.embed)
+
+    def collection_metadata(self) -> dict:
+        return {"embedding_backend": self.name, "embedding_dimension": self.dimension}
+
+    def check_collection(self, collection) -> None:
+        """Refuse to use a collection built with a different backend or dimension."""
+        metadata = collection.metadata or {}
+        built_with = metadata.get("embedding_backend", LEGACY_BACKEND_NAME)
+        dimension = metadata.get("embedding_dimension", LEGACY_BACKEND_DIMENSION)
+        if built_with != self.name or dimension != self.dimension:
+            raise ValueError(
+                f"Collection {collection.name} was built with {built_with} ({dimension} dims) "
+                f"but the configured embedding backend is {self.name} ({self.dimension} dims)"
+            )
@@ -0,0 +1,166 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence
+
+import numpy as np
+
+from utils import settings
+from utils.logger import Logger
+
+
+class EmbeddingCache:
+    """Two-tier (memory LRU + SQLite) cache of embeddings keyed by hash(model, text)."""
+
+    def __init__(
+        self,
+        path: str = settings.EMBEDDING_CACHE_PATH,
+        max_memory_items: int = settings.EMBEDDING_CACHE_MEMORY_ITEMS,
+        max_disk_items: int = settings.EMBEDDING_CACHE_DISK_ITEMS,
+        ttl_seconds: float = settings.EMBEDDING_CACHE_TTL_SECONDS,
+    ):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl_seconds = ttl_seconds
+        self.logger = Logger("EmbeddingCache")
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._writes_since_trim = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+        """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, vector: np.ndarray, created_at: float) -> None:
+        self._memory[key] = (vector, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[np.ndarray]]:
+        now = time.time()
+        found = [None] * len(keys)
+        with self._lock:
+            disk_lookup = {}
+            for i, key in enumerate(keys):
+                entry = self._memory.get(key)
+                if entry is not None and not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    found[i] = entry[0]
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+            if disk_lookup:
+                # Stay below SQLite's bound-parameter limit on very large documents.
+                lookup_keys = list(disk_lookup)
+                rows = []
+                for offset in range(0, len(lookup_keys), 500):
+                    batch = lookup_keys[offset:offset + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows.extend(
+                        self._conn.execute(
+                            f"SELECT key, vector, created_at FROM embeddings WHERE key IN ({placeholders})", batch
+                        ).fetchall()
+                    )
+                used = []
+                for key, blob, created_at in rows:
+                    if self._expired(created_at, now):
+                        continue
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, vector, created_at)
+                    for i in disk_lookup[key]:
+                        found[i] = vector
+                    self.disk_hits += len(disk_lookup[key])
+                    used.append((now, key))
+                if used:
+                    self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", used)
+                    self._conn.commit()
+            self.misses += sum(1 for vector in found if vector is None)
+        return found
+
+    def put_many(self, keys: Sequence[str], vectors: Sequence) -> None:
+        now = time.time()
+        rows = []
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector, now)
+                rows.append((key, vector.tobytes(), now, now))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._writes_since_trim += len(rows)
+            if self._writes_since_trim >= 1000:
+                self._trim()
+
+    def _trim(self) -> None:
+        self._writes_since_trim = 0
+        if self.ttl_seconds > 0:
+            self._conn.execute("DELETE FROM embeddings WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.max_disk_items:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_disk_items,),
+            )
+        self._conn.commit()
+
+    def get_or_compute(self, model: str, texts: Sequence[str], compute: Callable[[List[str]], Sequence]) -> List[np.ndarray]:
+        """Return embeddings for `texts`, calling `compute` only for texts not in the cache."""
+        keys = [self.make_key(model, text) for text in texts]
+        vectors = self.get_many(keys)
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(keys[i], []).append(i)
+        if not missing:
+            return vectors
+
+        missing_texts = [texts[indices[0]] for indices in missing.values()]
+        computed = compute(missing_texts)
+        if computed is None:
+            return None
+        self.put_many(list(missing), computed)
+        for indices, vector in zip(missing.values(), computed):
+            vector = np.asarray(vector, dtype=np.float32)
+            for i in indices:
+                vectors[i] = vector
+        return vectors
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_items": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
@@ -1,33 +1,184 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import queue
+import random
+import sys
+import threading
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from utils import settings
+
+ROOT_LOGGER = "rag"
+
+# Id of the HTTP request being handled, attached to every record logged while handling it.
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+_configure_lock = threading.Lock()
+_listener = None
+
+
+class ContextFilter(logging.Filter):
+    """Attaches the request id and samples DEBUG records.
+
+    Attached to the queue handler, so it runs on the thread that logs, before
+    the record is queued: the request id is read from that caller's context,
+    and dropped debug records are never formatted.
+    """
+
+    def __init__(self, debug_sample_rate: float = 1.0):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG and self.debug_sample_rate < 1.0:
+            if random.random() >= self.debug_sample_rate:
+                return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves the formatting of the log line to the listener thread.
+
+    Like the stock `prepare`, it merges `msg % args` on the caller's thread,
+    so arguments that change after the call are logged as they were, and
+    drops `args` and `exc_info` so no live objects are held by the queue. The
+    traceback is kept as `exc_text`. Unlike the stock `prepare`, it does not
+    apply the handler's formatter, which stays with the listener's handler.
+    """
+
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(
+    level: str = settings.LOG_LEVEL,
+    fmt: str = settings.LOG_FORMAT,
+    debug_sample_rate: float = settings.LOG_DEBUG_SAMPLE_RATE,
+) -> None:
+    """Route the `rag` logger tree through one queue to a background writer thread.
+
+    Idempotent: later calls are no-ops, however many `Logger`s get created.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    with _configure_lock:
+        if _listener is not None:
+            return
+        stream_handler = logging.StreamHandler(sys.stderr)
+        if fmt == "json":
+            stream_handler.setFormatter(JsonFormatter())
+        else:
+            stream_handler.setFormatter(
+                logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s")
+            )
+        log_queue = queue.SimpleQueue()
+        queue_handler = DeferredQueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter(debug_sample_rate))
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(level.upper())
+        root.handlers = [queue_handler]
+        root.propagate = False
+
+        listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        _listener = listener
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class RequestIdMiddleware:
+    """ASGI middleware binding an id to each request (from `X-Request-ID` or a new one).
+
+    The id is available to log records through `request_id_var` and echoed in
+    the `X-Request-ID` response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")[:64] or new_request_id()
+        token = request_id_var.set(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
+
 
 class Logger:
-    def __init__(self, name: str = "RAG-DB", log_level: int = logging.DEBUG):
-        # Create a logger
-        self.logger = logging.getLogger(name)
-        self.logger.setLevel(log_level)
+    """Named logger under the shared `rag` tree.
+
+    Cheap to construct per request: no handlers are added. Messages take
+    %-style arguments, which are only formatted if the record is emitted.
+    """
 
-        # Create a console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(log_level)
+    def __init__(self, name: str = "RAG-DB", log_level: int = None):
+        configure_logging()
+        self.logger = logging.getLogger(f"{ROOT_LOGGER}.{name}")
+        if log_level is not None:
+            self.logger.setLevel(log_level)
 
-        # Create a formatter and set it for the handler
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        console_handler.setFormatter(formatter)
+    def is_enabled(self, level: int) -> bool:
+        return self.logger.isEnabledFor(level)
 
-        # Add the console handler to the logger
-        self.logger.addHandler(console_handler)
+    def debug(self, message: str, *args, **kwargs):
+        self.logger.debug(message, *args, **kwargs)
 
-    def debug(self, message: str):
-        self.logger.debug(message)
+    def info(self, message: str, *args, **kwargs):
+        self.logger.info(message, *args, **kwargs)
 
-    def info(self, message: str):
-        self.logger.info(message)
+    def warning(self, message: str, *args, **kwargs):
+        self.logger.warning(message, *args, **kwargs)
 
-    def warning(self, message: str):
-        self.logger.warning(message)
+    def error(self, message: str, *args, **kwargs):
+        self.logger.error(message, *args, **kwargs)
 
-    def error(self, message: str):
-        self.logger.error(message)
+    def exception(self, message: str, *args, **kwargs):
+        self.logger.exception(message, *args, **kwargs)
 
-    def critical(self, message: str):
-        self.logger.critical(message)
+    def critical(self, message: str, *args, **kwargs):
+        self.logger.critical(message, *args, **kwargs)
@@ -0,0 +1,252 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from utils import settings
+
+ENABLED = settings.METRICS_ENABLED
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+# (stage, seconds) recorded during the current HTTP request, for the Server-Timing header.
+_request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+_NOOP = nullcontext()
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if not ENABLED:
+            return
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        if not ENABLED:
+            return
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            values = [(key, list(series)) for key, series in self._values.items()]
+        for key, series in values:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "Time spent per request stage.", ["stage"])
+HTTP_SECONDS = Histogram(
+    "rag_http_request_duration_seconds", "HTTP request latency until the response completes.", ["handler", "status"]
+)
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Model tokens by kind (prompt, completion, reasoning).", ["model", "kind"])
+LLM_TOKENS_PER_CALL = Histogram(
+    "rag_llm_tokens_per_call", "Model tokens per call by kind.", ["model", "kind"], buckets=TOKEN_BUCKETS
+)
+LLM_BACKEND_REQUESTS = Counter(
+    "rag_llm_backend_requests_total", "Model calls per backend host by outcome.", ["backend", "outcome"]
+)
+LLM_BACKEND_SECONDS = Histogram("rag_llm_backend_duration_seconds", "Model call latency per backend host.", ["backend"])
+MODEL_LOAD_SECONDS = Histogram(
+    "rag_model_load_seconds",
+    "Time to load a model on an Ollama host at warm-up or after eviction.",
+    ["backend", "model"],
+)
+REASONING_TOKENS = Histogram(
+    "rag_llm_reasoning_tokens", "Reasoning tokens per generation by budget.", ["budget"], buckets=TOKEN_BUCKETS
+)
+REASONING_CUTOFFS = Counter("rag_llm_reasoning_cutoffs_total", "Reasoning phases cut short by budget.", ["budget"])
+
+_metrics = [
+    STAGE_SECONDS,
+    HTTP_SECONDS,
+    LLM_TOKENS,
+    LLM_TOKENS_PER_CALL,
+    LLM_BACKEND_REQUESTS,
+    LLM_BACKEND_SECONDS,
+    MODEL_LOAD_SECONDS,
+    REASONING_TOKENS,
+    REASONING_CUTOFFS,
+]
+# Callables returning `(name, type, help, [(labels dict, value), ...])` families, read at scrape time.
+_collectors: List[Callable[[], Iterable[Tuple[str, str, str, list]]]] = []
+
+
+def register_collector(collector: Callable[[], Iterable[Tuple[str, str, str, list]]]) -> None:
+    _collectors.append(collector)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Record a stage duration measured elsewhere (e.g. reported by Ollama)."""
+    if not ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def _span(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started)
+
+
+def span(stage: str):
+    """Context manager timing a stage; a shared no-op when metrics are disabled."""
+    return _span(stage) if ENABLED else _NOOP
+
+
+def timed(stage: str):
+    """Decorator timing every call of a sync or async function as `stage`."""
+
+    def decorator(func):
+        if not ENABLED:
+            return func
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with _span(stage):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _span(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_tokens(model: str, prompt: int = None, completion: int = None, reasoning: int = None) -> None:
+    if not ENABLED:
+        return
+    for kind, count in (("prompt", prompt), ("completion", completion), ("reasoning", reasoning)):
+        if count:
+            LLM_TOKENS.inc(count, model=model, kind=kind)
+            LLM_TOKENS_PER_CALL.observe(count, model=model, kind=kind)
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, kind, documentation, samples in collector():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {float(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(timings: List[Tuple[str, float]], total: float) -> str:
+    """`Server-Timing` header value; repeated stages are summed, in first-seen order."""
+    merged: Dict[str, float] = {}
+    for stage, seconds in timings:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+    merged["total"] = total
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in merged.items())
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency and emitting `Server-Timing`.
+
+    The header lists the stages finished before the response starts; for
+    streamed responses later stages only reach the histograms.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings: List[Tuple[str, float]] = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing(list(timings), time.perf_counter() - started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - started, handler=handler, status=status)
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from utils import settings
+from utils.logger import Logger
+from utils.metrics import MODEL_LOAD_SECONDS
+from utils.ollama import OllamaEndpoint, OllamaRouter
+
+
+def _tagged(model: str) -> str:
+    """Model name as Ollama lists it, with the implicit `latest` tag."""
+    return model if ":" in model else f"{model}:latest"
+
+
+class ModelLifecycle:
+    """Loads the configured models on every Ollama host and keeps them there.
+
+    At startup each model is preloaded with `keep_alive` (by default pinned
+    until Ollama restarts). Afterwards every `interval` seconds the resident
+    models of each healthy host are listed and evicted ones are loaded again,
+    e.g. after a host restart. `ready()` is true once every healthy host has
+    every model resident.
+    """
+
+    def __init__(
+        self,
+        models: List[str] = None,
+        keep_alive=settings.OLLAMA_KEEP_ALIVE,
+        interval: float = settings.OLLAMA_HEALTH_CHECK_INTERVAL,
+    ):
+        self.models = list(settings.OLLAMA_PRELOAD_MODELS if models is None else models)
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.router: Optional[OllamaRouter] = None
+        # host -> models seen resident at the last check
+        self.resident: Dict[str, set] = {}
+        # host -> model -> seconds the last load took
+        self.load_seconds: Dict[str, Dict[str, float]] = {}
+        self._task = None
+        self.logger = Logger("ModelLifecycle")
+
+    async def _load(self, endpoint: OllamaEndpoint, model: str) -> None:
+        started = time.perf_counter()
+        if model == settings.OLLAMA_EMBEDDING_MODEL:
+            await endpoint.async_client.embed(model=model, input="warm-up", keep_alive=self.keep_alive)
+        else:
+            # A chat request without messages only loads the model.
+            await endpoint.async_client.chat(model=model, messages=[], keep_alive=self.keep_alive)
+        seconds = time.perf_counter() - started
+        self.load_seconds.setdefault(endpoint.host, {})[model] = seconds
+        MODEL_LOAD_SECONDS.observe(seconds, backend=endpoint.host, model=model)
+        self.logger.info("Loaded %s on %s in %.1f s", model, endpoint.host, seconds)
+
+    async def _ensure_resident(self, endpoint: OllamaEndpoint) -> None:
+        try:
+            running = await endpoint.async_client.ps()
+            resident = {_tagged(model.model) for model in running.models}
+        except Exception as e:
+            self.logger.warning("Could not list models on %s: %s", endpoint.host, e)
+            resident = set()
+        for model in self.models:
+            if _tagged(model) in resident:
+                continue
+            try:
+                await self._load(endpoint, model)
+                resident.add(_tagged(model))
+            except Exception as e:
+                self.logger.error("Failed to load %s on %s: %s", model, endpoint.host, e)
+        self.resident[endpoint.host] = resident
+
+    async def ensure_resident(self) -> None:
+        await asyncio.gather(
+            *(self._ensure_resident(endpoint) for endpoint in self.router.endpoints if endpoint.healthy)
+        )
+
+    async def _loop(self):
+        while True:
+            await self.ensure_resident()
+            await asyncio.sleep(self.interval)
+
+    def start(self, router: OllamaRouter) -> None:
+        """Warm up in the background; needs a running event loop."""
+        self.router = router
+        if self.models and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def ready(self) -> bool:
+        if not self.models:
+            return True
+        if self.router is None:
+            return False
+        healthy = [endpoint for endpoint in self.router.endpoints if endpoint.healthy]
+        wanted = {_tagged(model) for model in self.models}
+        return bool(healthy) and all(wanted <= self.resident.get(endpoint.host, set()) for endpoint in healthy)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready(),
+            "models": self.models,
+            "keep_alive": self.keep_alive,
+            "hosts": {
+                host: {
+                    "resident": sorted(model for model in self.models if _tagged(model) in resident),
+                    "load_seconds": {model: round(s, 3) for model, s in self.load_seconds.get(host, {}).items()},
+                }
+                for host, resident in self.resident.items()
+            },
+        }
@@ -0,0 +1,30 @@
+import threading
+
+import nltk
+
+# (resource name, path used by nltk.data.find)
+NLTK_RESOURCES = [
+    ("punkt", "tokenizers/punkt"),
+    ("punkt_tab", "tokenizers/punkt_tab"),
+    ("wordnet", "corpora/wordnet"),
+    ("omw-1.4", "corpora/omw-1.4"),
+]
+
+_lock = threading.Lock()
+_ready = False
+
+
+def ensure_nltk_resources() -> None:
+    """Download the NLTK resources used for sentence splitting once per process."""
+    global _ready
+    if _ready:
+        return
+    with _lock:
+        if _ready:
+            return
+        for name, path in NLTK_RESOURCES:
+            try:
+                nltk.data.find(path)
+            except LookupError:
+                nltk.download(name, quiet=True)
+        _ready = True
@@ -1,19 +1,360 @@
-from ollama import Client
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import httpx
+from ollama import AsyncClient, Client, ResponseError
 from pydantic import BaseModel
 
+from utils import settings
+from utils.logger import Logger
+from utils.metrics import (
+    LLM_BACKEND_REQUESTS,
+    LLM_BACKEND_SECONDS,
+    REASONING_CUTOFFS,
+    REASONING_TOKENS,
+    record_stage,
+    record_tokens,
+    span,
+)
+from utils.reasoning import THINK_CLOSE, ThinkFilter, strip_reasoning
+
+# Weight of the latest call in a host's moving average latency.
+LATENCY_SMOOTHING = 0.2
+
+
+def _is_host_failure(error: Exception) -> bool:
+    """Whether an error says something about the host rather than about the request."""
+    if isinstance(error, ResponseError):
+        return error.status_code < 0 or error.status_code >= 500
+    return True
+
+
+class OllamaEndpoint:
+    """One Ollama host with its clients, concurrency limit, load and health."""
+
+    def __init__(self, host: str, max_in_flight: int = settings.OLLAMA_MAX_CONCURRENCY):
+        self.host = host
+        self.client = Client(host=host)
+        self.async_client = AsyncClient(host=host, limits=httpx.Limits(max_connections=max_in_flight))
+        self.max_in_flight = max_in_flight
+        self.limit = asyncio.Semaphore(max_in_flight)
+        # Calls routed here that have not finished, including ones waiting for `limit`.
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.healthy = True
+        self.failures = 0
+
+    @property
+    def saturated(self) -> bool:
+        return self.in_flight >= self.max_in_flight
+
+    def load(self):
+        """Sort key for least-loaded routing: queue occupancy, then typical latency."""
+        return self.in_flight / self.max_in_flight, self.latency or 0.0
+
+    def stats(self) -> dict:
+        return {
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "consecutive_failures": self.failures,
+        }
+
+
+class OllamaRouter:
+    """Spreads generation over a pool of Ollama hosts.
+
+    Each call goes to the healthy host with the fewest calls in flight
+    (relative to its limit), ties broken by moving average latency. Hosts
+    are taken out after `max_failures` consecutive failed calls or a failed
+    health check, and put back by the next good health check. A call whose
+    answer takes longer than `hedge_after` seconds is duplicated on another
+    idle host and the first answer wins; a call that fails on its host is
+    retried once elsewhere. When every host is saturated or down, callers
+    can send the generation to `overflow` (an OpenAI client) instead.
+    """
+
+    def __init__(
+        self,
+        hosts: List[str],
+        overflow=None,
+        hedge_after: float = settings.OLLAMA_HEDGE_AFTER,
+        health_interval: float = settings.OLLAMA_HEALTH_CHECK_INTERVAL,
+        health_timeout: float = settings.OLLAMA_HEALTH_CHECK_TIMEOUT,
+        max_failures: int = settings.OLLAMA_MAX_FAILURES,
+    ):
+        if not hosts:
+            raise ValueError("At least one Ollama host is required")
+        self.endpoints = [OllamaEndpoint(host) for host in hosts]
+        self.overflow = overflow
+        self.hedge_after = hedge_after
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.max_failures = max_failures
+        self.hedged = 0
+        self.retried = 0
+        self.overflowed = 0
+        self._health_task = None
+        self.logger = Logger("OllamaRouter")
+
+    def pick(self, exclude=()) -> Optional[OllamaEndpoint]:
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+        # With every host marked down, keep trying them rather than failing outright.
+        candidates = healthy or ([] if exclude else candidates)
+        return min(candidates, key=OllamaEndpoint.load) if candidates else None
+
+    def should_overflow(self) -> bool:
+        if self.overflow is None:
+            return False
+        if all(endpoint.saturated or not endpoint.healthy for endpoint in self.endpoints):
+            self.overflowed += 1
+            return True
+        return False
+
+    def _set_health(self, endpoint: OllamaEndpoint, healthy: bool, reason: str = "") -> None:
+        if endpoint.healthy != healthy:
+            if healthy:
+                self.logger.info("Ollama host %s is back", endpoint.host)
+            else:
+                self.logger.warning("Ollama host %s taken out of rotation: %s", endpoint.host, reason)
+        endpoint.healthy = healthy
+
+    def record_success(self, endpoint: OllamaEndpoint, seconds: float) -> None:
+        endpoint.failures = 0
+        if endpoint.latency is None:
+            endpoint.latency = seconds
+        else:
+            endpoint.latency += LATENCY_SMOOTHING * (seconds - endpoint.latency)
+        LLM_BACKEND_REQUESTS.inc(backend=endpoint.host, outcome="ok")
+        LLM_BACKEND_SECONDS.observe(seconds, backend=endpoint.host)
+
+    def record_failure(self, endpoint: OllamaEndpoint, error: Exception) -> None:
+        LLM_BACKEND_REQUESTS.inc(backend=endpoint.host, outcome="error")
+        if not _is_host_failure(error):
+            return
+        endpoint.failures += 1
+        if endpoint.failures >= self.max_failures:
+            self._set_health(endpoint, False, f"{endpoint.failures} consecutive failures ({error})")
+
+    @asynccontextmanager
+    async def acquire(self, endpoint: OllamaEndpoint):
+        """Hold one of the host's call slots; waiting time is recorded as `llm_wait`."""
+        endpoint.in_flight += 1
+        try:
+            async with self._slot(endpoint):
+                yield endpoint
+        finally:
+            endpoint.in_flight -= 1
+
+    @asynccontextmanager
+    async def _slot(self, endpoint: OllamaEndpoint):
+        waiting = time.perf_counter()
+        async with endpoint.limit:
+            record_stage("llm_wait", time.perf_counter() - waiting)
+            yield
+
+    def _submit(self, endpoint: OllamaEndpoint, **kwargs) -> asyncio.Future:
+        # Count the call right away, so that routing decisions made before the task runs see it.
+        endpoint.in_flight += 1
+        task = asyncio.ensure_future(self._chat_on(endpoint, **kwargs))
+        task.add_done_callback(lambda _: setattr(endpoint, "in_flight", endpoint.in_flight - 1))
+        return task
+
+    async def _chat_on(self, endpoint: OllamaEndpoint, **kwargs):
+        async with self._slot(endpoint):
+            started = time.perf_counter()
+            try:
+                response = await endpoint.async_client.chat(**kwargs)
+            except asyncio.CancelledError:
+                LLM_BACKEND_REQUESTS.inc(backend=endpoint.host, outcome="cancelled")
+                raise
+            except Exception as e:
+                self.record_failure(endpoint, e)
+                raise
+            self.record_success(endpoint, time.perf_counter() - started)
+        return response
+
+    async def chat(self, **kwargs):
+        """Non-streaming `AsyncClient.chat` on the pool, hedged and retried as configured."""
+        tried = [self.pick()]
+        pending = {self._submit(tried[0], **kwargs)}
+        retries = 1
+        try:
+            if self.hedge_after > 0 and len(self.endpoints) > 1:
+                done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+                backup = None if done else self.pick(exclude=tried)
+                if backup is not None and not backup.saturated:
+                    tried.append(backup)
+                    self.hedged += 1
+                    pending.add(self._submit(backup, **kwargs))
+                pending |= done
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if pending:
+                    continue
+                retry = self.pick(exclude=tried) if retries and _is_host_failure(error) else None
+                if retry is None:
+                    raise error
+                retries -= 1
+                self.retried += 1
+                tried.append(retry)
+                pending.add(self._submit(retry, **kwargs))
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _check(self, endpoint: OllamaEndpoint) -> None:
+        try:
+            await asyncio.wait_for(endpoint.async_client.list(), timeout=self.health_timeout)
+        except Exception as e:
+            self._set_health(endpoint, False, f"health check failed ({e!r})")
+            return
+        endpoint.failures = 0
+        self._set_health(endpoint, True)
+
+    async def check_health(self) -> None:
+        await asyncio.gather(*(self._check(endpoint) for endpoint in self.endpoints))
+
+    async def _health_loop(self):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(self.health_interval)
+
+    def start(self) -> None:
+        """Start active health checks; needs a running event loop."""
+        if self._health_task is None and self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def stop(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    def stats(self) -> dict:
+        return {
+            "hosts": {endpoint.host: endpoint.stats() for endpoint in self.endpoints},
+            "hedged": self.hedged,
+            "retried": self.retried,
+            "overflowed": self.overflowed,
+        }
+
 
 class ChatOllama:
-    def __init__(self, model_name: str = "deepseek-r1:1.5b", host: str = "http://localhost:11434"):
+    def __init__(
+        self,
+        model_name: str = settings.OLLAMA_MODEL,
+        host: str = settings.OLLAMA_HOST,
+        hosts: List[str] = None,
+        overflow=None,
+    ):
         self.model_name = model_name
-        self.client = Client(host=host)
+        self.router = OllamaRouter(hosts or [host], overflow=overflow)
+        # Clients of the first host, for callers that need a single one (e.g. embeddings).
+        self.client = self.router.endpoints[0].client
+        self.async_client = self.router.endpoints[0].async_client
+        self.logger = Logger("ChatOllama")
+
+    @staticmethod
+    def budget(name: str = None):
+        """Ollama `options` and reasoning token limit (0 = none) of a generation budget."""
+        budgets = settings.GENERATION_BUDGETS
+        budget = {**budgets.get("default", {}), **budgets.get(name or "default", {})}
+        options = {key: budget[key] for key in ("num_predict", "num_ctx") if budget.get(key)}
+        return options, budget.get("max_reasoning_tokens") or 0
+
+    def _log_usage(self, response, content: str = "", budget: str = None):
+        """Log and record token counts and Ollama's own prefill/generation timings.
+
+        Ollama does not count reasoning tokens separately; they are estimated
+        from the share of `content` inside `<think>` sections.
+        """
+        reasoning_tokens = None
+        if content and response.eval_count:
+            reasoning_chars = len(content) - len(strip_reasoning(content))
+            reasoning_tokens = round(response.eval_count * reasoning_chars / len(content))
+        self.logger.info(
+            "%s: prompt_tokens=%s completion_tokens=%s reasoning_tokens~%d prompt_ms=%.0f total_ms=%.0f",
+            self.model_name,
+            response.prompt_eval_count,
+            response.eval_count,
+            reasoning_tokens or 0,
+            (response.prompt_eval_duration or 0) / 1e6,
+            (response.total_duration or 0) / 1e6,
+        )
+        record_tokens(
+            self.model_name,
+            prompt=response.prompt_eval_count,
+            completion=response.eval_count,
+            reasoning=reasoning_tokens,
+        )
+        if budget is not None and reasoning_tokens is not None:
+            REASONING_TOKENS.observe(reasoning_tokens, budget=budget)
+        if response.load_duration:
+            record_stage("llm_load", response.load_duration / 1e9)
+        if response.prompt_eval_duration:
+            record_stage("llm_prefill", response.prompt_eval_duration / 1e9)
+        if response.eval_duration:
+            record_stage("llm_generate", response.eval_duration / 1e9)
 
-    def generate_response(self, messages: list[dict], format: dict):
+    def generate_response(self, messages: list[dict], format: dict, budget: str = None):
+        options, _ = self.budget(budget)
         try:
-            response = self.client.chat(
-                messages=messages,
-                model=self.model_name,
-                format=format,
-            )
+            with span("llm"):
+                response = self.router.pick().client.chat(
+                    messages=messages,
+                    model=self.model_name,
+                    format=format,
+                    options=options,
+                    keep_alive=settings.OLLAMA_KEEP_ALIVE,
+                )
+            self._log_usage(response, response.message.content, budget=budget or "default")
+            return response.message.content
+        except ConnectionError as e:
+
+            return f"ConnectionError: {e}"
+        except ValueError as e:
+
+            return f"ValueError: {e}"
+        except Exception as e:
+
+            return f"Exception: {e}"
+
+    async def agenerate_response(self, messages: list[dict], format: dict, budget: str = None):
+        """Full response for `messages`, within the named generation `budget`.
+
+        Structured output (`format`) starts with the JSON right away, so only
+        free-text generations can have their reasoning cut short; those are
+        streamed internally to be able to stop it.
+        """
+        options, max_reasoning = self.budget(budget)
+        try:
+            if self.router.should_overflow():
+                json_schema = format if isinstance(format, dict) else None
+                return await self.router.overflow.achat(
+                    messages, json_schema=json_schema, max_tokens=options.get("num_predict")
+                )
+            if not format and max_reasoning:
+                with span("llm"):
+                    return "".join([piece async for piece in self.astream_response(messages, budget=budget)])
+            with span("llm"):
+                response = await self.router.chat(
+                    messages=messages,
+                    model=self.model_name,
+                    format=format,
+                    options=options,
+                    keep_alive=settings.OLLAMA_KEEP_ALIVE,
+                )
+            self._log_usage(response, response.message.content, budget=budget or "default")
             return response.message.content
         except ConnectionError as e:
 
@@ -24,3 +365,84 @@ class ChatOllama:
         except Exception as e:
 
             return f"Exception: {e}"
+
+    async def _stream_parts(self, endpoint: OllamaEndpoint, messages: list[dict], format, options: dict):
+        try:
+            stream = await endpoint.async_client.chat(
+                messages=messages,
+                model=self.model_name,
+                format=format,
+                options=options,
+                keep_alive=settings.OLLAMA_KEEP_ALIVE,
+                stream=True,
+            )
+        except Exception as e:
+            self.router.record_failure(endpoint, e)
+            raise
+        try:
+            async for part in stream:
+                yield part
+        finally:
+            await stream.aclose()
+
+    async def astream_response(self, messages: list[dict], format: dict = None, budget: str = None):
+        """Yield response content pieces as Ollama produces them, from the least-loaded host.
+
+        Once the `<think>` section reaches the budget's `max_reasoning_tokens`,
+        the stream is stopped, `</think>` is emitted and generation resumes
+        from the truncated reasoning straight into the answer.
+
+        Closing the generator (e.g. on client disconnect) closes the upstream
+        HTTP stream, which makes Ollama stop generating.
+        """
+        budget = budget or "default"
+        options, max_reasoning = self.budget(budget)
+        endpoint = self.router.pick()
+        async with self.router.acquire(endpoint):
+            started = time.perf_counter()
+            think = ThinkFilter()
+            pieces = []
+            reasoning_tokens = 0
+            cut_off = False
+            parts = self._stream_parts(endpoint, messages, format, options)
+            try:
+                async for part in parts:
+                    if part.done:
+                        self._log_usage(part, "".join(pieces), budget=budget)
+                        self.router.record_success(endpoint, time.perf_counter() - started)
+                    if part.message.content:
+                        if not pieces:
+                            record_stage("llm_first_token", time.perf_counter() - started)
+                        pieces.append(part.message.content)
+                        yield part.message.content
+                        think.feed(part.message.content)
+                        if think.in_think:
+                            reasoning_tokens += 1
+                            if max_reasoning and reasoning_tokens >= max_reasoning:
+                                cut_off = True
+                                break
+            finally:
+                await parts.aclose()
+            if not cut_off:
+                return
+
+            REASONING_CUTOFFS.inc(budget=budget)
+            REASONING_TOKENS.observe(reasoning_tokens, budget=budget)
+            closing = f"\n{THINK_CLOSE}\n\n"
+            yield closing
+            # Ollama continues a trailing assistant message, so the answer follows the cut reasoning.
+            continuation = messages + [{"role": "assistant", "content": "".join(pieces) + closing}]
+            if options.get("num_predict"):
+                options = {**options, "num_predict": max(options["num_predict"] - len(pieces), 1)}
+            answer = []
+            parts = self._stream_parts(endpoint, continuation, format, options)
+            try:
+                async for part in parts:
+                    if part.done:
+                        self._log_usage(part, "".join(answer))
+                        self.router.record_success(endpoint, time.perf_counter() - started)
+                    if part.message.content:
+                        answer.append(part.message.content)
+                        yield part.message.content
+            finally:
+                await parts.aclose()
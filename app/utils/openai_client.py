@@ -1,6 +1,10 @@
 import os
+import httpx
 import openai
+from utils import settings
+from utils.concurrency import backend_limit
 from utils.logger import Logger
+from utils.metrics import record_tokens, span
 # from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.prompts import PromptTemplate
@@ -12,6 +16,12 @@ class ChatGPTClient:
         self.model = model
         load_dotenv()
         self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.async_client = openai.AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=settings.OPENAI_MAX_CONCURRENCY)
+            ),
+        )
         self.logger = Logger("ChatGPTClient")
 
     # def generate_json(self, prompt_template: str, input_var: dict):
@@ -31,6 +41,19 @@ class ChatGPTClient:
     #     result = chain.invoke(input_var)
     #     return result
 
+    @staticmethod
+    def record_usage(response) -> None:
+        usage = response.usage
+        if usage is None:
+            return
+        details = usage.completion_tokens_details
+        record_tokens(
+            response.model,
+            prompt=usage.prompt_tokens,
+            completion=usage.completion_tokens,
+            reasoning=details.reasoning_tokens if details is not None else None,
+        )
+
     def generate_response(
         self,
         system_prompt: str,
@@ -50,13 +73,66 @@ class ChatGPTClient:
                 temperature=temperature,
                 max_tokens=max_tokens,
             )
+            self.record_usage(response)
+            return response.choices[0].message.content
+
+        except openai.APIConnectionError as e:
+            self.logger.error("The server could not be reached: %s", e.__cause__)
+        except openai.RateLimitError as e:
+            self.logger.error("A 429 status code was received; we should back off a bit.")
+        except openai.APIStatusError as e:
+            self.logger.error("Another non-200-range status code(%s) was received: %s", e.status_code, e.response)
+
+        return ""
+
+    async def agenerate_response(
+        self,
+        system_prompt: str,
+        request: str,
+        response_format: dict,
+        max_tokens: int = 150,
+        temperature: float = 0.7,
+    ) -> str:
+        try:
+            async with backend_limit("openai"):
+                with span("openai"):
+                    response = await self.async_client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": request},
+                        ],
+                        response_format=response_format,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+            self.record_usage(response)
             return response.choices[0].message.content
 
         except openai.APIConnectionError as e:
-            self.logger.error(f"The server could not be reached: {e.__cause__}")
+            self.logger.error("The server could not be reached: %s", e.__cause__)
         except openai.RateLimitError as e:
             self.logger.error("A 429 status code was received; we should back off a bit.")
         except openai.APIStatusError as e:
-            self.logger.error(f"Another non-200-range status code({e.status_code}) was received: {e.response}")
+            self.logger.error("Another non-200-range status code(%s) was received: %s", e.status_code, e.response)
 
         return ""
+
+    async def achat(self, messages: list[dict], json_schema: dict = None, max_tokens: int = None) -> str:
+        """Chat completion for Ollama-style `messages`, optionally constrained to a JSON schema.
+
+        Used as overflow capacity for Ollama generation; errors propagate to the caller.
+        """
+        response_format = None
+        if json_schema is not None:
+            response_format = {"type": "json_schema", "json_schema": {"name": "response", "schema": json_schema}}
+        async with backend_limit("openai"):
+            with span("openai"):
+                response = await self.async_client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    response_format=response_format or openai.NOT_GIVEN,
+                    max_tokens=max_tokens or openai.NOT_GIVEN,
+                )
+        self.record_usage(response)
+        return response.choices[0].message.content
@@ -0,0 +1,58 @@
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_tag_suffix(text: str, tag: str) -> int:
+    """Length of the longest suffix of `text` that is a proper prefix of `tag`."""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+class ThinkFilter:
+    """Incrementally removes deepseek-r1 `<think>...</think>` sections from streamed text.
+
+    Tags may be split across chunks, so a possible partial tag at the end of a
+    chunk is held back until the next `feed` call.
+    """
+
+    def __init__(self):
+        self.in_think = False
+        self.answer_started = False
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        pending = self._pending + text
+        visible = []
+        while pending:
+            tag = THINK_CLOSE if self.in_think else THINK_OPEN
+            index = pending.find(tag)
+            if index >= 0:
+                if not self.in_think:
+                    visible.append(pending[:index])
+                pending = pending[index + len(tag):]
+                self.in_think = not self.in_think
+                continue
+            held = _partial_tag_suffix(pending, tag)
+            if not self.in_think:
+                visible.append(pending[:len(pending) - held])
+            pending = pending[len(pending) - held:]
+            break
+        self._pending = pending
+        return self._start_answer("".join(visible))
+
+    def flush(self) -> str:
+        pending, self._pending = self._pending, ""
+        return "" if self.in_think else self._start_answer(pending)
+
+    def _start_answer(self, text: str) -> str:
+        if not self.answer_started:
+            text = text.lstrip()
+            self.answer_started = bool(text)
+        return text
+
+
+def strip_reasoning(text: str) -> str:
+    think_filter = ThinkFilter()
+    return think_filter.feed(text) + think_filter.flush()
@@ -0,0 +1,294 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import chromadb
+
+from utils import settings
+from utils.answer_cache import SemanticAnswerCache
+from utils.bm25 import BM25Index
+from utils.embedding import Embedding, create_embedding_backend
+from utils.embedding_cache import EmbeddingCache
+from utils.logger import Logger
+from utils.ollama import ChatOllama
+from utils.openai_client import ChatGPTClient
+from utils.storage import lexical_group
+from utils.summary_cache import SummaryCache
+from utils.translation_memory import TranslationMemory
+from utils.vector_store import QuantizedVectors, VectorLayout
+
+
+class ResourceRegistry:
+    """Process-wide owner of the Chroma client, the LLM clients and open collections.
+
+    Collections are kept in an LRU keyed by collection name so that repeated
+    requests against the same document skip `get_or_create_collection`.
+    """
+
+    def __init__(self, db_path: str = settings.CHROMA_DB_PATH, max_collections: int = settings.COLLECTION_CACHE_SIZE):
+        self.db_path = db_path
+        self.max_collections = max_collections
+        self.logger = Logger("ResourceRegistry")
+        self._lock = threading.RLock()
+        self._chroma_client = None
+        self._openai = None
+        self._ollama = None
+        self._embedding = None
+        self._embedding_cache = None
+        self._answer_cache = None
+        self._summary_cache = None
+        self._translation_memory = None
+        self._embedding_executor = None
+        self._collections = OrderedDict()
+        # Per-name locks held while a collection is opened, so opens happen outside `_lock`.
+        self._opening = {}
+        self._lexical_indexes = OrderedDict()
+        self._vector_stores = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def chroma_client(self):
+        if self._chroma_client is None:
+            with self._lock:
+                if self._chroma_client is None:
+                    self._chroma_client = chromadb.PersistentClient(path=self.db_path)
+        return self._chroma_client
+
+    @property
+    def openai(self) -> ChatGPTClient:
+        if self._openai is None:
+            with self._lock:
+                if self._openai is None:
+                    self._openai = ChatGPTClient(model=settings.OPENAI_MODEL)
+        return self._openai
+
+    @property
+    def ollama(self) -> ChatOllama:
+        if self._ollama is None:
+            with self._lock:
+                if self._ollama is None:
+                    self._ollama = ChatOllama(
+                        model_name=settings.OLLAMA_MODEL,
+                        hosts=settings.OLLAMA_HOSTS,
+                        overflow=self.openai if settings.OLLAMA_OPENAI_OVERFLOW else None,
+                    )
+        return self._ollama
+
+    @property
+    def embedding(self) -> Embedding:
+        if self._embedding is None:
+            with self._lock:
+                if self._embedding is None:
+                    # Only the client of the selected backend is built: "hashing" needs none, and
+                    # the OpenAI client cannot be built without an API key.
+                    name = settings.EMBEDDING_BACKEND
+                    backend = create_embedding_backend(
+                        name,
+                        openai_client=self.openai.client if name == "openai" else None,
+                        ollama_client=self.ollama.client if name == "ollama" else None,
+                        executor=self.embedding_executor,
+                    )
+                    cache = self.embedding_cache if backend.cacheable else None
+                    self._embedding = Embedding(backend, cache=cache)
+        return self._embedding
+
+    @property
+    def embedding_cache(self):
+        if self._embedding_cache is None and settings.EMBEDDING_CACHE_ENABLED:
+            with self._lock:
+                if self._embedding_cache is None:
+                    self._embedding_cache = EmbeddingCache()
+        return self._embedding_cache
+
+    @property
+    def answer_cache(self):
+        if self._answer_cache is None and settings.ANSWER_CACHE_ENABLED:
+            with self._lock:
+                if self._answer_cache is None:
+                    self._answer_cache = SemanticAnswerCache()
+        return self._answer_cache
+
+    @property
+    def summary_cache(self):
+        if self._summary_cache is None and settings.SUMMARY_CACHE_ENABLED:
+            with self._lock:
+                if self._summary_cache is None:
+                    self._summary_cache = SummaryCache()
+        return self._summary_cache
+
+    @property
+    def translation_memory(self):
+        if self._translation_memory is None and settings.TRANSLATION_MEMORY_ENABLED:
+            with self._lock:
+                if self._translation_memory is None:
+                    self._translation_memory = TranslationMemory()
+        return self._translation_memory
+
+    @property
+    def embedding_executor(self) -> ThreadPoolExecutor:
+        if self._embedding_executor is None:
+            with self._lock:
+                if self._embedding_executor is None:
+                    self._embedding_executor = ThreadPoolExecutor(
+                        max_workers=settings.EMBEDDING_CONCURRENCY, thread_name_prefix="embedding"
+                    )
+        return self._embedding_executor
+
+    def _cached_collection(self, name: str):
+        collection = self._collections.get(name)
+        if collection is not None:
+            self._collections.move_to_end(name)
+            self.hits += 1
+        return collection
+
+    def get_collection(self, name: str):
+        """Open collection handle, from the LRU or opened (and created if needed) on a miss.
+
+        Opening reads from disk, so it happens under a lock of its own for that
+        name: concurrent requests for the same collection open it once, and
+        lookups of other collections are not held up meanwhile.
+        """
+        with self._lock:
+            collection = self._cached_collection(name)
+            if collection is not None:
+                return collection
+            opening = self._opening.setdefault(name, threading.Lock())
+
+        with opening:
+            with self._lock:
+                collection = self._cached_collection(name)
+                if collection is not None:
+                    return collection
+                self.misses += 1
+            try:
+                collection = self.chroma_client.get_or_create_collection(
+                    name=name,
+                    embedding_function=self.embedding.embedding_function,
+                    metadata={
+                        "hnsw:space": "cosine",
+                        **self.embedding.collection_metadata(),
+                        **VectorLayout.configured(name, self.embedding.dimension).to_metadata(),
+                    },
+                )
+                self.embedding.check_collection(collection)
+            except BaseException:
+                with self._lock:
+                    self._opening.pop(name, None)
+                raise
+            with self._lock:
+                self._opening.pop(name, None)
+                self._collections[name] = collection
+                while len(self._collections) > self.max_collections:
+                    evicted, _ = self._collections.popitem(last=False)
+                    self.evictions += 1
+                    self.logger.debug("Evicted collection handle %s", evicted)
+        return collection
+
+    def get_lexical_index(self, name: str) -> BM25Index:
+        """BM25 index of a collection, read from disk on its first search.
+
+        Collections without a persisted index (ingested before lexical indexing
+        existed or while it was disabled) are indexed from their stored
+        documents on that first search. This happens under the index's own
+        lock, so other collections are not held up meanwhile.
+        """
+        with self._lock:
+            index = self._lexical_indexes.get(name)
+            if index is not None:
+                self._lexical_indexes.move_to_end(name)
+                return index
+
+            index = BM25Index(
+                self._lexical_index_path(name),
+                backfill=lambda: self._stored_chunks(name),
+                flush_after=settings.LEXICAL_INDEX_FLUSH_CHUNKS,
+            )
+            self._lexical_indexes[name] = index
+            evicted = []
+            while len(self._lexical_indexes) > self.max_collections:
+                evicted.append(self._lexical_indexes.popitem(last=False)[1])
+        for stale in evicted:
+            stale.save()
+        return index
+
+    def _stored_chunks(self, name: str):
+        """`(ids, documents, BM25 groups)` of every chunk in a collection."""
+        stored = self.get_collection(name).get(include=["documents", "metadatas"])
+        groups = [
+            lexical_group(metadata.get("user_id"), metadata.get("document_id")) if metadata else None
+            for metadata in stored["metadatas"]
+        ]
+        return stored["ids"], stored["documents"], groups
+
+    def _lexical_index_path(self, name: str) -> str:
+        return os.path.join(self.db_path, "bm25", name)
+
+    def discard_lexical_index(self, name: str) -> None:
+        """Forget the BM25 index of a collection and delete its files."""
+        with self._lock:
+            self._lexical_indexes.pop(name, None)
+            BM25Index.delete(self._lexical_index_path(name))
+
+    def get_vector_layout(self, name: str) -> VectorLayout:
+        return VectorLayout.from_metadata(self.get_collection(name).metadata, self.embedding.dimension)
+
+    def get_vector_store(self, name: str):
+        """Quantized re-scoring vectors of a collection, or None if its layout keeps none."""
+        with self._lock:
+            store = self._vector_stores.get(name)
+            if store is not None:
+                self._vector_stores.move_to_end(name)
+                return store
+
+        # Loaded without holding `_lock`; if two requests race, the first store kept wins.
+        layout = self.get_vector_layout(name)
+        if not layout.rescored:
+            return None
+        path = os.path.join(self.db_path, "vectors", f"{name}.npz")
+        loaded = QuantizedVectors.load(path, layout.dimension, layout.rescore_dtype)
+        with self._lock:
+            store = self._vector_stores.setdefault(name, loaded)
+            self._vector_stores.move_to_end(name)
+            while len(self._vector_stores) > self.max_collections:
+                # Saved before the lock is released, so a later miss cannot load a stale file.
+                _, evicted = self._vector_stores.popitem(last=False)
+                evicted.save()
+            return store
+
+    def drop_collection(self, name: str) -> None:
+        with self._lock:
+            self._collections.pop(name, None)
+            self._lexical_indexes.pop(name, None)
+            self._vector_stores.pop(name, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "open_collections": len(self._collections),
+                "max_collections": self.max_collections,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "open_vector_stores": len(self._vector_stores),
+                "vector_store_bytes": sum(store.nbytes for store in self._vector_stores.values()),
+            }
+
+
+_registries: dict[str, ResourceRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(db_path: str = settings.CHROMA_DB_PATH) -> ResourceRegistry:
+    registry = _registries.get(db_path)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(db_path)
+            if registry is None:
+                registry = ResourceRegistry(db_path=db_path)
+                _registries[db_path] = registry
+    return registry
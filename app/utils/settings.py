@@ -0,0 +1,178 @@
+import json
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "deepseek-r1:1.5b")
+# Comma-separated pool of Ollama hosts that generation is balanced across; defaults to OLLAMA_HOST.
+OLLAMA_HOSTS = [host.strip() for host in os.getenv("OLLAMA_HOSTS", OLLAMA_HOST).split(",") if host.strip()]
+OLLAMA_HEALTH_CHECK_INTERVAL = float(os.getenv("OLLAMA_HEALTH_CHECK_INTERVAL", "10"))
+OLLAMA_HEALTH_CHECK_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_CHECK_TIMEOUT", "2"))
+# Consecutive failed calls after which a host is taken out until its next good health check.
+OLLAMA_MAX_FAILURES = int(os.getenv("OLLAMA_MAX_FAILURES", "3"))
+# Send a duplicate request to another idle host when no answer arrived after this many seconds; 0 disables.
+OLLAMA_HEDGE_AFTER = float(os.getenv("OLLAMA_HEDGE_AFTER", "0"))
+# Send non-streaming generations to OpenAI when every Ollama host is saturated or down.
+OLLAMA_OPENAI_OVERFLOW = os.getenv("OLLAMA_OPENAI_OVERFLOW", "false").lower() == "true"
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+# Upper bound on the number of open Chroma collection handles kept by the registry.
+COLLECTION_CACHE_SIZE = int(os.getenv("COLLECTION_CACHE_SIZE", "256"))
+
+# One of "openai", "ollama" or "hashing" (fully local, no network).
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+OLLAMA_EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+HASHING_EMBEDDING_DIMENSION = int(os.getenv("HASHING_EMBEDDING_DIMENSION", "1024"))
+# OpenAI caps a single embeddings request at 2048 inputs and ~300k tokens.
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "2048"))
+
+# How long Ollama keeps a model loaded after a call (duration string or seconds; -1 keeps it resident).
+_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "-1")
+OLLAMA_KEEP_ALIVE = int(_keep_alive) if _keep_alive.lstrip("-").isdigit() else _keep_alive
+# Models loaded on every Ollama host at startup and reloaded if evicted; /api/ready waits for them.
+OLLAMA_PRELOAD_MODELS = [
+    model.strip()
+    for model in os.getenv(
+        "OLLAMA_PRELOAD_MODELS",
+        ",".join([OLLAMA_MODEL] + ([OLLAMA_EMBEDDING_MODEL] if EMBEDDING_BACKEND == "ollama" else [])),
+    ).split(",")
+    if model.strip()
+]
+# Ollama generation budgets per endpoint: `num_predict` and `num_ctx` are passed as
+# options, `max_reasoning_tokens` cuts the <think> phase short (0 = unlimited).
+# GENERATION_BUDGETS (JSON) overrides entries, e.g. {"chat": {"max_reasoning_tokens": 128}}.
+GENERATION_BUDGETS = {
+    "default": {"num_ctx": 4096},
+    "ask_ai": {"num_predict": 1024, "num_ctx": 4096, "max_reasoning_tokens": 384},
+    "chat": {"num_predict": 1024, "num_ctx": 8192, "max_reasoning_tokens": 384},
+    "summarize": {"num_predict": 512, "num_ctx": 4096, "max_reasoning_tokens": 256},
+    "chat_summary": {"num_predict": 384, "num_ctx": 8192},
+}
+for _name, _budget in json.loads(os.getenv("GENERATION_BUDGETS", "{}")).items():
+    GENERATION_BUDGETS[_name] = {**GENERATION_BUDGETS.get(_name, {}), **_budget}
+
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+# Number of chunks written to Chroma per add call.
+CHROMA_WRITE_BATCH_SIZE = int(os.getenv("CHROMA_WRITE_BATCH_SIZE", "1000"))
+# Streaming ingestion (/api/upload_document): bytes read from the upload at a time,
+# and chunks embedded and written per batch as they are produced.
+INGEST_READ_BLOCK_SIZE = int(os.getenv("INGEST_READ_BLOCK_SIZE", str(1024 * 1024)))
+INGEST_BATCH_CHUNKS = int(os.getenv("INGEST_BATCH_CHUNKS", "256"))
+# Text with no sentence break is cut after this many characters instead of buffered.
+INGEST_MAX_SENTENCE_CHARS = int(os.getenv("INGEST_MAX_SENTENCE_CHARS", "65536"))
+# Batches being embedded in the background while the next one is chunked and written.
+INGEST_EMBED_PREFETCH = int(os.getenv("INGEST_EMBED_PREFETCH", "2"))
+# Background ingestion jobs (/api/ingest_jobs). Job state lives in CHAT_DB_PATH and
+# submitted content is spooled to INGEST_SPOOL_DIR until the job finishes.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "32"))
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", "ingest_spool")
+
+# "per_document" (one collection per user/document pair) or "shared" (documents of
+# many users in SHARED_COLLECTION_SHARDS collections, selected by metadata filters).
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "per_document")
+SHARED_COLLECTION_SHARDS = int(os.getenv("SHARED_COLLECTION_SHARDS", "8"))
+SHARED_COLLECTION_PREFIX = os.getenv("SHARED_COLLECTION_PREFIX", "rag_shared")
+
+# Blocking work (Chroma, SQLite, sync SDK calls) runs on a bounded thread pool.
+BLOCKING_IO_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", "32"))
+# Per-backend limits on concurrent in-flight calls from one worker process
+# (for Ollama, per host in OLLAMA_HOSTS).
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+CHROMA_MAX_CONCURRENCY = int(os.getenv("CHROMA_MAX_CONCURRENCY", "8"))
+SQLITE_MAX_CONCURRENCY = int(os.getenv("SQLITE_MAX_CONCURRENCY", "4"))
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.db")
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+EMBEDDING_CACHE_DISK_ITEMS = int(os.getenv("EMBEDDING_CACHE_DISK_ITEMS", "1000000"))
+# 0 disables expiry.
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+CHAT_DB_PATH = os.getenv("CHAT_DB_PATH", "chat_history.db")
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
+# Window of chat history sent to the model on /api/ai_chat.
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "20"))
+CHAT_HISTORY_MAX_TOKENS = int(os.getenv("CHAT_HISTORY_MAX_TOKENS", "2000"))
+# "summary": the last CHAT_MEMORY_RECENT_TURNS turns verbatim plus a running summary of
+# everything before, updated in the background after each turn (messages the summary has not
+# caught up with are sent verbatim too, within the window above). "window": the window above only.
+CHAT_MEMORY_MODE = os.getenv("CHAT_MEMORY_MODE", "summary")
+CHAT_MEMORY_RECENT_TURNS = int(os.getenv("CHAT_MEMORY_RECENT_TURNS", "4"))
+# Messages folded into the running summary per model call.
+CHAT_SUMMARY_BATCH_MESSAGES = int(os.getenv("CHAT_SUMMARY_BATCH_MESSAGES", "20"))
+
+# Retrieved-context assembly. Disable the builder to get the old "join every hit"
+# behaviour, e.g. for before/after prompt size comparisons.
+CONTEXT_BUILDER_ENABLED = os.getenv("CONTEXT_BUILDER_ENABLED", "true").lower() == "true"
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Chunks at least this cosine-similar to an already selected chunk are dropped.
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.95"))
+# Chunks farther than this cosine distance from the query are dropped (2.0 keeps everything).
+CONTEXT_MAX_DISTANCE = float(os.getenv("CONTEXT_MAX_DISTANCE", "2.0"))
+
+# "vector", "hybrid" (BM25 + vector, fused with reciprocal rank fusion) or "lexical".
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+# In hybrid mode, queries of at most this many terms skip the embedding call and
+# are served from the BM25 index alone.
+KEYWORD_QUERY_MAX_TERMS = int(os.getenv("KEYWORD_QUERY_MAX_TERMS", "2"))
+# Per-collection BM25 indexes, needed by "hybrid" and "lexical" retrieval. When disabled nothing
+# is indexed at ingestion and requests for those modes are refused; indexes are rebuilt from the
+# stored chunks when it is enabled again.
+LEXICAL_INDEX_ENABLED = os.getenv("LEXICAL_INDEX_ENABLED", str(RETRIEVAL_MODE != "vector")).lower() == "true"
+# Chunks buffered by an index not read into memory yet (e.g. while ingesting) before they are written out.
+LEXICAL_INDEX_FLUSH_CHUNKS = int(os.getenv("LEXICAL_INDEX_FLUSH_CHUNKS", "2048"))
+
+# Vector layout of new collections; a collection keeps the layout it was created with.
+# VECTOR_DIMENSIONS leading embedding dimensions are kept, renormalised (0 keeps them all);
+# this suits models trained for it, e.g. text-embedding-3-* and nomic-embed-text v1.5.
+# The HNSW index holds the first VECTOR_INDEX_DIMENSIONS of them (0: all). With
+# VECTOR_RESCORE_DTYPE "float16" or "int8" all VECTOR_DIMENSIONS are also kept quantized
+# in a side store, and VECTOR_RESCORE_OVERSAMPLE x k index hits are re-ranked with them.
+VECTOR_DIMENSIONS = int(os.getenv("VECTOR_DIMENSIONS", "0"))
+VECTOR_INDEX_DIMENSIONS = int(os.getenv("VECTOR_INDEX_DIMENSIONS", "0"))
+VECTOR_RESCORE_DTYPE = os.getenv("VECTOR_RESCORE_DTYPE", "none")
+VECTOR_RESCORE_OVERSAMPLE = int(os.getenv("VECTOR_RESCORE_OVERSAMPLE", "4"))
+# VECTOR_LAYOUTS (JSON) overrides the above for collections whose name matches a pattern, e.g.
+# {"rag_shared_*": {"dimensions": 512, "index_dimensions": 128, "rescore_dtype": "int8"}}.
+VECTOR_LAYOUTS = json.loads(os.getenv("VECTOR_LAYOUTS", "{}"))
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
+# "text" or "json" (one object per line, with the request id).
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Fraction of DEBUG records kept; sampling happens before the record is formatted.
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+# Per-stage timings on /metrics (Prometheus text format) and in Server-Timing headers.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+# Minimum cosine similarity between query embeddings for a cached answer to be reused.
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+# Whole-document summaries: chunk and intermediate summaries are cached by content hash.
+SUMMARY_CACHE_ENABLED = os.getenv("SUMMARY_CACHE_ENABLED", "true").lower() == "true"
+SUMMARY_CACHE_PATH = os.getenv("SUMMARY_CACHE_PATH", "summary_cache.db")
+SUMMARY_CACHE_MAX_ITEMS = int(os.getenv("SUMMARY_CACHE_MAX_ITEMS", "1000000"))
+# Average number of summaries merged per reduce step.
+SUMMARY_REDUCE_FANOUT = int(os.getenv("SUMMARY_REDUCE_FANOUT", "8"))
+# Summary generations in flight per document; defaults to the Ollama pool's capacity.
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", str(OLLAMA_MAX_CONCURRENCY * len(OLLAMA_HOSTS))))
+
+# Translation memory: translated sentences are reused per (sentence, language, document collection, model).
+TRANSLATION_MEMORY_ENABLED = os.getenv("TRANSLATION_MEMORY_ENABLED", "true").lower() == "true"
+TRANSLATION_MEMORY_PATH = os.getenv("TRANSLATION_MEMORY_PATH", "translation_memory.db")
+TRANSLATION_MEMORY_MAX_ITEMS = int(os.getenv("TRANSLATION_MEMORY_MAX_ITEMS", "1000000"))
+# Untranslated segments are sent in parallel batches of at most this many segments / estimated tokens.
+TRANSLATION_BATCH_SEGMENTS = int(os.getenv("TRANSLATION_BATCH_SEGMENTS", "20"))
+TRANSLATION_BATCH_TOKENS = int(os.getenv("TRANSLATION_BATCH_TOKENS", "1000"))
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+def normalize_text(text: str) -> str:
+    """Case- and whitespace-insensitive form of a request text, for coalescing keys."""
+    return " ".join(text.split()).casefold()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the work as a task; callers arriving
+    while it runs await the same task and receive its result or exception.
+    The work runs as its own task, so one caller being cancelled (e.g. a client
+    disconnect) does not cancel it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away.
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._tasks), "calls": self.calls, "coalesced": self.coalesced}
+
+
+retrieval_flight = SingleFlight("retrieval")
+generation_flight = SingleFlight("generation")
@@ -0,0 +1,69 @@
+import asyncio
+import contextlib
+import json
+
+from starlette.requests import Request
+
+from utils.reasoning import ThinkFilter, strip_reasoning
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# Seconds between checks for a client that went away, whether or not tokens are arriving.
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def wait_for_disconnect(http_request: Request, interval: float) -> None:
+    while not await http_request.is_disconnected():
+        await asyncio.sleep(interval)
+
+
+async def stream_events(tokens, http_request: Request, hide_reasoning: bool = False, on_complete=None):
+    """Turn an async token generator into server-sent events.
+
+    Emits one `data: {"token": ...}` event per generated piece and a final
+    `done` event carrying the full answer (reasoning stripped). `on_complete` is
+    awaited with that answer before the `done` event, and only then: a stream
+    that fails or is abandoned never reaches it. The client is checked every
+    DISCONNECT_POLL_INTERVAL seconds, also while the model has yet to produce
+    a token; when it has gone away, the upstream generator is closed, which
+    cancels the generation.
+    """
+    think_filter = ThinkFilter() if hide_reasoning else None
+    parts = []
+    disconnected = asyncio.ensure_future(wait_for_disconnect(http_request, DISCONNECT_POLL_INTERVAL))
+    try:
+        while True:
+            next_token = asyncio.ensure_future(tokens.__anext__())
+            await asyncio.wait({next_token, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_token.done():
+                next_token.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await next_token
+                return
+            try:
+                token = next_token.result()
+            except StopAsyncIteration:
+                break
+            parts.append(token)
+            visible = think_filter.feed(token) if think_filter else token
+            if visible:
+                yield sse_event({"token": visible})
+        if think_filter:
+            tail = think_filter.flush()
+            if tail:
+                yield sse_event({"token": tail})
+
+        answer = strip_reasoning("".join(parts))
+        if on_complete is not None:
+            await on_complete(answer)
+        yield sse_event({"answer": answer}, event="done")
+    except Exception as e:
+        yield sse_event({"detail": str(e) or "An unexpected error occurred"}, event="error")
+    finally:
+        disconnected.cancel()
+        await tokens.aclose()
@@ -0,0 +1,76 @@
+import zlib
+from dataclasses import dataclass
+from typing import Optional
+
+from uuid_shortener import UUIDShortener
+
+from utils import settings
+
+
+@dataclass(frozen=True)
+class DocumentScope:
+    """Where a user's document lives in Chroma and how its chunks are selected.
+
+    In the "per_document" layout every user/document pair has its own
+    collection and no filter is needed. In the "shared" layout documents share
+    a few collections (sharded by user) and are selected by metadata.
+    """
+
+    collection_name: str
+    user_id: Optional[str] = None
+    document_id: Optional[str] = None
+    shared: bool = False
+
+    @property
+    def where(self) -> Optional[dict]:
+        if not self.shared:
+            return None
+        return {"$and": [{"user_id": self.user_id}, {"document_id": self.document_id}]}
+
+    @property
+    def key(self) -> str:
+        """Identifies the document's chunks, for caches and request coalescing."""
+        if not self.shared:
+            return self.collection_name
+        return f"{self.collection_name}/{self.group}"
+
+    @property
+    def group(self) -> Optional[str]:
+        """BM25 group of the document's chunks within a shared collection."""
+        return lexical_group(self.user_id, self.document_id) if self.shared else None
+
+    def chunk_id_prefix(self, document_id: str, user_id: str) -> str:
+        # Document ids are only unique per user, so shared collections also key on the user.
+        return f"doc_{user_id}_{document_id}" if self.shared else f"doc_{document_id}"
+
+
+def user_scope_key(user_id: str) -> str:
+    """Cache and coalescing key of requests over all of a user's documents."""
+    return f"user:{user_id}"
+
+
+def lexical_group(user_id: str, document_id: str) -> str:
+    return f"{user_id}/{document_id}"
+
+
+def per_document_collection(user_id: str, document_id: str) -> str:
+    return UUIDShortener.encode(f"{user_id}{document_id}")
+
+
+def shared_collection(user_id: str, shards: int = settings.SHARED_COLLECTION_SHARDS) -> str:
+    shard = zlib.crc32(user_id.encode("utf-8")) % max(shards, 1)
+    return f"{settings.SHARED_COLLECTION_PREFIX}_{shard:03d}"
+
+
+def stored_document_scope(collection_name: str, user_id: str, document_id: str) -> DocumentScope:
+    """Scope of a document recorded as living in `collection_name`, whatever STORAGE_LAYOUT is now."""
+    shared = collection_name != per_document_collection(user_id, document_id)
+    return DocumentScope(collection_name, user_id=user_id, document_id=document_id, shared=shared)
+
+
+def document_scope(user_id: str, document_id: str, layout: str = settings.STORAGE_LAYOUT) -> DocumentScope:
+    if layout == "shared":
+        return DocumentScope(shared_collection(user_id), user_id=user_id, document_id=document_id, shared=True)
+    if layout == "per_document":
+        return DocumentScope(per_document_collection(user_id, document_id), user_id=user_id, document_id=document_id)
+    raise ValueError(f"Unknown storage layout {layout!r}")
@@ -0,0 +1,109 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Sequence
+
+from utils import settings
+from utils.logger import Logger
+
+
+class SummaryCache:
+    """SQLite store of summaries keyed by hash of the summarized content.
+
+    Keys come from `leaf_key` (one chunk) and `node_key` (the keys of the
+    summaries being merged), so a node stays valid exactly as long as every
+    chunk below it is unchanged, whichever document it belongs to.
+    """
+
+    def __init__(self, path: str = settings.SUMMARY_CACHE_PATH, max_items: int = settings.SUMMARY_CACHE_MAX_ITEMS):
+        self.path = path
+        self.max_items = max_items
+        self.logger = Logger("SummaryCache")
+        self._lock = threading.Lock()
+        self._writes_since_trim = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS summaries (
+                key TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+        """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_summaries_last_used ON summaries (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def leaf_key(model: str, prompt_version: str, chunk_hash: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt_version}\0leaf\0{chunk_hash}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def node_key(model: str, prompt_version: str, child_keys: Sequence[str]) -> str:
+        joined = "\0".join(child_keys)
+        return hashlib.sha256(f"{model}\0{prompt_version}\0node\0{joined}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, str]:
+        """`{key: summary}` for the cached keys among `keys`."""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit on very large documents.
+            for offset in range(0, len(keys), 500):
+                batch = keys[offset:offset + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, summary FROM summaries WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE summaries SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+    def put(self, key: str, summary: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, summary, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, summary, now, now),
+            )
+            self._conn.commit()
+            self._writes_since_trim += 1
+            if self._writes_since_trim >= 1000:
+                self._trim()
+
+    def _trim(self) -> None:
+        self._writes_since_trim = 0
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()
+        if count > self.max_items:
+            self._conn.execute(
+                "DELETE FROM summaries WHERE key IN (SELECT key FROM summaries ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_items,),
+            )
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
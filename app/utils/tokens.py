@@ -0,0 +1,30 @@
+from typing import Iterable, List
+
+# Rough average for English text with OpenAI/deepseek tokenizers. Good enough for
+# budgeting requests; never used where an exact count matters.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def token_budget_batches(texts: Iterable[str], max_tokens: int, max_items: int) -> List[List[int]]:
+    """Group text indices into batches that stay under a token and item budget.
+
+    A single text larger than `max_tokens` still gets a batch of its own.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
@@ -0,0 +1,126 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Sequence
+
+from utils import settings
+from utils.logger import Logger
+
+
+class TranslationMemory:
+    """SQLite store of translated segments.
+
+    Entries are keyed by (segment hash, target language, context, model): the
+    same sentence translated for the same document collection into the same
+    language is only ever sent to the model once.
+    """
+
+    def __init__(
+        self, path: str = settings.TRANSLATION_MEMORY_PATH, max_items: int = settings.TRANSLATION_MEMORY_MAX_ITEMS
+    ):
+        self.path = path
+        self.max_items = max_items
+        self.logger = Logger("TranslationMemory")
+        self._lock = threading.Lock()
+        self._writes_since_trim = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS translations (
+                segment_hash TEXT NOT NULL,
+                language TEXT NOT NULL,
+                context TEXT NOT NULL,
+                model TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (segment_hash, language, context, model)
+            );
+        """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def segment_hash(segment: str) -> str:
+        """Hash of a segment, ignoring differences in whitespace."""
+        return hashlib.sha256(" ".join(segment.split()).encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def normalize_language(language: str) -> str:
+        return language.strip().casefold()
+
+    def get_many(self, segment_hashes: Sequence[str], language: str, context: str, model: str) -> Dict[str, str]:
+        """`{segment_hash: translation}` for the remembered segments among `segment_hashes`."""
+        segment_hashes = list(dict.fromkeys(segment_hashes))
+        if not segment_hashes:
+            return {}
+        language = self.normalize_language(language)
+        found = {}
+        with self._lock:
+            # Stay below SQLite's bound-parameter limit on very long texts.
+            for offset in range(0, len(segment_hashes), 500):
+                batch = segment_hashes[offset:offset + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT segment_hash, translation FROM translations "
+                    f"WHERE language = ? AND context = ? AND model = ? AND segment_hash IN ({placeholders})",
+                    [language, context, model, *batch],
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE translations SET last_used = ? "
+                    "WHERE segment_hash = ? AND language = ? AND context = ? AND model = ?",
+                    [(now, segment_hash, language, context, model) for segment_hash in found],
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(segment_hashes) - len(found)
+        return found
+
+    def put_many(self, translations: Dict[str, str], language: str, context: str, model: str) -> None:
+        """Remember `{segment_hash: translation}`."""
+        now = time.time()
+        language = self.normalize_language(language)
+        rows = [
+            (segment_hash, language, context, model, translation, now, now)
+            for segment_hash, translation in translations.items()
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translations "
+                "(segment_hash, language, context, model, translation, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self._writes_since_trim += len(rows)
+            if self._writes_since_trim >= 1000:
+                self._trim()
+
+    def _trim(self) -> None:
+        self._writes_since_trim = 0
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()
+        if count > self.max_items:
+            self._conn.execute(
+                "DELETE FROM translations WHERE rowid IN "
+                "(SELECT rowid FROM translations ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_items,),
+            )
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,300 @@
+import fnmatch
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils import settings
+
+RESCORE_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+def truncate(vectors, dimension: int) -> np.ndarray:
+    """The first `dimension` components of every row of `vectors`, renormalised to unit length."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.shape[1] < dimension:
+        raise ValueError(f"Cannot take {dimension} dimensions of {vectors.shape[1]}-dimensional vectors")
+    vectors = vectors[:, :dimension]
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    """`(codes, scales)` of float32 `vectors`; int8 rows are scaled to their largest component."""
+    if dtype != "int8":
+        return vectors.astype(RESCORE_DTYPES[dtype]), np.ones(len(vectors), dtype=np.float32)
+    scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12).astype(np.float32) / 127.0
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+
+def dequantize(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * scales[:, None]
+
+
+@dataclass(frozen=True)
+class VectorLayout:
+    """How a collection stores the embeddings of its chunks.
+
+    The HNSW index holds the first `index_dimension` components of every
+    embedding, renormalised. With a `rescore_dtype`, the first `dimension`
+    components are also kept, quantized, in a `QuantizedVectors` side store;
+    index hits are re-ranked with them and they are the embeddings handed to
+    the context builder. Without one, the index holds all `dimension`
+    components and is used as is.
+    """
+
+    native_dimension: int
+    dimension: int
+    index_dimension: int
+    rescore_dtype: Optional[str] = None
+
+    def __post_init__(self):
+        if self.rescore_dtype is not None and self.rescore_dtype not in RESCORE_DTYPES:
+            raise ValueError(f"Unknown rescore dtype: {self.rescore_dtype}")
+        if not 0 < self.index_dimension <= self.dimension <= self.native_dimension:
+            raise ValueError(
+                f"Invalid vector layout: need 0 < index dimensions ({self.index_dimension}) "
+                f"<= dimensions ({self.dimension}) <= embedding dimensions ({self.native_dimension})"
+            )
+        if self.rescore_dtype is None and self.index_dimension != self.dimension:
+            raise ValueError("A vector index narrower than the stored dimensions needs a rescore dtype")
+
+    @classmethod
+    def full(cls, native_dimension: int) -> "VectorLayout":
+        return cls(native_dimension, native_dimension, native_dimension)
+
+    @classmethod
+    def from_spec(cls, spec: dict, native_dimension: int) -> "VectorLayout":
+        """Layout from `{"dimensions", "index_dimensions", "rescore_dtype"}`; 0 or missing means "all"."""
+        dimension = spec.get("dimensions") or native_dimension
+        rescore_dtype = spec.get("rescore_dtype") or "none"
+        return cls(
+            native_dimension,
+            dimension,
+            spec.get("index_dimensions") or dimension,
+            None if rescore_dtype == "none" else rescore_dtype,
+        )
+
+    @classmethod
+    def configured(cls, collection_name: str, native_dimension: int) -> "VectorLayout":
+        """Layout for a new collection: VECTOR_* settings, overridden by the first matching VECTOR_LAYOUTS entry."""
+        spec = {
+            "dimensions": settings.VECTOR_DIMENSIONS,
+            "index_dimensions": settings.VECTOR_INDEX_DIMENSIONS,
+            "rescore_dtype": settings.VECTOR_RESCORE_DTYPE,
+        }
+        for pattern, override in settings.VECTOR_LAYOUTS.items():
+            if fnmatch.fnmatchcase(collection_name, pattern):
+                spec = {**spec, **override}
+                break
+        return cls.from_spec(spec, native_dimension)
+
+    @classmethod
+    def from_metadata(cls, metadata: Optional[dict], native_dimension: int) -> "VectorLayout":
+        """Layout recorded on a collection; collections from before layouts existed store full vectors."""
+        metadata = metadata or {}
+        if "vector_dimension" not in metadata:
+            return cls.full(native_dimension)
+        rescore_dtype = metadata.get("vector_rescore_dtype", "none")
+        return cls(
+            native_dimension,
+            metadata["vector_dimension"],
+            metadata["vector_index_dimension"],
+            None if rescore_dtype == "none" else rescore_dtype,
+        )
+
+    def to_metadata(self) -> dict:
+        return {
+            "vector_dimension": self.dimension,
+            "vector_index_dimension": self.index_dimension,
+            "vector_rescore_dtype": self.rescore_dtype or "none",
+        }
+
+    def __str__(self) -> str:
+        if self.rescore_dtype is None:
+            return "full" if self.dimension == self.native_dimension else str(self.dimension)
+        return f"{self.dimension}/{self.index_dimension}/{self.rescore_dtype}"
+
+    @property
+    def rescored(self) -> bool:
+        return self.rescore_dtype is not None
+
+    def index_vectors(self, embeddings) -> list:
+        """What the HNSW index stores for native `embeddings`."""
+        if self.index_dimension == self.native_dimension:
+            return list(embeddings)
+        return list(truncate(embeddings, self.index_dimension))
+
+    def rescore_vectors(self, embeddings) -> np.ndarray:
+        """What the side store keeps for native `embeddings`, before quantization."""
+        return truncate(embeddings, self.dimension)
+
+    def pad(self, index_vector) -> np.ndarray:
+        """An index vector zero-padded to the stored dimensions, for chunks missing from the side store."""
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        vector[:self.index_dimension] = index_vector
+        return vector
+
+    @property
+    def bytes_per_vector(self) -> int:
+        """Vector bytes per chunk: float32 index vector plus quantized side-store vector."""
+        size = 4 * self.index_dimension
+        if self.rescored:
+            size += self.dimension * np.dtype(RESCORE_DTYPES[self.rescore_dtype]).itemsize
+            size += 4 if self.rescore_dtype == "int8" else 0
+        return size
+
+
+class QuantizedVectors:
+    """Side store of one collection's re-scoring vectors, quantized.
+
+    Rows live in one matrix, reusing the rows of removed chunks, so memory is
+    `dimension` x itemsize per chunk plus a float32 scale for int8. Like the
+    BM25 index, the store is persisted as an `.npz` file in the Chroma directory.
+    """
+
+    def __init__(self, path: str, dimension: int, dtype: str):
+        self.path = path
+        self.dimension = dimension
+        self.dtype = dtype
+        self.lock = threading.RLock()
+        self.codes = np.zeros((0, dimension), dtype=RESCORE_DTYPES[dtype])
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._used = 0
+        self.dirty = False
+
+    @classmethod
+    def load(cls, path: str, dimension: int, dtype: str) -> "QuantizedVectors":
+        store = cls(path, dimension, dtype)
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as data:
+                codes = data["codes"]
+                if codes.dtype != store.codes.dtype or codes.shape[1] != dimension:
+                    raise ValueError(
+                        f"{path} holds {codes.shape[1]}-dimensional {codes.dtype} vectors, "
+                        f"expected {dimension}-dimensional {dtype}"
+                    )
+                store.codes = codes
+                store.scales = data["scales"]
+                store.rows = {chunk_id: row for row, chunk_id in enumerate(data["ids"].tolist())}
+                store._used = len(store.rows)
+        return store
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if self._used == len(self.codes):
+            capacity = max(64, 2 * len(self.codes))
+            codes = np.zeros((capacity, self.dimension), dtype=self.codes.dtype)
+            codes[:self._used] = self.codes[:self._used]
+            scales = np.zeros(capacity, dtype=np.float32)
+            scales[:self._used] = self.scales[:self._used]
+            self.codes, self.scales = codes, scales
+        self._used += 1
+        return self._used - 1
+
+    def add(self, ids: Sequence[str], vectors: np.ndarray) -> None:
+        codes, scales = quantize(np.asarray(vectors, dtype=np.float32), self.dtype)
+        with self.lock:
+            rows = []
+            for chunk_id in ids:
+                row = self.rows.get(chunk_id)
+                if row is None:
+                    row = self.rows[chunk_id] = self._allocate()
+                rows.append(row)
+            self.codes[rows] = codes
+            self.scales[rows] = scales
+            self.dirty = True
+
+    def remove(self, ids: Sequence[str]) -> None:
+        with self.lock:
+            for chunk_id in ids:
+                row = self.rows.pop(chunk_id, None)
+                if row is not None:
+                    self._free.append(row)
+            self.dirty = True
+
+    def get(self, ids: Sequence[str]) -> Dict[str, np.ndarray]:
+        """`{id: float32 vector}` for the stored chunks among `ids`."""
+        with self.lock:
+            found = [chunk_id for chunk_id in ids if chunk_id in self.rows]
+            rows = [self.rows[chunk_id] for chunk_id in found]
+            vectors = dequantize(self.codes[rows], self.scales[rows])
+        return dict(zip(found, vectors))
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+            ids = list(self.rows)
+            rows = [self.rows[chunk_id] for chunk_id in ids]
+            # Saving also compacts: rows freed by removals are dropped from memory too.
+            self.codes, self.scales = self.codes[rows], self.scales[rows]
+            self.rows = {chunk_id: row for row, chunk_id in enumerate(ids)}
+            self._free = []
+            self._used = len(ids)
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp.npz"
+            # Quantized vectors barely compress; plain npz keeps saves cheap.
+            np.savez(tmp_path, ids=np.array(ids, dtype=str), codes=self.codes, scales=self.scales)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+
+def query_collection(
+    collection,
+    layout: VectorLayout,
+    store: Optional[QuantizedVectors],
+    query_embedding,
+    n_results: int,
+    where: Optional[dict] = None,
+    oversample: int = settings.VECTOR_RESCORE_OVERSAMPLE,
+):
+    """Nearest chunks to a native `query_embedding` as `(ids, documents, embeddings, distances)`, best first.
+
+    Collections with a side store are searched for `oversample` x `n_results`
+    candidates in the reduced index, which are re-ranked by cosine distance to
+    their side-store vectors.
+    """
+    rescore = layout.rescored and store is not None
+    results = collection.query(
+        query_embeddings=layout.index_vectors([query_embedding]),
+        n_results=n_results * oversample if rescore else n_results,
+        where=where,
+        include=["documents", "distances", "embeddings"],
+    )
+    ids, documents, embeddings, distances = (
+        results["ids"][0], results["documents"][0], list(results["embeddings"][0]), results["distances"][0]
+    )
+    if not rescore:
+        return ids, documents, embeddings, distances
+
+    query = layout.rescore_vectors([query_embedding])[0]
+    stored = store.get(ids)
+    candidates = []
+    for chunk_id, document, embedding, distance in zip(ids, documents, embeddings, distances):
+        vector = stored.get(chunk_id)
+        if vector is None:
+            # In the index but not the side store (ingest interrupted before it was saved).
+            vector = layout.pad(embedding)
+        else:
+            distance = 1.0 - float(vector @ query) / max(float(np.linalg.norm(vector)), 1e-12)
+        candidates.append((distance, chunk_id, document, vector))
+    candidates.sort(key=lambda candidate: candidate[0])
+    candidates = candidates[:n_results]
+    return (
+        [chunk_id for _, chunk_id, _, _ in candidates],
+        [document for _, _, document, _ in candidates],
+        [vector for _, _, _, vector in candidates],
+        [distance for distance, _, _, _ in candidates],
+    )
@@ -0,0 +1,180 @@
+"""Vector footprint of the collections, and what compact layouts would cost in recall.
+
+First, for every collection: its vector layout (see `utils.vector_store`), its
+chunks, the vector bytes they take (float32 index vectors plus quantized
+side-store vectors; HNSW graph links and document text are not counted) and
+the size of its side-store file.
+
+Then candidate layouts are compared with the full-precision baseline on up
+to `--collections` collections. Every sampled chunk (or every line of
+`--queries`, embedded with the configured backend) is a query; the exact top
+k other chunks of its collection by full-precision cosine similarity are the
+ground truth, and recall@k is the share of them a layout finds: exact search
+on its index vectors, then re-scoring of `--oversample` x k candidates with
+its dequantized side-store vectors. Both sides search exactly, so the numbers
+show what compression loses, not HNSW's own approximation.
+
+Baseline vectors are read from collections stored in full precision and
+re-embedded from the chunk text otherwise.
+
+    python vector_report.py
+    python vector_report.py --layout 512/128/int8 --layout 384 -k 10 --sample 500
+"""
+import argparse
+import os
+
+import numpy as np
+
+from utils import settings
+from utils.registry import get_registry
+from utils.vector_store import VectorLayout, dequantize, quantize, truncate
+
+
+def parse_layout(spec: str, native_dimension: int) -> VectorLayout:
+    """"full", "DIMS" (no side store) or "DIMS/INDEX_DIMS/DTYPE"."""
+    if spec == "full":
+        return VectorLayout.full(native_dimension)
+    parts = spec.split("/")
+    if len(parts) == 1:
+        return VectorLayout.from_spec({"dimensions": int(parts[0])}, native_dimension)
+    dimension, index_dimension, rescore_dtype = parts
+    return VectorLayout.from_spec(
+        {"dimensions": int(dimension), "index_dimensions": int(index_dimension), "rescore_dtype": rescore_dtype},
+        native_dimension,
+    )
+
+
+def default_layouts(native_dimension: int) -> list:
+    d = native_dimension
+    return ["full", f"{d // 4}", f"{d}/{d // 4}/int8", f"{d // 2}/{d // 8}/int8", f"{d // 3}/{d // 12}/int8"]
+
+
+def file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def baseline_vectors(registry, name: str):
+    """`(ids, full-precision embeddings)` of every chunk in a collection."""
+    stored = registry.get_collection(name).get(include=["documents", "embeddings"])
+    if registry.get_vector_layout(name).index_dimension == registry.embedding.dimension:
+        return stored["ids"], np.asarray(stored["embeddings"], dtype=np.float32)
+    return stored["ids"], np.asarray(registry.embedding.embed(stored["documents"]), dtype=np.float32)
+
+
+def search(layout: VectorLayout, vectors: np.ndarray, queries: np.ndarray, k: int, oversample: int, exclude=None):
+    """Indices of the top `k` rows of `vectors` for each query under `layout`."""
+    scores = truncate(queries, layout.index_dimension) @ truncate(vectors, layout.index_dimension).T
+    if exclude is not None:
+        scores[np.arange(len(queries)), exclude] = -np.inf
+    if not layout.rescored:
+        return np.argsort(-scores, axis=1)[:, :k]
+    candidates = np.argsort(-scores, axis=1)[:, :k * oversample]
+    side = dequantize(*quantize(truncate(vectors, layout.dimension), layout.rescore_dtype))
+    side /= np.maximum(np.linalg.norm(side, axis=1, keepdims=True), 1e-12)
+    rescored = np.einsum("qcd,qd->qc", side[candidates], truncate(queries, layout.dimension))
+    return np.take_along_axis(candidates, np.argsort(-rescored, axis=1)[:, :k], axis=1)
+
+
+def recall(layout, vectors, queries, k, oversample, exclude, truth) -> float:
+    found = search(layout, vectors, queries, k, oversample, exclude)
+    return float(np.mean([len(set(row) & set(expected)) / len(expected) for row, expected in zip(found, truth)]))
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(headers, *rows)]
+    for row in [headers, *rows]:
+        print("  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db-path", default=settings.CHROMA_DB_PATH)
+    parser.add_argument("--layout", action="append", help='"full", "DIMS" or "DIMS/INDEX_DIMS/DTYPE"; repeatable')
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--oversample", type=int, default=settings.VECTOR_RESCORE_OVERSAMPLE)
+    parser.add_argument("--sample", type=int, default=200, help="chunks used as queries per collection")
+    parser.add_argument("--collections", type=int, default=20, help="collections evaluated")
+    parser.add_argument("--queries", help="file with one query per line, instead of sampled chunks")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    registry = get_registry(args.db_path)
+    native_dimension = registry.embedding.dimension
+    rng = np.random.default_rng(args.seed)
+
+    rows = []
+    names = []
+    total_chunks = total_bytes = 0
+    for name in sorted(registry.chroma_client.list_collections()):
+        try:
+            layout = registry.get_vector_layout(name)
+        except ValueError as e:
+            print(f"{name}: skipped ({e})")
+            continue
+        count = registry.get_collection(name).count()
+        side_store = file_size(os.path.join(args.db_path, "vectors", f"{name}.npz"))
+        rows.append([name, str(layout), count, layout.bytes_per_vector, count * layout.bytes_per_vector, side_store])
+        total_chunks += count
+        total_bytes += count * layout.bytes_per_vector
+        if count > args.k:
+            names.append(name)
+        registry.drop_collection(name)
+    print(f"Collections in {args.db_path} ({registry.embedding.name}, {native_dimension} dims)\n")
+    print_table(["collection", "layout", "chunks", "bytes/vector", "vector_bytes", "side_store_file"], rows)
+    print(
+        f"\n{total_chunks} chunks, {total_bytes / 2**20:.1f} MiB of vectors "
+        f"({total_chunks * 4 * native_dimension / 2**20:.1f} MiB at full precision), "
+        f"{directory_size(args.db_path) / 2**20:.1f} MiB on disk"
+    )
+
+    queries = None
+    if args.queries:
+        with open(args.queries) as f:
+            lines = [line.strip() for line in f if line.strip()]
+        queries = np.asarray(registry.embedding.embed(lines), dtype=np.float32)
+    layouts = [parse_layout(spec, native_dimension) for spec in args.layout or default_layouts(native_dimension)]
+    if len(names) > args.collections:
+        names = sorted(rng.choice(names, size=args.collections, replace=False))
+    recalls = {str(layout): [] for layout in layouts}
+    evaluated = 0
+    for name in names:
+        _, vectors = baseline_vectors(registry, name)
+        registry.drop_collection(name)
+        if queries is None:
+            sample = rng.choice(len(vectors), size=min(args.sample, len(vectors)), replace=False)
+            collection_queries, exclude = vectors[sample], sample
+        else:
+            collection_queries, exclude = queries, None
+        truth = search(VectorLayout.full(native_dimension), vectors, collection_queries, args.k, 1, exclude)
+        for layout in layouts:
+            recalls[str(layout)].append(
+                recall(layout, vectors, collection_queries, args.k, args.oversample, exclude, truth)
+            )
+        evaluated += 1
+    if not evaluated:
+        print(f"\nNo collection has more than k={args.k} chunks to evaluate recall on.")
+        return
+
+    full_bytes = 4 * native_dimension
+    print(f"\nRecall@{args.k} against full precision over {evaluated} collections (oversample {args.oversample})\n")
+    print_table(
+        ["layout", "bytes/vector", "reduction", f"recall@{args.k}", "min"],
+        [
+            [
+                str(layout),
+                layout.bytes_per_vector,
+                f"{full_bytes / layout.bytes_per_vector:.1f}x",
+                f"{np.mean(recalls[str(layout)]):.3f}",
+                f"{np.min(recalls[str(layout)]):.3f}",
+            ]
+            for layout in layouts
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
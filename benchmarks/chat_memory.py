@@ -0,0 +1,176 @@
+"""Prompt size of /api/ai_chat over a long conversation, per chat memory mode.
+
+Plays a `--turns`-turn conversation about one document against the fake
+Ollama server (see fake_servers.py) in each mode and records the estimated
+prompt tokens of every turn:
+
+  full     the whole chat history (what prompts grow to without a bound)
+  window   the last CHAT_HISTORY_MAX_MESSAGES / CHAT_HISTORY_MAX_TOKENS only
+  summary  the last CHAT_MEMORY_RECENT_TURNS turns verbatim plus a running summary
+  summary_slow     summary mode with a summarizer that only catches up every
+                   `--slow-every` turns
+  summary_failing  summary mode with a summarizer that always fails
+
+In summary mode the summary is brought up to date after every turn, as the
+background update would between turns of a real conversation. `max_gap` is
+the most messages a prompt skipped between its summary and its verbatim
+messages; it must stay 0. Runs fully
+offline with the hashing embedding backend; sentence splitting needs the NLTK
+punkt data to be installed already.
+
+    python benchmarks/chat_memory.py
+    python benchmarks/chat_memory.py --turns 500 --answer-tokens 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import APP_DIR, compare_to_baseline, print_table, save_baseline  # noqa: E402
+from fake_servers import BackgroundServer, FakeConfig, create_app  # noqa: E402
+
+# IDs go through UUIDShortener.encode, which expects hex strings.
+DOCUMENT_ID = "b0c"
+USER_IDS = {"full": "a0f", "window": "a0e", "summary": "a0d", "summary_slow": "a0c", "summary_failing": "a0b"}
+REPORTED_TURNS = (1, 10, 50, 100, 200)
+
+
+async def failing_summarizer(summary, messages):
+    raise RuntimeError("summary model unavailable")
+
+
+def summarized_messages(user_id: str) -> int:
+    """Messages covered by the stored summary of the conversation."""
+    from utils.db_helper import get_chat_summary, get_pool
+
+    state = get_chat_summary(user_id, DOCUMENT_ID)
+    if not state or not state["summary"]:
+        return 0
+    with get_pool().connection() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM chat_messages WHERE user_id = ? AND document_id = ? AND id <= ?",
+            (user_id, DOCUMENT_ID, state["last_message_id"]),
+        ).fetchone()[0]
+
+
+async def play(mode: str, turns: int, slow_every: int):
+    from ai.services.ask_ai_service import AskAIService, Response
+    from ai.services.conversation_memory import ConversationMemory
+    from utils.db_helper import add_message, get_chat_history
+    from utils.storage import document_scope
+    from utils.tokens import estimate_tokens
+
+    user_id = USER_IDS[mode]
+    service = AskAIService(scope=document_scope(user_id, DOCUMENT_ID))
+    memory = ConversationMemory(mode={"full": "window", "window": "window"}.get(mode, "summary"))
+    if mode == "summary_failing":
+        memory._summarize = failing_summarizer
+    prompt_tokens = []
+    gaps = []
+    summary_seconds = 0.0
+    for turn in range(1, turns + 1):
+        request = f"Question {turn}: how does topic {turn % 17} relate to what we discussed about topic {turn % 5}?"
+        if mode == "full":
+            history = get_chat_history(user_id, document_id=DOCUMENT_ID)
+        else:
+            history = await memory.history(user_id, DOCUMENT_ID)
+        if mode.startswith("summary") and history and history[0]["role"] == "system":
+            gaps.append(2 * (turn - 1) - (len(history) - 1) - summarized_messages(user_id))
+        messages = await service.build_chat_messages(request, chat_history=history)
+        prompt_tokens.append(sum(estimate_tokens(message["content"]) for message in messages))
+        response = await service.ollama_client.agenerate_response(
+            messages=messages, format=Response.model_json_schema(), budget="chat"
+        )
+        answer = json.loads(response)["answer"]
+        add_message(user_id, "user", request, document_id=DOCUMENT_ID)
+        add_message(user_id, "assistant", answer, document_id=DOCUMENT_ID)
+        if mode == "summary" or (mode == "summary_slow" and turn % slow_every == 0) or mode == "summary_failing":
+            started = time.perf_counter()
+            try:
+                await memory.update(user_id, DOCUMENT_ID)
+            except RuntimeError:
+                memory.failures += 1
+            summary_seconds += time.perf_counter() - started
+
+    row = {f"turn_{turn}": prompt_tokens[turn - 1] for turn in REPORTED_TURNS if turn <= turns}
+    row["max"] = max(prompt_tokens)
+    row["summary_calls"] = memory.updates
+    row["window_fallbacks"] = memory.fallbacks
+    row["max_gap"] = max(gaps, default=0)
+    row["summary_ms_per_turn"] = summary_seconds / turns * 1000
+    return row
+
+
+async def play_all(turns: int, slow_every: int):
+    # One event loop for every mode: the model clients are bound to the loop they first ran on.
+    return {mode: await play(mode, turns, slow_every) for mode in USER_IDS}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--answer-tokens", type=int, default=120, help="length of every fake answer")
+    parser.add_argument("--slow-every", type=int, default=10, help="turns between summary_slow updates")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--save-baseline", nargs="?", const="default", default=None, metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    fake = BackgroundServer(
+        create_app(FakeConfig(latency=0.0, tokens_per_second=1e6, answer_tokens=args.answer_tokens))
+    ).start()
+    work_dir = tempfile.mkdtemp(prefix="rag-chat-memory-")
+    os.environ.update(
+        {
+            "OLLAMA_HOST": fake.url,
+            "EMBEDDING_BACKEND": "hashing",
+            "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "benchmark"),
+            "CHROMA_DB_PATH": os.path.join(work_dir, "chroma_db"),
+            "CHAT_DB_PATH": os.path.join(work_dir, "chat_history.db"),
+            "EMBEDDING_CACHE_ENABLED": "false",
+            "ANSWER_CACHE_ENABLED": "false",
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        }
+    )
+    sys.path.insert(0, APP_DIR)
+
+    results = {}
+    try:
+        from ai.services.rag_service import VectorDBManager
+        from utils.db_helper import init_db
+        from utils.storage import document_scope
+
+        init_db()
+        content = " ".join(f"Topic {i % 17} is explained by fact {i}." for i in range(400))
+        for user_id in USER_IDS.values():
+            VectorDBManager(scope=document_scope(user_id, DOCUMENT_ID)).add_document(content, DOCUMENT_ID, user_id)
+        results = asyncio.run(play_all(args.turns, args.slow_every))
+    finally:
+        fake.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    columns = [f"turn_{turn}" for turn in REPORTED_TURNS if turn <= args.turns]
+    print_table(
+        f"Estimated prompt tokens per turn ({args.turns} turns, {args.answer_tokens}-token answers)",
+        results,
+        columns + ["max", "summary_calls", "window_fallbacks", "max_gap", "summary_ms_per_turn"],
+    )
+    ok = True
+    gaps = [mode for mode, row in results.items() if row["max_gap"]]
+    if gaps:
+        print(f"\nMessages fell between the summary and the verbatim turns in: {', '.join(gaps)}")
+        ok = False
+    if args.baseline:
+        ok = compare_to_baseline("chat_memory", args.baseline, results, ["max"], args.tolerance) and ok
+    if args.save_baseline:
+        print(f"\nSaved baseline to {save_baseline('chat_memory', args.save_baseline, results)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
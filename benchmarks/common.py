@@ -0,0 +1,85 @@
+import json
+import os
+from typing import Dict, Sequence
+
+import numpy as np
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+# Metrics where a larger value is an improvement; everything else is a latency.
+HIGHER_IS_BETTER = {"throughput"}
+
+
+def summarize_latencies(seconds: Sequence[float]) -> Dict[str, float]:
+    """Count, mean and p50/p95/p99 of `seconds`, in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+def print_table(title: str, rows: Dict[str, Dict[str, float]], columns: Sequence[str]):
+    print(f"\n{title}")
+    width = max([len(name) for name in rows] + [8])
+    print(f"{'':<{width}}  " + "  ".join(f"{column:>12}" for column in columns))
+    for name, values in rows.items():
+        cells = []
+        for column in columns:
+            value = values.get(column)
+            if isinstance(value, float):
+                cells.append(f"{value:>12.2f}")
+            else:
+                cells.append(f"{'-' if value is None else value:>12}")
+        print(f"{name:<{width}}  " + "  ".join(cells))
+
+
+def baseline_path(suite: str, name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{suite}-{name}.json")
+
+
+def save_baseline(suite: str, name: str, results: Dict[str, Dict[str, float]]) -> str:
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(suite, name)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return path
+
+
+def compare_to_baseline(
+    suite: str, name: str, results: Dict[str, Dict[str, float]], metrics: Sequence[str], tolerance: float
+) -> bool:
+    """Print metrics that regressed by more than `tolerance` (a fraction); False if any did."""
+    path = baseline_path(suite, name)
+    if not os.path.exists(path):
+        print(f"\nNo baseline at {path}; run with --save-baseline first.")
+        return True
+    with open(path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for bench, values in results.items():
+        for metric in metrics:
+            old, new = baseline.get(bench, {}).get(metric), values.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > tolerance:
+                regressions.append(f"{bench}.{metric}: {old:.2f} -> {new:.2f} ({change:+.0%} worse)")
+
+    if regressions:
+        print(f"\nRegressions against {path} (tolerance {tolerance:.0%}):")
+        for line in regressions:
+            print(f"  {line}")
+        return False
+    print(f"\nNo regressions against {path} (tolerance {tolerance:.0%}).")
+    return True
@@ -0,0 +1,251 @@
+"""End-to-end benchmark of the HTTP API against local model stand-ins.
+
+Starts the fake Ollama/OpenAI server (see fake_servers.py) and the service itself
+(uvicorn main:app, pointed at the fake server through OLLAMA_HOST and
+OPENAI_BASE_URL, with its databases in a temporary directory). It ingests a
+synthetic corpus, then drives each endpoint at a fixed concurrency. For each
+endpoint it reports throughput and p50/p95/p99 latency, plus the time per
+request spent in each upstream model call and, from the service's
+Server-Timing headers, the mean time per request of each internal stage.
+
+    python benchmarks/e2e.py --requests 100 --concurrency 8
+    python benchmarks/e2e.py --save-baseline            # record benchmarks/baselines/e2e-default.json
+    python benchmarks/e2e.py --baseline default         # exit 1 on a >20% regression
+
+Sentence splitting needs the NLTK punkt data to be installed already.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import APP_DIR, compare_to_baseline, print_table, save_baseline, summarize_latencies  # noqa: E402
+from fake_servers import BackgroundServer, FakeConfig, create_app  # noqa: E402
+
+# IDs go through UUIDShortener.encode, which expects hex strings.
+USER_ID = "0a1b2c3d"
+DOCUMENT_ID = "00f"
+ENDPOINTS = ["add_document", "ask_ai", "ai_chat", "summarize", "translate"]
+TOPICS = ["photosynthesis", "mitosis", "thermodynamics", "entropy", "osmosis", "enzymes", "orbitals", "inertia"]
+
+
+def sentence(i: int) -> str:
+    topic = TOPICS[i % len(TOPICS)]
+    other = TOPICS[(i * 3 + 1) % len(TOPICS)]
+    return f"Fact {i} explains how {topic} relates to {other} in experiment {i % 97}."
+
+
+def corpus(n_sentences: int, offset: int = 0) -> str:
+    return " ".join(sentence(offset + i) for i in range(n_sentences))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_service(port: int, fake_url: str, work_dir: str, answer_cache: bool) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "OLLAMA_HOST": fake_url,
+        "OPENAI_BASE_URL": f"{fake_url}/v1",
+        "OPENAI_API_KEY": "benchmark",
+        "EMBEDDING_BACKEND": "openai",
+        "EMBEDDING_MODEL": "fake-embedding",
+        "CHROMA_DB_PATH": os.path.join(work_dir, "chroma_db"),
+        "CHAT_DB_PATH": os.path.join(work_dir, "chat_history.db"),
+        "EMBEDDING_CACHE_PATH": os.path.join(work_dir, "embedding_cache.db"),
+        "SUMMARY_CACHE_PATH": os.path.join(work_dir, "summary_cache.db"),
+        "TRANSLATION_MEMORY_PATH": os.path.join(work_dir, "translation_memory.db"),
+        "INGEST_SPOOL_DIR": os.path.join(work_dir, "ingest_spool"),
+        "ANSWER_CACHE_ENABLED": "true" if answer_cache else "false",
+    }
+    log = open(os.path.join(work_dir, "service.log"), "wb")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited early, see {log.name}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Service did not start, see {log.name}")
+
+
+def make_request(client: httpx.AsyncClient, endpoint: str, i: int):
+    if endpoint == "add_document":
+        params = {"user_id": USER_ID, "document_id": f"{0x1000 + i:x}", "document": corpus(20, offset=i * 20)}
+        return client.post("/api/add_document", params=params)
+    if endpoint == "ask_ai":
+        params = {"user_id": USER_ID, "document_id": DOCUMENT_ID, "request": f"What does fact {i} say?"}
+        params["no_cache"] = True
+        return client.get("/api/ask_ai", params=params)
+    if endpoint == "ai_chat":
+        params = {"user_id": USER_ID, "document_id": DOCUMENT_ID, "request": f"Tell me more about fact {i}."}
+        return client.get("/api/ai_chat", params=params)
+    if endpoint == "summarize":
+        params = {"user_id": USER_ID, "document_id": DOCUMENT_ID, "text": corpus(5, offset=i), "no_cache": True}
+        return client.get("/api/summarize", params=params)
+    if endpoint == "translate":
+        params = {"user_id": USER_ID, "document_id": DOCUMENT_ID, "request": sentence(i), "language": "German"}
+        return client.get("/api/translate", params=params)
+    raise ValueError(f"Unknown endpoint {endpoint}")
+
+
+def parse_server_timing(header: str):
+    """`{stage: milliseconds}` from a Server-Timing header value."""
+    timings = {}
+    for metric in filter(None, (part.strip() for part in header.split(","))):
+        name, *params = metric.split(";")
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                timings[name.strip()] = timings.get(name.strip(), 0.0) + float(value)
+    return timings
+
+
+async def drive(client: httpx.AsyncClient, endpoint: str, total: int, concurrency: int):
+    latencies = []
+    stage_ms = {}
+    errors = 0
+    indices = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in indices:
+            started = time.perf_counter()
+            try:
+                response = await make_request(client, endpoint, i)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+                for stage, ms in parse_server_timing(response.headers.get("server-timing", "")).items():
+                    stage_ms[stage] = stage_ms.get(stage, 0.0) + ms
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    stage_means = {stage: ms / len(latencies) for stage, ms in stage_ms.items()} if latencies else {}
+    return latencies, stage_means, errors, wall
+
+
+async def run(args, service_url: str, fake_url: str):
+    results = {}
+    stages = {}
+    server_stages = {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=service_url, timeout=300, limits=limits) as client, httpx.AsyncClient(
+        base_url=fake_url
+    ) as fake:
+        started = time.perf_counter()
+        response = await client.post(
+            "/api/upload_document",
+            params={"user_id": USER_ID, "document_id": DOCUMENT_ID},
+            files={"file": ("corpus.txt", corpus(args.corpus_sentences).encode("utf-8"), "text/plain")},
+        )
+        response.raise_for_status()
+        print(f"Ingested {response.json()['chunks']} chunks in {time.perf_counter() - started:.1f}s")
+
+        for endpoint in args.endpoints:
+            await fake.post("/stats/reset")
+            latencies, stage_means, errors, wall = await drive(client, endpoint, args.requests, args.concurrency)
+            for stage, ms in stage_means.items():
+                server_stages[f"{endpoint}: {stage}"] = {"ms/req": ms}
+            results[endpoint] = {
+                **summarize_latencies(latencies),
+                "errors": errors,
+                "throughput": len(latencies) / wall if wall else 0.0,
+            }
+            upstream = (await fake.get("/stats")).json()
+            for route, stats in upstream.items():
+                stages[f"{endpoint} -> {route}"] = {
+                    "calls/req": stats["calls"] / args.requests,
+                    "ms/req": stats["seconds"] * 1000.0 / args.requests,
+                    "share": stats["seconds"] * 1000.0 / args.requests / results[endpoint].get("mean_ms", 1.0),
+                }
+    return results, stages, server_stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", nargs="+", default=ENDPOINTS, choices=ENDPOINTS)
+    parser.add_argument("--requests", type=int, default=50, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--corpus-sentences", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=FakeConfig.latency, help="seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=FakeConfig.tokens_per_second)
+    parser.add_argument("--answer-tokens", type=int, default=FakeConfig.answer_tokens)
+    parser.add_argument("--embedding-dimension", type=int, default=FakeConfig.embedding_dimension)
+    parser.add_argument("--embedding-latency", type=float, default=FakeConfig.embedding_latency)
+    parser.add_argument("--answer-cache", action="store_true", help="leave the semantic answer cache enabled")
+    parser.add_argument("--baseline", default=None, help="compare against this saved baseline")
+    parser.add_argument("--save-baseline", nargs="?", const="default", default=None, metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--keep-work-dir", action="store_true")
+    args = parser.parse_args()
+
+    config = FakeConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        embedding_dimension=args.embedding_dimension,
+        embedding_latency=args.embedding_latency,
+    )
+    work_dir = tempfile.mkdtemp(prefix="rag-bench-")
+    fake_server = BackgroundServer(create_app(config)).start()
+    port = free_port()
+    service = start_service(port, fake_server.url, work_dir, answer_cache=args.answer_cache)
+    try:
+        results, stages, server_stages = asyncio.run(run(args, f"http://127.0.0.1:{port}", fake_server.url))
+    finally:
+        service.terminate()
+        service.wait(timeout=30)
+        fake_server.stop()
+        if args.keep_work_dir:
+            print(f"Work directory kept at {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(
+        f"Endpoints ({args.requests} requests each, concurrency {args.concurrency})",
+        results,
+        ["count", "errors", "throughput", "mean_ms", "p50_ms", "p95_ms", "p99_ms"],
+    )
+    print_table("Upstream model calls (share = fraction of mean latency)", stages, ["calls/req", "ms/req", "share"])
+    if server_stages:
+        print_table("Service stages (Server-Timing, nested stages overlap)", server_stages, ["ms/req"])
+
+    ok = True
+    if args.baseline:
+        metrics = ["p50_ms", "p95_ms", "p99_ms", "throughput"]
+        ok = compare_to_baseline("e2e", args.baseline, results, metrics, args.tolerance)
+    if args.save_baseline:
+        print(f"\nSaved baseline to {save_baseline('e2e', args.save_baseline, results)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
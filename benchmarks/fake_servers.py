@@ -0,0 +1,291 @@
+"""Local stand-ins for the Ollama and OpenAI HTTP APIs used by the service.
+
+One FastAPI app serves both protocols:
+  - Ollama: POST /api/chat (streaming and not), POST /api/embed, GET /api/tags,
+    GET /api/ps
+  - OpenAI: POST /v1/chat/completions, POST /v1/embeddings
+
+Generation waits `latency` seconds before the first token and then emits
+`answer_tokens` tokens at `tokens_per_second`. Structured output requests (an
+Ollama `format` schema or an OpenAI `json_schema` response format) get a JSON
+object with every schema property filled in. Streamed answers start with
+`reasoning_tokens` tokens inside `<think>` tags unless the request continues an
+assistant message. Embeddings are deterministic per text, so caches behave as
+they would against a real model. The first request for a model waits
+`model_load_latency` seconds more and marks it loaded (listed by /api/ps); a
+chat request without messages only loads the model.
+
+Per-route call counts and time spent are served at GET /stats, reset with
+POST /stats/reset.
+
+Run standalone: python benchmarks/fake_servers.py --port 11434
+"""
+import argparse
+import asyncio
+import base64
+import json
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+WORDS = (
+    "the cell membrane controls which substances enter and leave while energy from light "
+    "is converted into chemical bonds during photosynthesis in the chloroplast"
+).split()
+
+
+@dataclass
+class FakeConfig:
+    latency: float = 0.2
+    tokens_per_second: float = 50.0
+    answer_tokens: int = 64
+    embedding_dimension: int = 256
+    embedding_latency: float = 0.02
+    reasoning: bool = True
+    reasoning_tokens: int = 1
+    model_load_latency: float = 0.0
+
+
+class RouteStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.routes = {}
+
+    def record(self, route: str, seconds: float, items: int = 1):
+        with self._lock:
+            stats = self.routes.setdefault(route, {"calls": 0, "items": 0, "seconds": 0.0})
+            stats["calls"] += 1
+            stats["items"] += items
+            stats["seconds"] += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {route: dict(stats) for route, stats in self.routes.items()}
+
+
+def _answer_words(n: int):
+    return [WORDS[i % len(WORDS)] for i in range(n)]
+
+
+def _structured_content(schema: dict, n_tokens: int) -> str:
+    properties = (schema or {}).get("properties") or {"answer": {}}
+    text = " ".join(_answer_words(n_tokens))
+    return json.dumps({name: text for name in properties})
+
+
+def _embedding(text: str, dimension: int) -> np.ndarray:
+    rng = np.random.default_rng(zlib.crc32(text.encode("utf-8")))
+    vector = rng.standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def create_app(config: FakeConfig = None) -> FastAPI:
+    config = config or FakeConfig()
+    stats = RouteStats()
+    app = FastAPI()
+    app.state.config = config
+    app.state.stats = stats
+    app.state.loaded = set()
+
+    async def load(model: str):
+        if model not in app.state.loaded:
+            await asyncio.sleep(config.model_load_latency)
+            app.state.loaded.add(model)
+
+    def generation_seconds(n_tokens: int) -> float:
+        return config.latency + n_tokens / config.tokens_per_second
+
+    @app.get("/")
+    async def root():
+        return "Ollama is running"
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": []}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": model, "model": model} for model in sorted(app.state.loaded)]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats.snapshot()
+
+    @app.post("/stats/reset")
+    async def reset_stats():
+        stats.reset()
+        return {"ok": True}
+
+    @app.post("/api/chat")
+    async def ollama_chat(request: Request):
+        body = await request.json()
+        started = time.perf_counter()
+        schema = body.get("format")
+        messages = body.get("messages") or []
+        n_tokens = config.answer_tokens
+        await load(body.get("model", "fake"))
+
+        def final_part(content: str) -> dict:
+            return {
+                "model": body.get("model", "fake"),
+                "created_at": "2025-01-01T00:00:00Z",
+                "message": {"role": "assistant", "content": content},
+                "done": True,
+                "done_reason": "stop",
+                "prompt_eval_count": sum(len(m.get("content", "")) // 4 for m in body.get("messages", [])),
+                "eval_count": n_tokens,
+                "prompt_eval_duration": int(config.latency * 1e9),
+                "eval_duration": int(n_tokens / config.tokens_per_second * 1e9),
+                "total_duration": int(generation_seconds(n_tokens) * 1e9),
+            }
+
+        if not messages:
+            stats.record("ollama.load", time.perf_counter() - started)
+            return {**final_part(""), "done_reason": "load", "eval_count": 0}
+
+        if not body.get("stream", True):
+            await asyncio.sleep(generation_seconds(n_tokens))
+            if isinstance(schema, dict) or schema == "json":
+                content = _structured_content(schema if isinstance(schema, dict) else None, n_tokens)
+            else:
+                content = " ".join(_answer_words(n_tokens))
+            stats.record("ollama.chat", time.perf_counter() - started)
+            return final_part(content)
+
+        async def parts():
+            try:
+                await asyncio.sleep(config.latency)
+                continues = messages[-1].get("role") == "assistant"
+                pieces = []
+                if config.reasoning and not continues:
+                    pieces = ["<think>", *(f"{word} " for word in _answer_words(config.reasoning_tokens)), "</think>"]
+                pieces += [f"{word} " for word in _answer_words(n_tokens)]
+                for piece in pieces:
+                    part = {"model": body.get("model", "fake"), "message": {"role": "assistant", "content": piece}}
+                    yield json.dumps({**part, "done": False}) + "\n"
+                    await asyncio.sleep(1.0 / config.tokens_per_second)
+                yield json.dumps(final_part("")) + "\n"
+            finally:
+                stats.record("ollama.chat_stream", time.perf_counter() - started)
+
+        return StreamingResponse(parts(), media_type="application/x-ndjson")
+
+    @app.post("/api/embed")
+    async def ollama_embed(request: Request):
+        body = await request.json()
+        started = time.perf_counter()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await load(body.get("model", "fake"))
+        await asyncio.sleep(config.embedding_latency)
+        embeddings = [_embedding(text, config.embedding_dimension).tolist() for text in texts]
+        stats.record("ollama.embed", time.perf_counter() - started, items=len(texts))
+        return {"model": body.get("model", "fake"), "embeddings": embeddings}
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        body = await request.json()
+        started = time.perf_counter()
+        n_tokens = min(config.answer_tokens, body.get("max_tokens") or config.answer_tokens)
+        await asyncio.sleep(generation_seconds(n_tokens))
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            content = _structured_content(response_format["json_schema"].get("schema"), n_tokens)
+        elif response_format.get("type") == "json_object":
+            content = _structured_content(None, n_tokens)
+        else:
+            content = " ".join(_answer_words(n_tokens))
+        stats.record("openai.chat", time.perf_counter() - started)
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+            ],
+            "usage": {"prompt_tokens": 0, "completion_tokens": n_tokens, "total_tokens": n_tokens},
+        }
+
+    @app.post("/v1/embeddings")
+    async def openai_embeddings(request: Request):
+        body = await request.json()
+        started = time.perf_counter()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(config.embedding_latency)
+        data = []
+        for i, text in enumerate(texts):
+            vector = _embedding(text, config.embedding_dimension)
+            if body.get("encoding_format") == "base64":
+                encoded = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                encoded = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": encoded})
+        stats.record("openai.embeddings", time.perf_counter() - started, items=len(texts))
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "fake"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+class BackgroundServer:
+    """Runs an ASGI app with uvicorn on a background thread."""
+
+    def __init__(self, app, host: str = "127.0.0.1", port: int = 0):
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self, timeout: float = 10.0) -> "BackgroundServer":
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Fake server did not start")
+            time.sleep(0.01)
+        return self
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=FakeConfig.latency)
+    parser.add_argument("--tokens-per-second", type=float, default=FakeConfig.tokens_per_second)
+    parser.add_argument("--answer-tokens", type=int, default=FakeConfig.answer_tokens)
+    parser.add_argument("--embedding-dimension", type=int, default=FakeConfig.embedding_dimension)
+    parser.add_argument("--embedding-latency", type=float, default=FakeConfig.embedding_latency)
+    args = parser.parse_args()
+    config = FakeConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        embedding_dimension=args.embedding_dimension,
+        embedding_latency=args.embedding_latency,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Memory held while streaming a large upload through ingestion.
+
+Streams a synthetic `--megabytes` document (default 200) through
+`add_document_stream` in INGEST_READ_BLOCK_SIZE blocks, as
+/api/upload_document does, once with lexical indexing off ("vector") and
+once with it on ("hybrid"). Each run happens in a fresh process and reports:
+
+  ingest_s        wall time of the ingestion
+  mb_per_s        document megabytes ingested per second
+  rss_growth_mb   peak resident memory during the ingestion minus the resident
+                  memory before it
+  collection_mb   resident memory a fresh process needs to open the ingested
+                  collection and search it once, i.e. Chroma's in-process
+                  HNSW index, which grows with the document by design
+  held_mb         rss_growth_mb - collection_mb: what ingestion itself holds
+
+The run fails (exit status 1) when `held_mb` exceeds `--max-held-mb`; a bound
+well below the document size shows that streaming keeps memory flat. Runs
+fully offline with the hashing embedding backend at a small dimension.
+
+    python benchmarks/ingest_memory.py
+    python benchmarks/ingest_memory.py --megabytes 50 --baseline default
+"""
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import APP_DIR, compare_to_baseline, print_table, save_baseline  # noqa: E402
+
+MODES = ("vector", "hybrid")
+MAX_HELD_MB = 48.0
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # No procfs (macOS): fall back to the peak, reported in bytes there.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PeakRSS:
+    """Samples the resident set size in the background and keeps the largest value."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def synthetic_blocks(megabytes: int, block_size: int, seed: int = 0):
+    """`megabytes` of text in `block_size` blocks, built from a pool of random sentences."""
+    rng = np.random.default_rng(seed)
+    words = np.array([f"term{i}" for i in range(20000)])
+    pool = [" ".join(sentence).capitalize() + "." for sentence in rng.choice(words, size=(20000, 14))]
+    remaining = megabytes * 2**20
+    while remaining > 0:
+        parts, size = [], 0
+        for i in rng.integers(0, len(pool), size=block_size // 100):
+            parts.append(pool[i])
+            size += len(pool[i]) + 1
+            if size >= min(block_size, remaining):
+                break
+        block = " ".join(parts) + " "
+        remaining -= len(block)
+        yield block
+
+
+def use_work_dir(mode: str, work_dir: str):
+    """Point this process at the databases of `mode` under `work_dir`."""
+    os.makedirs(os.path.join(work_dir, mode), exist_ok=True)
+    os.environ.update(
+        {
+            "RETRIEVAL_MODE": mode,
+            "CHROMA_DB_PATH": os.path.join(work_dir, mode, "chroma_db"),
+            "CHAT_DB_PATH": os.path.join(work_dir, mode, "chat_history.db"),
+        }
+    )
+    sys.path.insert(0, APP_DIR)
+
+
+def ingest(mode: str, megabytes: int, work_dir: str) -> dict:
+    """Run in a child process: stream the document into a fresh collection and measure it."""
+    use_work_dir(mode, work_dir)
+    from ai.services.rag_service import VectorDBManager
+    from utils import settings
+    from utils.db_helper import init_db
+    from utils.storage import document_scope
+
+    init_db()
+    manager = VectorDBManager(scope=document_scope("a0a", "b0b"))
+    # Warm up imports, the embedding backend and the collection before the baseline reading.
+    manager.add_document_stream(["Warm-up sentence. Another one."], document_id="b0a", user_id="a0a")
+    blocks = synthetic_blocks(megabytes, settings.INGEST_READ_BLOCK_SIZE)
+    before = rss_bytes()
+    started = time.perf_counter()
+    with PeakRSS() as peak:
+        chunks = manager.add_document_stream(blocks, document_id="b0b", user_id="a0a")
+    elapsed = time.perf_counter() - started
+    return {
+        "chunks": chunks,
+        "ingest_s": elapsed,
+        "mb_per_s": megabytes / elapsed,
+        "rss_growth_mb": (peak.peak - before) / 2**20,
+    }
+
+
+def open_collection(mode: str, work_dir: str) -> float:
+    """Run in a child process: resident memory growth of opening and searching the ingested collection."""
+    use_work_dir(mode, work_dir)
+    from ai.services.rag_service import VectorDBManager
+    from utils.storage import document_scope
+
+    # Warm up imports and the embedding backend on another collection first.
+    VectorDBManager(scope=document_scope("a0a", "c0c")).add_document(
+        "Warm-up sentence. Another one.", document_id="c0c", user_id="a0a"
+    )
+    before = rss_bytes()
+    with PeakRSS() as peak:
+        manager = VectorDBManager(scope=document_scope("a0a", "b0b"))
+        manager.collection.query(query_embeddings=manager.get_embedding(["term1 term2"]), n_results=1)
+    return (peak.peak - before) / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--megabytes", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=64, help="hashing embedding dimension")
+    parser.add_argument("--max-held-mb", type=float, default=MAX_HELD_MB)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--save-baseline", nargs="?", const="default", default=None, metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="rag-ingest-memory-")
+    os.environ.update(
+        {
+            "EMBEDDING_BACKEND": "hashing",
+            "HASHING_EMBEDDING_DIMENSION": str(args.dimension),
+            "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "benchmark"),
+            "EMBEDDING_CACHE_ENABLED": "false",
+            "ANSWER_CACHE_ENABLED": "false",
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        }
+    )
+
+    results = {}
+    try:
+        for mode in MODES:
+            # A fresh process per mode, so memory freed by one run cannot hide growth in the next.
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                results[mode] = executor.submit(ingest, mode, args.megabytes, work_dir).result()
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                results[mode]["collection_mb"] = executor.submit(open_collection, mode, work_dir).result()
+            results[mode]["held_mb"] = results[mode]["rss_growth_mb"] - results[mode]["collection_mb"]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(
+        f"Streaming ingestion of {args.megabytes} MB ({args.dimension}-dim hashing embeddings)",
+        results,
+        ["chunks", "ingest_s", "mb_per_s", "rss_growth_mb", "collection_mb", "held_mb"],
+    )
+    ok = True
+    over = [mode for mode, values in results.items() if values["held_mb"] > args.max_held_mb]
+    if over:
+        print(f"\nIngestion held more than {args.max_held_mb:.0f} MB in: {', '.join(over)}")
+        ok = False
+    if args.baseline:
+        metrics = ["ingest_s", "held_mb"]
+        ok = compare_to_baseline("ingest_memory", args.baseline, results, metrics, args.tolerance) and ok
+    if args.save_baseline:
+        print(f"\nSaved baseline to {save_baseline('ingest_memory', args.save_baseline, results)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
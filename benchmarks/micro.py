@@ -0,0 +1,110 @@
+"""Microbenchmarks for the hot paths that do not involve a model call.
+
+  create_chunks          sentence list -> chunks
+  chroma_query           HNSW top-20 query on a populated collection
+  retrieve_context       vector search plus context assembly (hashing embeddings)
+  chat_history_window    get_chat_history on a long conversation
+  chat_history_page      one page of get_chat_history_page on the same conversation
+
+Runs fully offline: embeddings use the hashing backend and every database
+lives in a temporary directory.
+
+    python benchmarks/micro.py
+    python benchmarks/micro.py --save-baseline
+    python benchmarks/micro.py --baseline default
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import APP_DIR, compare_to_baseline, print_table, save_baseline, summarize_latencies  # noqa: E402
+
+
+def timed(func, repeat: int):
+    func()  # warm-up
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - started)
+    return summarize_latencies(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--sentences", type=int, default=20000)
+    parser.add_argument("--collection-chunks", type=int, default=5000)
+    parser.add_argument("--history-messages", type=int, default=100000)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--save-baseline", nargs="?", const="default", default=None, metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="rag-micro-")
+    os.environ.update(
+        {
+            "EMBEDDING_BACKEND": "hashing",
+            "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "benchmark"),
+            "CHAT_DB_PATH": os.path.join(work_dir, "chat_history.db"),
+            "EMBEDDING_CACHE_ENABLED": "false",
+            "ANSWER_CACHE_ENABLED": "false",
+        }
+    )
+    sys.path.insert(0, APP_DIR)
+    from ai.services.rag_service import VectorDBManager
+    from utils.db_helper import get_chat_history, get_chat_history_page, get_pool, init_db
+
+    results = {}
+    try:
+        manager = VectorDBManager(db_path=os.path.join(work_dir, "chroma_db"), collection_name="micro_benchmark")
+        rng = np.random.default_rng(0)
+        words = [f"term{i}" for i in range(5000)]
+        sentences = [" ".join(rng.choice(words, size=14)).capitalize() + "." for _ in range(args.sentences)]
+        results["create_chunks"] = timed(lambda: manager.create_chunks(sentences), args.repeat)
+
+        chunks = manager.create_chunks(sentences)[: args.collection_chunks]
+        ids, metadatas = manager.chunk_records(chunks, document_id="micro", user_id="micro")
+        manager.write_chunks(ids, chunks, manager.get_embedding(chunks), metadatas)
+        query = manager.get_embedding(["term1 term2 term3 term4"])
+        results["chroma_query"] = timed(
+            lambda: manager.collection.query(query_embeddings=query, n_results=20, include=["documents", "distances"]),
+            args.repeat,
+        )
+        results["retrieve_context"] = timed(lambda: manager.retrieve_context("term1 term2 term3 term4"), args.repeat)
+
+        init_db()
+        with get_pool().connection() as conn:
+            conn.executemany(
+                "INSERT INTO chat_messages (user_id, document_id, role, content) VALUES (?, ?, ?, ?)",
+                (
+                    ("micro", "micro", "user" if i % 2 == 0 else "assistant", f"Message {i}: " + "lorem ipsum " * 20)
+                    for i in range(args.history_messages)
+                ),
+            )
+        results["chat_history_window"] = timed(
+            lambda: get_chat_history("micro", document_id="micro", max_messages=20, max_tokens=2000), args.repeat
+        )
+        results["chat_history_page"] = timed(
+            lambda: get_chat_history_page("micro", document_id="micro", limit=50), args.repeat
+        )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table("Microbenchmarks", results, ["count", "mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    ok = True
+    if args.baseline:
+        ok = compare_to_baseline("micro", args.baseline, results, ["p50_ms", "p95_ms"], args.tolerance)
+    if args.save_baseline:
+        print(f"\nSaved baseline to {save_baseline('micro', args.save_baseline, results)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
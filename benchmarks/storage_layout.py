@@ -0,0 +1,173 @@
+"""Per-document vs shared collections at many documents.
+
+Ingests the same synthetic corpus (`--documents` documents of a few chunks
+each, spread over `--users` users) once per storage layout and reports:
+
+  build          ingest time per document
+  first_request  opening a document not touched yet plus its first vector query,
+                 on a freshly started client (what a request for a cold document costs)
+  vector_query   vector query against an already open document
+  lexical_query  BM25 query restricted to the document
+
+and the on-disk footprint of each layout (Chroma plus BM25 files).
+
+Runs fully offline with the hashing embedding backend. Every per-document
+collection preallocates its index files, so 10k documents take several GB of
+temporary disk.
+
+    python benchmarks/storage_layout.py
+    python benchmarks/storage_layout.py --documents 20000 --shards 16
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from common import APP_DIR, compare_to_baseline, print_table, save_baseline, summarize_latencies  # noqa: E402
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def synthetic_documents(count: int, users: int, chunks_per_document: int, rng):
+    words = [f"term{i}" for i in range(5000)]
+    for i in range(count):
+        user_id = f"a{i % users:04x}"
+        document_id = f"b{i:06x}"
+        chunks = [" ".join(rng.choice(words, size=60)) + "." for _ in range(chunks_per_document)]
+        yield user_id, document_id, chunks
+
+
+def build(db_path: str, layout: str, documents, batch_documents: int = 200):
+    from ai.services.rag_service import VectorDBManager
+    from utils.storage import document_scope
+
+    durations = []
+    for offset in range(0, len(documents), batch_documents):
+        batch = documents[offset:offset + batch_documents]
+        started = time.perf_counter()
+        managers = [
+            VectorDBManager(db_path=db_path, scope=document_scope(user_id, document_id, layout=layout))
+            for user_id, document_id, _ in batch
+        ]
+        embeddings = managers[0].get_embedding([chunk for _, _, chunks in batch for chunk in chunks])
+        position = 0
+        for manager, (user_id, document_id, chunks) in zip(managers, batch):
+            ids, metadatas = manager.chunk_records(chunks, document_id=document_id, user_id=user_id)
+            manager.write_chunks(ids, chunks, embeddings[position:position + len(chunks)], metadatas)
+            position += len(chunks)
+        for manager in {manager.collection_name: manager for manager in managers}.values():
+            manager.lexical_index.save()
+        durations.append((time.perf_counter() - started) / len(batch))
+    return durations
+
+
+def measure(db_path: str, layout: str, sample, query: str):
+    import chromadb
+    from utils.registry import ResourceRegistry
+    from utils.storage import document_scope
+
+    chromadb.api.client.SharedSystemClient.clear_system_cache()
+    registry = ResourceRegistry(db_path=db_path)
+    query_embedding = registry.embedding.embed([query])
+    scopes = [document_scope(user_id, document_id, layout=layout) for user_id, document_id in sample]
+
+    def vector_query(scope):
+        registry.get_collection(scope.collection_name).query(
+            query_embeddings=query_embedding, n_results=5, where=scope.where, include=["documents", "distances"]
+        )
+
+    first_request, vector_queries, lexical_queries = [], [], []
+    for scope in scopes:
+        started = time.perf_counter()
+        vector_query(scope)
+        first_request.append(time.perf_counter() - started)
+    for scope in scopes:
+        started = time.perf_counter()
+        vector_query(scope)
+        vector_queries.append(time.perf_counter() - started)
+        groups = [scope.group] if scope.shared else None
+        started = time.perf_counter()
+        registry.get_lexical_index(scope.collection_name).search(query, k=5, groups=groups)
+        lexical_queries.append(time.perf_counter() - started)
+    return first_request, vector_queries, lexical_queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--chunks-per-document", type=int, default=4)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--sample", type=int, default=200, help="documents queried per layout")
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--save-baseline", nargs="?", const="default", default=None, metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="rag-storage-")
+    os.environ.update(
+        {
+            "EMBEDDING_BACKEND": "hashing",
+            "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "benchmark"),
+            "EMBEDDING_CACHE_ENABLED": "false",
+            "ANSWER_CACHE_ENABLED": "false",
+            "SHARED_COLLECTION_SHARDS": str(args.shards),
+            "LEXICAL_INDEX_ENABLED": "true",
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        }
+    )
+    sys.path.insert(0, APP_DIR)
+
+    rng = np.random.default_rng(0)
+    documents = list(synthetic_documents(args.documents, args.users, args.chunks_per_document, rng))
+    sample = [(user_id, document_id) for user_id, document_id, _ in random.Random(0).sample(documents, args.sample)]
+    query = "term1 term2 term3 term4 term5"
+
+    results = {}
+    footprint = {}
+    try:
+        for layout in ("per_document", "shared"):
+            db_path = os.path.join(work_dir, layout)
+            build_durations = build(db_path, layout, documents)
+            first_request, vector_queries, lexical_queries = measure(db_path, layout, sample, query)
+            results[f"{layout}.build"] = summarize_latencies(build_durations)
+            results[f"{layout}.first_request"] = summarize_latencies(first_request)
+            results[f"{layout}.vector_query"] = summarize_latencies(vector_queries)
+            results[f"{layout}.lexical_query"] = summarize_latencies(lexical_queries)
+            chroma_bytes = directory_size(db_path) - directory_size(os.path.join(db_path, "bm25"))
+            footprint[layout] = {
+                "collections": len(os.listdir(os.path.join(db_path, "bm25"))),
+                "chroma_mb": chroma_bytes / 2**20,
+                "bm25_mb": directory_size(os.path.join(db_path, "bm25")) / 2**20,
+            }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(
+        f"Storage layouts ({args.documents} documents, {args.users} users, {args.shards} shards)",
+        results,
+        ["count", "mean_ms", "p50_ms", "p95_ms", "p99_ms"],
+    )
+    print_table("Disk footprint", footprint, ["collections", "chroma_mb", "bm25_mb"])
+    ok = True
+    if args.baseline:
+        ok = compare_to_baseline("storage_layout", args.baseline, results, ["p50_ms", "p95_ms"], args.tolerance)
+    if args.save_baseline:
+        print(f"\nSaved baseline to {save_baseline('storage_layout', args.save_baseline, results)}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
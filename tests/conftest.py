@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# Settings are read at import time: run offline, with state in a throwaway directory.
+_work_dir = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+os.environ.setdefault("CHAT_DB_PATH", os.path.join(_work_dir, "chat_history.db"))
+os.environ.setdefault("CHROMA_DB_PATH", os.path.join(_work_dir, "chroma_db"))
+os.environ.setdefault("EMBEDDING_CACHE_ENABLED", "false")
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+os.environ.setdefault("INGEST_SPOOL_DIR", os.path.join(_work_dir, "ingest_spool"))
@@ -0,0 +1,44 @@
+from utils.answer_cache import SemanticAnswerCache
+
+
+def test_lookup_returns_similar_answers():
+    cache = SemanticAnswerCache(similarity=0.9, ttl_seconds=0)
+    cache.store("doc", "ask_ai", [1.0, 0.0], "answer")
+    assert cache.lookup("doc", "ask_ai", [0.99, 0.05]) == "answer"
+    assert cache.lookup("doc", "ask_ai", [0.0, 1.0]) is None
+    assert cache.lookup("doc", "summarize", [1.0, 0.0]) is None
+
+
+def test_store_drops_answers_generated_across_an_invalidation():
+    cache = SemanticAnswerCache(similarity=0.9, ttl_seconds=0)
+    generation = cache.generation("doc")
+    cache.invalidate("doc")
+    cache.store("doc", "ask_ai", [1.0, 0.0], "stale", generation=generation)
+    assert cache.lookup("doc", "ask_ai", [1.0, 0.0]) is None
+    assert cache.stats()["stale_stores"] == 1
+
+    cache.store("doc", "ask_ai", [1.0, 0.0], "fresh", generation=cache.generation("doc"))
+    assert cache.lookup("doc", "ask_ai", [1.0, 0.0]) == "fresh"
+    assert cache.generation("other") == cache.generation("another")
+
+
+def test_answers_are_not_shared_across_variants():
+    cache = SemanticAnswerCache(similarity=0.9, ttl_seconds=0)
+    cache.store("doc", ("ask_ai", "vector", "llama3"), [1.0, 0.0], "answer")
+    assert cache.lookup("doc", ("ask_ai", "vector", "llama3"), [1.0, 0.0]) == "answer"
+    assert cache.lookup("doc", ("ask_ai", "hybrid", "llama3"), [1.0, 0.0]) is None
+    assert cache.lookup("doc", ("ask_ai", "vector", "mistral"), [1.0, 0.0]) is None
+
+
+def test_generations_are_bounded_and_still_detect_invalidations():
+    cache = SemanticAnswerCache(similarity=0.9, ttl_seconds=0, max_collections=2)
+    generation = cache.generation("doc")
+    cache.invalidate("doc")
+    for name in ("a", "b", "c"):
+        cache.invalidate(name)
+    assert len(cache._generations) == 2
+
+    cache.store("doc", "ask_ai", [1.0, 0.0], "stale", generation=generation)
+    assert cache.lookup("doc", "ask_ai", [1.0, 0.0]) is None
+    cache.store("doc", "ask_ai", [1.0, 0.0], "fresh", generation=cache.generation("doc"))
+    assert cache.lookup("doc", "ask_ai", [1.0, 0.0]) == "fresh"
@@ -0,0 +1,135 @@
+import os
+
+from utils import bm25
+from utils.bm25 import BM25Index, reciprocal_rank_fusion
+
+
+def ids(hits):
+    return [chunk_id for chunk_id, _ in hits]
+
+
+def test_search_ranks_by_term_weight(tmp_path):
+    index = BM25Index(str(tmp_path / "index"))
+    index.add(["a", "b", "c"], ["sodium chloride", "chloride chloride ion", "water"])
+    assert ids(index.search("chloride")) == ["b", "a"]
+    assert index.search("nitrogen") == []
+
+
+def test_search_restricted_to_groups(tmp_path):
+    index = BM25Index(str(tmp_path / "index"))
+    index.add(["a", "b", "c"], ["salt water", "salt flats", "salt"], groups=["u1/d1", "u1/d2", "u2/d1"])
+    assert ids(index.search("salt", groups=["u1/d2"])) == ["b"]
+    assert sorted(ids(index.search("salt", groups=["u1/d1", "u2/d1"]))) == ["a", "c"]
+    assert index.search("salt", groups=["unknown"]) == []
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "index")
+    index = BM25Index(path)
+    index.add(["a", "b"], ["H2O is water", "NaCl is salt"], groups=["g1", "g2"])
+    index.save()
+    index.add(["c"], ["heavy water D2O"], groups=["g1"])
+    index.remove(["b"])
+    index.save()
+
+    loaded = BM25Index.load(path)
+    assert len(loaded) == 2
+    assert ids(loaded.search("h2o")) == ["a"]
+    assert sorted(ids(loaded.search("water"))) == ["a", "c"]
+    assert loaded.search("nacl") == []
+    assert ids(loaded.search("water", groups=["g1"])) == ids(index.search("water", groups=["g1"]))
+
+
+def test_unloaded_index_flushes_segments(tmp_path):
+    path = str(tmp_path / "index")
+    BM25Index(path).rebuild(["a"], ["alpha"])
+    index = BM25Index(path)
+    index.add(["b"], ["beta"])
+    index.save()
+    assert not index.loaded
+    assert not index.corpus.documents
+    assert sorted(ids(BM25Index.load(path).search("alpha beta"))) == ["a", "b"]
+
+
+def test_compaction_writes_a_new_base(tmp_path, monkeypatch):
+    monkeypatch.setattr(bm25, "COMPACT_MIN_CHANGES", 2)
+    path = str(tmp_path / "index")
+    index = BM25Index(path)
+    index.rebuild(["a"], ["alpha"])
+    index.add(["b"], ["beta"])
+    index.save()
+    assert sorted(os.listdir(path)) == ["00000001.base.npz", "00000002.npz"]
+    index.add(["c"], ["gamma"])
+    index.save()
+    assert os.listdir(path) == ["00000003.base.npz"]
+    assert len(BM25Index.load(path)) == 3
+
+
+def test_unsaved_changes_survive_loading(tmp_path):
+    path = str(tmp_path / "index")
+    BM25Index(path).rebuild(["a", "b"], ["alpha", "beta"])
+    index = BM25Index(path)
+    index.add(["c"], ["alpha gamma"])
+    index.remove(["b"])
+    assert sorted(ids(index.search("alpha beta gamma"))) == ["a", "c"]
+
+
+def test_search_sees_writes_after_first_search(tmp_path):
+    index = BM25Index(str(tmp_path / "index"))
+    index.add(["a"], ["alpha"])
+    assert ids(index.search("alpha")) == ["a"]
+    index.add(["b"], ["alpha beta"])
+    assert ids(index.search("beta")) == ["b"]
+
+
+def test_delete_removes_files(tmp_path):
+    path = str(tmp_path / "index")
+    index = BM25Index(path)
+    index.rebuild(["a"], ["alpha"])
+    BM25Index.delete(path)
+    assert not os.path.exists(path)
+    assert not BM25Index(path).exists
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60)
+    assert [chunk_id for chunk_id, _ in fused] == ["a", "c", "b"]
+    assert fused[0][1] == 1 / 61 + 1 / 62
+    assert reciprocal_rank_fusion([]) == []
+
+
+def test_backfill_on_first_load_without_base(tmp_path):
+    calls = []
+
+    def backfill():
+        calls.append(True)
+        # The collection: chunks ingested while indexing was off, and "c", also flushed to a segment below.
+        return ["a", "b", "c"], ["alpha", "beta", "alpha gamma"], ["g1", "g2", "g1"]
+
+    path = str(tmp_path / "index")
+    index = BM25Index(path, backfill=backfill)
+    index.add(["c"], ["alpha gamma"], groups=["g1"])
+    index.save()
+    index.add(["d"], ["delta"])
+    assert not calls
+    assert sorted(ids(index.search("alpha"))) == ["a", "c"]
+    assert ids(index.search("beta", groups=["g2"])) == ["b"]
+    assert calls == [True]
+    assert ids(index.search("delta")) == ["d"]
+    assert BM25Index(path, backfill=backfill).exists
+    assert len(BM25Index.load(path)) == 3
+    assert calls == [True]
+
+
+def test_unloaded_index_flushes_after_flush_after_chunks(tmp_path):
+    path = str(tmp_path / "index")
+    index = BM25Index(path, flush_after=2)
+    index.add(["a"], ["alpha"])
+    assert len(index.corpus.documents) == 1
+    index.add(["b"], ["beta"])
+    assert not index.corpus.documents
+    assert len(os.listdir(path)) == 1
+    assert sorted(ids(index.search("alpha beta"))) == ["a", "b"]
+    # Once loaded the index lives in memory and is only written by save().
+    index.add(["c", "d"], ["gamma", "delta"])
+    assert len(os.listdir(path)) == 1
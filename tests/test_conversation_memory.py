@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from ai.services.conversation_memory import ConversationMemory
+from utils import settings
+from utils.db_helper import add_message, get_messages_after, init_db, save_chat_summary
+
+
+@pytest.fixture(autouse=True)
+def chat_db():
+    init_db()
+
+
+def add_turns(user_id, count, start=0):
+    for turn in range(start, start + count):
+        add_message(user_id, "user", f"question {turn}", document_id="doc")
+        add_message(user_id, "assistant", f"answer {turn}", document_id="doc")
+    return [message["id"] for message in get_messages_after(user_id, "doc")]
+
+
+def test_history_sends_every_message_after_a_lagging_summary():
+    ids = add_turns("lagging", 8)
+    # The summary covers the first two turns; the update that would fold turns 2-3 has not run.
+    save_chat_summary("lagging", "doc", "Turns 0 and 1.", ids[3])
+    history = asyncio.run(ConversationMemory(mode="summary", recent_turns=2).history("lagging", "doc"))
+    assert history[0]["role"] == "system"
+    assert [message["content"] for message in history[1:3]] == ["question 2", "answer 2"]
+    assert len(history) == 1 + len(ids) - 4
+
+
+def test_history_falls_back_to_the_window_when_the_summary_is_too_far_behind(monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_HISTORY_MAX_MESSAGES", 6)
+    ids = add_turns("failing", 10)
+    save_chat_summary("failing", "doc", "Turn 0.", ids[1])
+    memory = ConversationMemory(mode="summary", recent_turns=2)
+    history = asyncio.run(memory.history("failing", "doc"))
+    assert all(message["role"] != "system" for message in history)
+    assert [message["content"] for message in history] == [
+        f"{kind} {turn}" for turn in (7, 8, 9) for kind in ("question", "answer")
+    ]
+    assert memory.fallbacks == 1
+
+
+def test_get_messages_after_limit_keeps_the_newest():
+    ids = add_turns("paged", 3)
+    newest = get_messages_after("paged", "doc", after_id=ids[0], limit=2)
+    assert [message["id"] for message in newest] == ids[-2:]
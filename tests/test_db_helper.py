@@ -0,0 +1,33 @@
+import pytest
+
+from utils.db_helper import add_message, get_chat_history_page, init_db
+
+
+@pytest.fixture(autouse=True)
+def chat_db():
+    init_db()
+
+
+def walk_pages(user_id, document_id, limit):
+    pages, before_id = [], None
+    while True:
+        page = get_chat_history_page(user_id, document_id, limit=limit, before_id=before_id)
+        pages.append([message["content"] for message in page["messages"]])
+        before_id = page["next_before_id"]
+        if before_id is None:
+            return pages
+
+
+def test_pages_walk_back_through_the_conversation_once():
+    for i in range(7):
+        add_message("paging", "user", f"message {i}", document_id="doc")
+        add_message("paging", "user", f"elsewhere {i}", document_id="other")
+    pages = walk_pages("paging", "doc", limit=3)
+    assert pages == [["message 4", "message 5", "message 6"], ["message 1", "message 2", "message 3"], ["message 0"]]
+
+
+def test_full_last_page_is_followed_by_an_empty_one():
+    for i in range(4):
+        add_message("paging-even", "user", f"message {i}", document_id="doc")
+    pages = walk_pages("paging-even", "doc", limit=2)
+    assert pages == [["message 2", "message 3"], ["message 0", "message 1"], []]
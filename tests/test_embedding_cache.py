@@ -0,0 +1,26 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from utils.embedding_cache import EmbeddingCache
+
+
+def test_lookup_of_more_keys_than_sqlite_binds_at_once(tmp_path):
+    cache = EmbeddingCache(path=str(tmp_path / "embeddings.db"), max_memory_items=10)
+    if hasattr(cache._conn, "setlimit"):
+        # Older SQLite builds allow only 999 variables per statement; hold this one to that.
+        cache._conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+    texts = [f"chunk {i}" for i in range(2500)]
+    computed = []
+
+    def compute(missing):
+        computed.extend(missing)
+        return [np.full(4, float(text.split()[1]), dtype=np.float32) for text in missing]
+
+    first = cache.get_or_compute("model", texts, compute)
+    # The memory tier holds 10 vectors, so the second pass is read from SQLite.
+    second = cache.get_or_compute("model", texts, pytest.fail)
+    assert len(computed) == 2500
+    assert [vector[0] for vector in second] == [vector[0] for vector in first] == list(range(2500))
+    assert cache.stats()["disk_hits"] >= 2490
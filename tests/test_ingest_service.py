@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from ai.services import ingest_service
+from ai.services.ingest_service import IngestJobQueue
+from utils.db_helper import create_ingest_job, get_ingest_job, init_db
+from utils.storage import document_scope
+
+
+class FakeManager:
+    scopes = []
+    fail = False
+
+    def __init__(self, scope):
+        self.scopes.append(scope)
+
+    def add_document_stream(self, blocks, document_id, user_id, skip_existing=False, on_progress=None):
+        for _ in blocks:
+            pass
+        if self.fail:
+            raise RuntimeError("embedding backend down")
+        return 3
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    init_db()
+    monkeypatch.setattr(ingest_service, "VectorDBManager", FakeManager)
+    FakeManager.scopes.clear()
+    return IngestJobQueue(spool_dir=str(tmp_path))
+
+
+def submit(queue, job_id, scope):
+    path = queue._spool(job_id, "Some text. More text.")
+    create_ingest_job(job_id, "a1", "b1", scope.collection_name, path, os.path.getsize(path))
+    return path
+
+
+def test_finished_job_removes_its_spool(queue, monkeypatch):
+    monkeypatch.setattr(FakeManager, "fail", False)
+    path = submit(queue, "job-done", document_scope("a1", "b1", layout="per_document"))
+    queue._run("job-done")
+    job = get_ingest_job("job-done")
+    assert job["status"] == "done"
+    assert job["chunks_done"] == 3
+    assert job["bytes_done"] == job["bytes_total"]
+    assert not os.path.exists(path)
+
+
+def test_failed_job_keeps_its_spool(queue, monkeypatch):
+    monkeypatch.setattr(FakeManager, "fail", True)
+    path = submit(queue, "job-failed", document_scope("a1", "b1", layout="per_document"))
+    queue._run("job-failed")
+    job = get_ingest_job("job-failed")
+    assert job["status"] == "failed"
+    assert "embedding backend down" in job["error"]
+    assert os.path.exists(path)
+
+
+def test_job_runs_in_the_collection_it_was_submitted_for(queue, monkeypatch):
+    monkeypatch.setattr(FakeManager, "fail", False)
+    scope = document_scope("a1", "b1", layout="shared")
+    submit(queue, "job-shared", scope)
+    queue._run("job-shared")
+    assert FakeManager.scopes == [scope]
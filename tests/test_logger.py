@@ -0,0 +1,34 @@
+import logging
+import queue
+
+from utils.logger import DeferredQueueHandler, JsonFormatter
+
+
+def _queued(log, *args, **kwargs):
+    records = queue.SimpleQueue()
+    logger = logging.getLogger("rag-tests.deferred")
+    logger.handlers = [DeferredQueueHandler(records)]
+    logger.propagate = False
+    log(logger, *args, **kwargs)
+    return records.get_nowait()
+
+
+def test_message_is_merged_on_the_callers_thread():
+    values = ["before"]
+    record = _queued(lambda logger: logger.warning("value %s", values))
+    values[0] = "after"
+    assert record.getMessage() == "value ['before']"
+    assert record.args is None
+
+
+def test_traceback_survives_without_exc_info():
+    def log(logger):
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            logger.exception("failed")
+
+    record = _queued(log)
+    assert record.exc_info is None
+    assert "RuntimeError: boom" in logging.Formatter().format(record)
+    assert "RuntimeError: boom" in JsonFormatter().format(record)
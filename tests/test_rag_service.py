@@ -0,0 +1,51 @@
+from collections import Counter
+
+import pytest
+
+from ai.services.rag_service import ChunkOccurrences, VectorDBManager
+from utils.storage import document_scope
+
+
+def test_chunk_position_prefers_chunk_index():
+    assert VectorDBManager.chunk_position("doc_b1_0123456789abcdef", {"chunk_index": 7}) == 7
+
+
+def test_chunk_position_of_legacy_ids_is_numeric():
+    ids = [f"doc_b1_chunk_{i}" for i in (10, 2, 1, 0)]
+    ordered = sorted(ids, key=lambda chunk_id: VectorDBManager.chunk_position(chunk_id, {"document_id": "b1"}))
+    assert ordered == ["doc_b1_chunk_0", "doc_b1_chunk_1", "doc_b1_chunk_2", "doc_b1_chunk_10"]
+    assert VectorDBManager.chunk_position("doc_a1_b1_chunk_12", None) == 12
+
+
+def test_chunk_position_unknown_fails_loudly():
+    with pytest.raises(ValueError):
+        VectorDBManager.chunk_position("doc_b1_0123456789abcdef", {"document_id": "b1"})
+
+
+def test_chunk_records_suffix_repeated_chunks_across_batches():
+    manager = VectorDBManager(scope=document_scope("a7", "b7", layout="per_document"))
+    occurrences = Counter()
+    first_ids, first_metadatas = manager.chunk_records(["same", "other"], "b7", "a7", occurrences=occurrences)
+    second_ids, second_metadatas = manager.chunk_records(
+        ["same", "same"], "b7", "a7", occurrences=occurrences, start_index=2
+    )
+    digest = VectorDBManager.chunk_hash("same")
+    assert first_ids[0] == f"doc_b7_{digest}"
+    assert second_ids == [f"doc_b7_{digest}_2", f"doc_b7_{digest}_3"]
+    assert len(set(first_ids + second_ids)) == 4
+    assert [metadata["chunk_index"] for metadata in first_metadatas + second_metadatas] == [0, 1, 2, 3]
+
+    # Re-ingesting the same content yields the same IDs.
+    again, _ = manager.chunk_records(["same", "other", "same", "same"], "b7", "a7")
+    assert again == first_ids + second_ids
+
+
+def test_chunk_occurrences_match_a_counter():
+    occurrences, expected = ChunkOccurrences(), Counter()
+    digests = [VectorDBManager.chunk_hash(str(i % 3000)) for i in range(5000)]
+    for digest in digests:
+        occurrences[digest] += 1
+        expected[digest] += 1
+        assert occurrences[digest] == expected[digest]
+    assert all(occurrences[digest] == expected[digest] for digest in set(digests))
+    assert occurrences[VectorDBManager.chunk_hash("unseen")] == 0
@@ -0,0 +1,40 @@
+import threading
+
+from utils import settings
+from utils.registry import ResourceRegistry
+
+
+def test_hashing_backend_needs_no_openai_key(monkeypatch, tmp_path):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(settings, "EMBEDDING_BACKEND", "hashing")
+    registry = ResourceRegistry(db_path=str(tmp_path))
+    vectors = registry.embedding.embed(["an offline sentence"])
+    assert len(vectors) == 1 and len(vectors[0]) == registry.embedding.dimension
+    assert registry.get_collection("offline_collection") is not None
+    assert registry._openai is None
+
+
+def test_opening_a_collection_does_not_block_other_lookups(tmp_path):
+    registry = ResourceRegistry(db_path=str(tmp_path))
+    client = registry.chroma_client
+    opening, release = threading.Event(), threading.Event()
+
+    class SlowClient:
+        def get_or_create_collection(self, name, **kwargs):
+            if name == "slow_collection":
+                opening.set()
+                assert release.wait(5)
+            return client.get_or_create_collection(name, **kwargs)
+
+    registry._chroma_client = SlowClient()
+    slow = threading.Thread(target=registry.get_collection, args=("slow_collection",))
+    slow.start()
+    try:
+        assert opening.wait(5)
+        assert registry.get_collection("fast_collection") is not None
+        assert registry.stats()["open_collections"] == 1
+    finally:
+        release.set()
+        slow.join()
+    assert registry.get_collection("slow_collection") is not None
+    assert registry.stats()["misses"] == 2
@@ -0,0 +1,60 @@
+import asyncio
+
+from utils import sse
+
+
+class FakeRequest:
+    def __init__(self, disconnect_after: float):
+        self.disconnect_after = disconnect_after
+        self.started = None
+
+    async def is_disconnected(self) -> bool:
+        now = asyncio.get_running_loop().time()
+        self.started = self.started or now
+        return now - self.started >= self.disconnect_after
+
+
+async def _collect(tokens, http_request, completed):
+    async def on_complete(answer):
+        completed.append(answer)
+
+    return [event async for event in sse.stream_events(tokens, http_request, on_complete=on_complete)]
+
+
+def test_disconnect_is_noticed_before_the_first_token(monkeypatch):
+    monkeypatch.setattr(sse, "DISCONNECT_POLL_INTERVAL", 0.01)
+    closed, completed = [], []
+
+    async def tokens():
+        try:
+            await asyncio.sleep(10)
+            yield "never"
+        finally:
+            closed.append(True)
+
+    events = asyncio.run(asyncio.wait_for(_collect(tokens(), FakeRequest(0.05), completed), timeout=2))
+    assert events == [] and closed == [True] and completed == []
+
+
+def test_completed_stream_reaches_on_complete():
+    completed = []
+
+    async def tokens():
+        for token in ("Hello", " world"):
+            yield token
+
+    events = asyncio.run(_collect(tokens(), FakeRequest(60), completed))
+    assert completed == ["Hello world"]
+    assert events[-1].startswith("event: done")
+
+
+def test_failed_stream_skips_on_complete():
+    completed = []
+
+    async def tokens():
+        yield "partial"
+        raise RuntimeError("model went away")
+
+    events = asyncio.run(_collect(tokens(), FakeRequest(60), completed))
+    assert completed == []
+    assert events[-1].startswith("event: error")
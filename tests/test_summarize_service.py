@@ -0,0 +1,28 @@
+import hashlib
+
+from ai.services.summarize_service import reduce_groups
+
+
+def keys(count, salt=""):
+    return [hashlib.sha256(f"{salt}{i}".encode()).hexdigest()[:16] for i in range(count)]
+
+
+def test_groups_cover_the_keys_in_order_within_bounds():
+    chunk_keys = keys(500)
+    groups = reduce_groups(chunk_keys, fanout=4)
+    assert [key for group in groups for key in group] == chunk_keys
+    assert all(2 <= len(group) <= 8 for group in groups[:-1])
+    assert 1 <= len(groups[-1]) <= 8
+
+
+def test_inserting_a_key_only_changes_the_groups_around_it():
+    chunk_keys = keys(500)
+    edited = chunk_keys[:250] + keys(1, salt="inserted") + chunk_keys[250:]
+    before = reduce_groups(chunk_keys, fanout=4)
+    after = reduce_groups(edited, fanout=4)
+    unchanged = {tuple(group) for group in before} & {tuple(group) for group in after}
+    assert len(before) - len(unchanged) <= 3
+
+
+def test_small_fanout_is_raised_to_two():
+    assert reduce_groups(keys(10), fanout=0) == reduce_groups(keys(10), fanout=2)
@@ -0,0 +1,42 @@
+import re
+
+import pytest
+
+from ai.services import translate_service
+from ai.services.translate_service import split_segments
+
+
+@pytest.fixture(autouse=True)
+def sentences(monkeypatch):
+    # A plain splitter stands in for punkt, which needs a download.
+    monkeypatch.setattr(translate_service, "ensure_nltk_resources", lambda: None)
+    monkeypatch.setattr(translate_service, "sent_tokenize", lambda text: re.split(r"(?<=[.!?])\s+", text.strip()))
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "One sentence.",
+        "First one.  Second one!\nThird line?",
+        "\n\n  Indented paragraph. Another.\r\n\r\n\tTabbed one.   \n",
+        "No terminal punctuation",
+        "",
+    ],
+)
+def test_segments_reassemble_to_the_text(text):
+    pieces = split_segments(text)
+    assert "".join(piece for piece, _ in pieces) == text
+    assert all(piece.strip() for piece, translatable in pieces if translatable)
+    assert not any(piece.strip() for piece, translatable in pieces if not translatable)
+
+
+def test_sentences_are_separate_segments():
+    pieces = split_segments("First one.  Second one!\nThird line?")
+    assert [piece for piece, translatable in pieces if translatable] == ["First one.", "Second one!", "Third line?"]
+
+
+def test_altered_sentence_keeps_the_rest_of_the_paragraph(monkeypatch):
+    monkeypatch.setattr(translate_service, "sent_tokenize", lambda text: ["First one.", "SECOND ONE."])
+    pieces = split_segments("First one. Second one. Third one.")
+    assert pieces == [("First one.", True), (" Second one. Third one.", True)]
+    assert "".join(piece for piece, _ in pieces) == "First one. Second one. Third one."
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import pytest
+
+from ai.services import rag_service
+from ai.services.rag_service import VectorDBManager
+from ai.services.user_search_service import UserDocumentsManager
+from utils.answer_cache import SemanticAnswerCache
+from utils.db_helper import init_db
+from utils.storage import document_scope
+
+
+@pytest.fixture(scope="module")
+def documents():
+    init_db()
+    ingested = [
+        ("a1", "b1", "per_document", "Photosynthesis turns light into chemical energy in plants."),
+        ("a1", "b2", "shared", "The mitochondria is the powerhouse of the cell."),
+        ("a2", "b3", "shared", "Secret notes of another user about plants and cells."),
+    ]
+    with pytest.MonkeyPatch.context() as patch:
+        # One sentence per document; keeps the tests clear of the punkt download.
+        patch.setattr(rag_service, "ensure_nltk_resources", lambda: None)
+        patch.setattr(rag_service, "sent_tokenize", lambda content: [content.strip()])
+        for user_id, document_id, layout, text in ingested:
+            manager = VectorDBManager(scope=document_scope(user_id, document_id, layout=layout))
+            manager.add_document_stream([text], document_id=document_id, user_id=user_id)
+
+
+def test_user_manager_covers_both_layouts_and_only_the_user(documents):
+    manager = UserDocumentsManager.for_user("a1")
+    targets = dict(manager.query_targets())
+    assert len(targets) == 2
+    assert {"user_id": "a1"} in targets.values() and None in targets.values()
+
+    context = asyncio.run(manager.aretrieve_context("plants and cells")).text
+    assert "Photosynthesis" in context and "mitochondria" in context
+    assert "Secret" not in context
+
+
+def test_user_manager_rejects_other_retrieval_modes(documents):
+    manager = UserDocumentsManager.for_user("a1")
+    with pytest.raises(ValueError):
+        asyncio.run(manager.aretrieve_context("plants", mode="hybrid"))
+
+
+def test_user_manager_without_documents():
+    init_db()
+    assert UserDocumentsManager.for_user("fff") is None
+
+
+def test_uncached_answer_embeds_the_query_once(documents, monkeypatch):
+    manager = UserDocumentsManager.for_user("a1")
+    monkeypatch.setattr(manager.registry, "_answer_cache", SemanticAnswerCache())
+    calls = []
+    embed = manager.get_embedding
+    monkeypatch.setattr(manager, "get_embedding", lambda content: calls.append(content) or embed(content))
+
+    async def generate(**kwargs):
+        return json.dumps({"answer": "Plants and cells."})
+
+    monkeypatch.setattr(manager.ollama_client, "agenerate_response", generate)
+    assert asyncio.run(manager.answer_query_base("how do plants store energy?")) == "Plants and cells."
+    assert calls == [["how do plants store energy?"]]
+
+
+def test_collections_of_another_embedding_backend_are_refused(documents):
+    manager = UserDocumentsManager.for_user("a1")
+    manager.registry.chroma_client.create_collection(
+        "other_backend", metadata={"embedding_backend": "ollama:other", "embedding_dimension": 3}
+    )
+    mixed = UserDocumentsManager("a1", [("b1", manager.scopes[0].collection_name), ("b4", "other_backend")])
+    with pytest.raises(ValueError):
+        asyncio.run(mixed.aretrieve_context("plants"))
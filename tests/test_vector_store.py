@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from utils.vector_store import dequantize, quantize, truncate
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    return truncate(rng.normal(size=(64, 128)), 128)
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 0.0), ("float16", 1e-3), ("int8", 1e-2)])
+def test_round_trip_stays_close(vectors, dtype, tolerance):
+    codes, scales = quantize(vectors, dtype)
+    assert codes.dtype == np.dtype(dtype)
+    restored = dequantize(codes, scales)
+    assert restored.dtype == np.float32
+    assert np.abs(restored - vectors).max() <= tolerance
+
+
+def test_int8_uses_the_full_range_per_row(vectors):
+    codes, scales = quantize(vectors, "int8")
+    assert scales.shape == (len(vectors),)
+    assert (np.abs(codes).max(axis=1) == 127).all()
+
+
+def test_int8_zero_row_does_not_divide_by_zero():
+    codes, scales = quantize(np.zeros((1, 8), dtype=np.float32), "int8")
+    assert not codes.any() and np.isfinite(scales).all()
+    assert not dequantize(codes, scales).any()
+
+
+def test_truncate_renormalises_and_rejects_missing_dimensions(vectors):
+    short = truncate(vectors, 32)
+    assert short.shape == (64, 32)
+    assert np.allclose(np.linalg.norm(short, axis=1), 1.0, atol=1e-6)
+    with pytest.raises(ValueError):
+        truncate(vectors, 256)